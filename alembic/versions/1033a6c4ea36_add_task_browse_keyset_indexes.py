@@ -0,0 +1,62 @@
+"""add task browse keyset indexes
+
+Revision ID: 1033a6c4ea36
+Revises: 2b8b1e0a6f4c
+Create Date: 2018-12-17 09:12:44.580613
+
+The tasks browse view seeks the priority and created orders by null-safe
+expressions (see task_browse_helpers.keyset_fields). These indexes match
+them, so every cursor page is a range scan.
+
+The indexes are built concurrently, outside of the migration transaction.
+Nothing is done twice, so a failed run can be started again.
+"""
+
+# revision identifiers, used by Alembic.
+revision = '1033a6c4ea36'
+down_revision = '2b8b1e0a6f4c'
+
+from alembic import context, op
+import sqlalchemy as sa
+
+
+INDEXES = [
+    ('task_project_id_priority_0_keyset_idx', 'task',
+     '(project_id, (priority_0 IS NULL), (COALESCE(priority_0, 0)), id)'),
+    ('task_project_id_created_keyset_idx', 'task',
+     "(project_id, (created IS NULL), (COALESCE(created, '')), id)"),
+]
+
+
+def upgrade():
+    if context.is_offline_mode():
+        for name, table, columns in INDEXES:
+            op.execute('CREATE INDEX IF NOT EXISTS {0} ON {1} {2}'
+                       .format(name, table, columns))
+        return
+
+    op.execute('COMMIT')
+    engine = op.get_bind().engine
+    conn = engine.connect().execution_options(isolation_level='AUTOCOMMIT')
+    try:
+        for name, table, columns in INDEXES:
+            drop_invalid_index(conn, name)
+            conn.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS {0} ON {1} {2}'
+                         .format(name, table, columns))
+    finally:
+        conn.close()
+
+
+def drop_invalid_index(conn, name):
+    """Drop the index left by a failed concurrent build, which IF NOT EXISTS
+    would keep."""
+    invalid = conn.execute(sa.text('''
+        SELECT 1 FROM pg_index JOIN pg_class ON pg_class.oid = indexrelid
+        WHERE relname = :name AND NOT indisvalid'''), name=name).scalar()
+    if invalid:
+        conn.execute('DROP INDEX CONCURRENTLY IF EXISTS {0}'.format(name))
+
+
+def downgrade():
+    for name, table, columns in INDEXES:
+        op.execute('DROP INDEX IF EXISTS {0}'.format(name))
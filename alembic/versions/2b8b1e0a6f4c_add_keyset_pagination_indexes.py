@@ -0,0 +1,80 @@
+"""add keyset pagination indexes
+
+Revision ID: 2b8b1e0a6f4c
+Revises: 964f03899a7a
+Create Date: 2018-12-14 10:22:05.143817
+
+The API cursor pages through the items of a project by (orderby, id). These
+indexes end with id so that every page is a range scan. The ones on the
+timestamp shadow columns replace the (project_id, <column>_ts) indexes.
+
+The indexes are built and dropped concurrently, outside of the migration
+transaction. Nothing is done twice, so a failed run can be started again.
+"""
+
+# revision identifiers, used by Alembic.
+revision = '2b8b1e0a6f4c'
+down_revision = '964f03899a7a'
+
+from alembic import context, op
+import sqlalchemy as sa
+
+
+INDEXES = [
+    ('task_project_id_id_idx', 'task', '(project_id, id)'),
+    ('task_project_id_created_ts_id_idx', 'task',
+     '(project_id, created_ts, id)'),
+    ('task_run_project_id_id_idx', 'task_run', '(project_id, id)'),
+    ('task_run_project_id_created_ts_id_idx', 'task_run',
+     '(project_id, created_ts, id)'),
+    ('task_run_project_id_finish_time_ts_id_idx', 'task_run',
+     '(project_id, finish_time_ts, id)'),
+    ('result_project_id_id_idx', 'result', '(project_id, id)'),
+]
+
+REPLACED = [
+    ('task_project_id_created_ts_idx', 'task', '(project_id, created_ts)'),
+    ('task_run_project_id_finish_time_ts_idx', 'task_run',
+     '(project_id, finish_time_ts)'),
+]
+
+
+def upgrade():
+    create_and_drop(INDEXES, REPLACED)
+
+
+def downgrade():
+    create_and_drop(REPLACED, INDEXES)
+
+
+def create_and_drop(create, drop):
+    if context.is_offline_mode():
+        for name, table, columns in create:
+            op.execute('CREATE INDEX IF NOT EXISTS {0} ON {1} {2}'
+                       .format(name, table, columns))
+        for name, table, columns in drop:
+            op.execute('DROP INDEX IF EXISTS {0}'.format(name))
+        return
+
+    op.execute('COMMIT')
+    engine = op.get_bind().engine
+    conn = engine.connect().execution_options(isolation_level='AUTOCOMMIT')
+    try:
+        for name, table, columns in create:
+            drop_invalid_index(conn, name)
+            conn.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS {0} ON {1} {2}'
+                         .format(name, table, columns))
+        for name, table, columns in drop:
+            conn.execute('DROP INDEX CONCURRENTLY IF EXISTS {0}'.format(name))
+    finally:
+        conn.close()
+
+
+def drop_invalid_index(conn, name):
+    """Drop the index left by a failed concurrent build, which IF NOT EXISTS
+    would keep."""
+    invalid = conn.execute(sa.text('''
+        SELECT 1 FROM pg_index JOIN pg_class ON pg_class.oid = indexrelid
+        WHERE relname = :name AND NOT indisvalid'''), name=name).scalar()
+    if invalid:
+        conn.execute('DROP INDEX CONCURRENTLY IF EXISTS {0}'.format(name))
@@ -0,0 +1,43 @@
+"""add task_stats table
+
+Revision ID: 38adb2b7ff7e
+Revises: 1fbe9ac7de05
+Create Date: 2018-12-03 10:12:31.204718
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '38adb2b7ff7e'
+down_revision = '1fbe9ac7de05'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('task_stats',
+                    sa.Column('task_id', sa.Integer,
+                              sa.ForeignKey('task.id', ondelete='CASCADE'),
+                              primary_key=True),
+                    sa.Column('project_id', sa.Integer,
+                              sa.ForeignKey('project.id', ondelete='CASCADE'),
+                              nullable=False),
+                    sa.Column('n_task_runs', sa.Integer, default=0,
+                              nullable=False),
+                    sa.Column('last_finish_time', sa.Text),
+                    )
+    op.create_index('task_stats_project_id_idx', 'task_stats', ['project_id'])
+    op.execute('''
+               INSERT INTO task_stats
+               (task_id, project_id, n_task_runs, last_finish_time)
+               SELECT task.id, task.project_id, coalesce(ct, 0), ft
+               FROM task LEFT OUTER JOIN
+               (SELECT task_id, COUNT(id) AS ct, MAX(finish_time) AS ft
+               FROM task_run GROUP BY task_id) AS log_counts
+               ON task.id=log_counts.task_id;
+               ''')
+
+
+def downgrade():
+    op.drop_index('task_stats_project_id_idx', 'task_stats')
+    op.drop_table('task_stats')
@@ -0,0 +1,75 @@
+"""add timestamp shadow columns
+
+Revision ID: 7525a09bb4dc
+Revises: 38adb2b7ff7e
+Create Date: 2018-12-10 09:41:27.318562
+
+The created and finish_time columns are Text. This adds TIMESTAMPTZ copies
+(<column>_ts) kept in sync by triggers, so time range queries can use
+indexes instead of parsing every row.
+
+Only the columns and triggers are added here, in the migration
+transaction. The existing rows are backfilled and indexed by the next
+migration.
+"""
+
+# revision identifiers, used by Alembic.
+revision = '7525a09bb4dc'
+down_revision = '38adb2b7ff7e'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+SHADOWS = [('project', ['created']),
+           ('task', ['created']),
+           ('task_run', ['created', 'finish_time'])]
+
+# Recreated with the new columns by the dashboard jobs.
+DASHBOARD_VIEWS = ['dashboard_week_users', 'dashboard_week_anon',
+                   'dashboard_week_project_draft', 'dashboard_week_new_task',
+                   'dashboard_week_new_task_run',
+                   'dashboard_week_returning_users']
+
+
+def upgrade():
+    op.execute('''
+               CREATE OR REPLACE FUNCTION text_to_timestamptz(value TEXT)
+               RETURNS TIMESTAMPTZ AS $$
+                   SELECT NULLIF(value, '')::TIMESTAMP AT TIME ZONE 'UTC'
+               $$ LANGUAGE sql STABLE;
+               ''')
+    for table, columns in SHADOWS:
+        for column in columns:
+            op.add_column(table, sa.Column(column + '_ts',
+                                           sa.TIMESTAMP(timezone=True)))
+        assignments = ' '.join('NEW.{0}_ts := text_to_timestamptz(NEW.{0});'
+                               .format(column) for column in columns)
+        op.execute('''
+                   CREATE OR REPLACE FUNCTION {0}_timestamps()
+                   RETURNS TRIGGER AS $$
+                   BEGIN
+                       {1}
+                       RETURN NEW;
+                   END;
+                   $$ LANGUAGE plpgsql;
+                   '''.format(table, assignments))
+        op.execute('''
+                   CREATE TRIGGER {0}_timestamps
+                   BEFORE INSERT OR UPDATE OF {1} ON {0}
+                   FOR EACH ROW EXECUTE PROCEDURE {0}_timestamps();
+                   '''.format(table, ', '.join(columns)))
+    for view in DASHBOARD_VIEWS:
+        op.execute('DROP MATERIALIZED VIEW IF EXISTS {0}'.format(view))
+
+
+def downgrade():
+    for view in DASHBOARD_VIEWS:
+        op.execute('DROP MATERIALIZED VIEW IF EXISTS {0}'.format(view))
+    for table, columns in SHADOWS:
+        op.execute('DROP TRIGGER IF EXISTS {0}_timestamps ON {0}'
+                   .format(table))
+        op.execute('DROP FUNCTION IF EXISTS {0}_timestamps()'.format(table))
+        for column in columns:
+            op.drop_column(table, column + '_ts')
+    op.execute('DROP FUNCTION IF EXISTS text_to_timestamptz(TEXT)')
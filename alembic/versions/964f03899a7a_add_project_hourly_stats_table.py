@@ -0,0 +1,49 @@
+"""add project_hourly_stats table
+
+Revision ID: 964f03899a7a
+Revises: d41f6c2b8e07
+Create Date: 2018-12-12 11:03:52.470912
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '964f03899a7a'
+down_revision = 'd41f6c2b8e07'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('project_hourly_stats',
+                    sa.Column('id', sa.Integer, primary_key=True),
+                    sa.Column('project_id', sa.Integer,
+                              sa.ForeignKey('project.id', ondelete='CASCADE'),
+                              nullable=False),
+                    sa.Column('hour', sa.DateTime, nullable=False),
+                    sa.Column('user_id', sa.Integer),
+                    sa.Column('user_ip', sa.Text),
+                    sa.Column('n_task_runs', sa.Integer, default=0,
+                              nullable=False),
+                    )
+    op.execute('''
+               INSERT INTO project_hourly_stats
+               (project_id, hour, user_id, user_ip, n_task_runs)
+               SELECT project_id,
+               date_trunc('hour', finish_time_ts AT TIME ZONE 'UTC'),
+               user_id, user_ip, COUNT(id)
+               FROM task_run WHERE finish_time_ts IS NOT NULL
+               GROUP BY 1, 2, 3, 4;
+               ''')
+    op.execute('''
+               CREATE UNIQUE INDEX project_hourly_stats_contributor_idx
+               ON project_hourly_stats (project_id, hour,
+                                        COALESCE(user_id, 0),
+                                        COALESCE(user_ip, ''));
+               ''')
+
+
+def downgrade():
+    op.drop_index('project_hourly_stats_contributor_idx',
+                  'project_hourly_stats')
+    op.drop_table('project_hourly_stats')
@@ -0,0 +1,119 @@
+"""backfill timestamp shadow columns
+
+Revision ID: d41f6c2b8e07
+Revises: 7525a09bb4dc
+Create Date: 2018-12-10 10:15:42.906214
+
+Fill the <column>_ts copies of the existing rows and build their indexes.
+The triggers already fill the new rows.
+
+Every statement commits on its own: the backfill runs in batches of
+BATCH_SIZE rows and the indexes are built concurrently, so writers are not
+locked out. Nothing is done twice, so a failed run can be started again.
+
+Rows whose timestamp cannot be parsed, like the old "/Date(...)/" task
+dates (see cli.py fix_task_date), keep an empty copy and are logged.
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'd41f6c2b8e07'
+down_revision = '7525a09bb4dc'
+
+import logging
+
+from alembic import context, op
+import sqlalchemy as sa
+from sqlalchemy.exc import DataError
+
+
+BATCH_SIZE = 10000
+
+SHADOWS = [('project', ['created']),
+           ('task', ['created']),
+           ('task_run', ['created', 'finish_time'])]
+
+INDEXES = [
+    ('task_run_project_id_finish_time_ts_idx', 'task_run',
+     '(project_id, finish_time_ts)'),
+    ('task_run_finish_time_ts_brin_idx', 'task_run',
+     'USING BRIN (finish_time_ts)'),
+    ('task_project_id_created_ts_idx', 'task', '(project_id, created_ts)'),
+    ('task_created_ts_brin_idx', 'task', 'USING BRIN (created_ts)'),
+]
+
+log = logging.getLogger('alembic.runtime.migration')
+
+
+def upgrade():
+    if context.is_offline_mode():
+        for table, columns in SHADOWS:
+            op.execute(backfill_sql(table, columns))
+        for name, table, columns in INDEXES:
+            op.execute('CREATE INDEX IF NOT EXISTS {0} ON {1} {2}'
+                       .format(name, table, columns))
+        return
+
+    # Commit the previous migrations, whose ALTER TABLE locks would block
+    # the connection below.
+    op.execute('COMMIT')
+    engine = op.get_bind().engine
+    conn = engine.connect().execution_options(isolation_level='AUTOCOMMIT')
+    try:
+        for table, columns in SHADOWS:
+            backfill(conn, table, columns)
+        for name, table, columns in INDEXES:
+            drop_invalid_index(conn, name)
+            conn.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS {0} ON {1} {2}'
+                         .format(name, table, columns))
+    finally:
+        conn.close()
+
+
+def backfill(conn, table, columns):
+    max_id = conn.execute('SELECT MAX(id) FROM {0}'.format(table)).scalar() or 0
+    sql = sa.text(backfill_sql(table, columns) +
+                  ' AND id >= :start AND id < :end')
+    row_sql = sa.text(backfill_sql(table, columns) + ' AND id = :id')
+    ids_sql = sa.text('SELECT id FROM {0} WHERE ({1}) AND id >= :start '
+                      'AND id < :end'.format(table, missing_sql(columns)))
+    for start in xrange(0, max_id + 1, BATCH_SIZE):
+        try:
+            conn.execute(sql, start=start, end=start + BATCH_SIZE)
+        except DataError:
+            # Some row of the batch is not a timestamp: fill the others one
+            # by one.
+            ids = [row.id for row in conn.execute(ids_sql, start=start,
+                                                  end=start + BATCH_SIZE)]
+            for id_ in ids:
+                try:
+                    conn.execute(row_sql, id=id_)
+                except DataError:
+                    log.warning('%s %s: invalid timestamp, not backfilled',
+                                table, id_)
+
+
+def backfill_sql(table, columns):
+    assignments = ', '.join('{0}_ts = text_to_timestamptz({0})'.format(column)
+                            for column in columns)
+    return 'UPDATE {0} SET {1} WHERE ({2})'.format(table, assignments,
+                                                  missing_sql(columns))
+
+
+def missing_sql(columns):
+    return ' OR '.join('({0}_ts IS NULL AND {0} IS NOT NULL)'.format(column)
+                       for column in columns)
+
+
+def drop_invalid_index(conn, name):
+    """Drop the index left by a failed concurrent build, which IF NOT EXISTS
+    would keep."""
+    invalid = conn.execute(sa.text('''
+        SELECT 1 FROM pg_index JOIN pg_class ON pg_class.oid = indexrelid
+        WHERE relname = :name AND NOT indisvalid'''), name=name).scalar()
+    if invalid:
+        conn.execute('DROP INDEX CONCURRENTLY IF EXISTS {0}'.format(name))
+
+
+def downgrade():
+    for name, table, columns in INDEXES:
+        op.execute('DROP INDEX IF EXISTS {0}'.format(name))
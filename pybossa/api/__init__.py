@@ -62,9 +62,13 @@ from token import TokenAPI
 from result import ResultAPI
 from project_stats import ProjectStatsAPI
 from helpingmaterial import HelpingMaterialAPI
-from pybossa.core import project_repo, task_repo
+from pybossa.core import project_repo, task_repo, result_repo
 from pybossa.contributions_guard import ContributionsGuard
-from pybossa.auth import jwt_authorize_project
+from pybossa.auth import jwt_authorize_project, ensure_authorized_to
+from pybossa.model.task import Task
+from pybossa.model.task_run import TaskRun
+from pybossa.model.result import Result
+from pybossa.api.ndjson import ndjson_response, parse_since, parse_since_id
 from werkzeug.exceptions import MethodNotAllowed, Forbidden
 from completed_task import CompletedTaskAPI
 from completed_task_run import CompletedTaskRunAPI
@@ -400,3 +404,85 @@ def fetch_lock(task_id):
                       'expires': seconds_to_expire})
 
     return Response(res, 200, mimetype='application/json')
+
+
+def _ndjson_project(project_id, model_class):
+    """Return the project, if the user can read it and its items of
+    model_class."""
+    project = project_repo.get(project_id)
+    if project is None:
+        raise NotFound
+    ensure_authorized_to('read', project)
+    ensure_authorized_to('read', model_class(project_id=project.id))
+    return project
+
+
+def _ndjson_export(project, stream, serialize):
+    """Return the items of the project as newline-delimited JSON."""
+    items = stream(project_id=project.id,
+                   since_id=parse_since_id(request.args.get('since_id')),
+                   since=parse_since(request.args.get('since')),
+                   yield_per=current_app.config.get('NDJSON_YIELD_PER'))
+    return ndjson_response(items, serialize)
+
+
+@blueprint.route('/project/<int:project_id>/tasks.ndjson')
+@ratelimit(limit=ratelimits.get('LIMIT'), per=ratelimits.get('PER'))
+def project_tasks_ndjson(project_id):
+    """Stream the tasks of a project, one JSON object per line.
+
+    since_id and since (a timestamp) only return the tasks created after
+    them, in id order.
+    """
+    try:
+        project = _ndjson_project(project_id, Task)
+        if not (current_user.admin or current_user.subadmin):
+            pwd_manager = get_pwd_manager(project)
+            if pwd_manager.password_needed(project, get_user_id_or_ip()):
+                raise Forbidden('Forbidden')
+        gold = current_user.admin or (current_user.subadmin and
+                                      current_user.id in project.owners_ids)
+
+        def serialize(task):
+            data = task.dictize()
+            if not gold:
+                data.pop('gold_answers', None)
+                data.pop('calibration', None)
+            return data
+
+        return _ndjson_export(project, task_repo.stream_tasks_by, serialize)
+    except Exception as e:
+        return error.format_exception(e, target='task', action='GET')
+
+
+@blueprint.route('/project/<int:project_id>/taskruns.ndjson')
+@ratelimit(limit=ratelimits.get('LIMIT'), per=ratelimits.get('PER'))
+def project_taskruns_ndjson(project_id):
+    """Stream the task runs of a project, one JSON object per line.
+
+    since_id and since (a timestamp) only return the task runs finished
+    after them, in id order.
+    """
+    try:
+        project = _ndjson_project(project_id, TaskRun)
+        return _ndjson_export(project, task_repo.stream_task_runs_by,
+                              lambda taskrun: taskrun.dictize())
+    except Exception as e:
+        return error.format_exception(e, target='taskrun', action='GET')
+
+
+@blueprint.route('/project/<int:project_id>/results.ndjson')
+@ratelimit(limit=ratelimits.get('LIMIT'), per=ratelimits.get('PER'))
+def project_results_ndjson(project_id):
+    """Stream the last version of the results of a project, one JSON
+    object per line.
+
+    since_id and since (a timestamp) only return the results created after
+    them, in id order.
+    """
+    try:
+        project = _ndjson_project(project_id, Result)
+        return _ndjson_export(project, result_repo.stream_by,
+                              lambda result: result.dictize())
+    except Exception as e:
+        return error.format_exception(e, target='result', action='GET')
@@ -26,16 +26,18 @@ This package adds GET, POST, PUT and DELETE methods for any class:
     * etc.
 
 """
+import base64
 import json
+from collections import defaultdict
 from flask import request, abort, Response, current_app
 from flask.ext.login import current_user
 from flask.views import MethodView
-from werkzeug.exceptions import NotFound, Unauthorized, Forbidden, BadRequest
+from werkzeug.exceptions import NotFound, Forbidden, BadRequest
 from werkzeug.exceptions import MethodNotAllowed
 from pybossa.util import jsonpify, fuzzyboolean, get_avatar_url
 from pybossa.util import get_user_id_or_ip
 from pybossa.core import ratelimits, uploader
-from pybossa.auth import ensure_authorized_to
+from pybossa.auth import ensure_authorized_to, is_authorized_many
 from pybossa.hateoas import Hateoas
 from pybossa.ratelimit import ratelimit
 from pybossa.error import ErrorStatus
@@ -79,11 +81,37 @@ repos = {'Task': {'repo': task_repo, 'filter': 'filter_tasks_by',
 caching = {'Project': {'refresh': clean_project},
            'User': {'refresh': delete_user_summary_id}}
 
+# Orders other than id that a cursor can seek through the items of one
+# project, with an index on (project_id, <order>, id).
+cursor_orders = {'Task': ['created'],
+                 'TaskRun': ['created', 'finish_time']}
+
 cors_headers = ['Content-Type', 'Authorization']
 
 error = ErrorStatus()
 
 
+def encode_cursor(orderby, descending, nulls, value, last_id):
+    """Return the opaque token of a keyset, see Repository._filter_by."""
+    if hasattr(value, 'isoformat'):
+        value = value.isoformat()
+    return base64.urlsafe_b64encode(json.dumps([orderby, descending, nulls,
+                                                value, last_id]))
+
+
+def decode_cursor(cursor):
+    """Return (orderby, descending, nulls, value, last_id) of a token, or
+    None for the empty one, which starts a listing."""
+    if not cursor:
+        return None
+    try:
+        orderby, descending, nulls, value, last_id = json.loads(
+            base64.urlsafe_b64decode(str(cursor)))
+    except (TypeError, ValueError):
+        raise BadRequest('Invalid cursor')
+    return orderby, descending, nulls, value, last_id
+
+
 class APIBase(MethodView):
 
     """Class to create CRUD methods."""
@@ -94,6 +122,8 @@ class APIBase(MethodView):
 
     immutable_keys = set([])
 
+    next_cursor = None
+
     def refresh_cache(self, cls_name, oid):
         """Refresh the cache."""
         if caching.get(cls_name):
@@ -126,7 +156,10 @@ class APIBase(MethodView):
             ensure_authorized_to('read', self.__class__)
             query = self._db_query(oid)
             json_response = self._create_json_response(query, oid)
-            return Response(json_response, mimetype='application/json')
+            response = Response(json_response, mimetype='application/json')
+            if self.next_cursor:
+                response.headers['X-Next-Cursor'] = self.next_cursor
+            return response
         except Exception as e:
             return error.format_exception(
                 e,
@@ -136,34 +169,36 @@ class APIBase(MethodView):
     def _create_json_response(self, query_result, oid):
         if len(query_result) == 1 and query_result[0] is None:
             raise abort(404)
-        items = []
+        results = []
         for result in query_result:
             # This is for n_favs orderby case
             if not isinstance(result, DomainObject):
                 if 'n_favs' in result.keys():
                     result = result[0]
-            try:
-                if (result.__class__ != self.__class__):
-                    (item, headline, rank) = result
-                else:
-                    item = result
-                    headline = None
-                    rank = None
-                if not self._verify_auth(item):
-                    continue
-                datum = self._create_dict_from_model(item)
-                if headline:
-                    datum['headline'] = headline
-                if rank:
-                    datum['rank'] = rank
-                ensure_authorized_to('read', item)
-                items.append(datum)
-            except (Forbidden, Unauthorized):
-                # Remove last added item, as it is 401 or 403
-                if len(items) > 0:
-                    items.pop()
-            except Exception:  # pragma: no cover
-                raise
+            if (result.__class__ != self.__class__):
+                results.append(result)
+            else:
+                results.append((result, None, None))
+        objects = [item for item, _, _ in results]
+        verified = self._verify_auth_many(objects)
+        authorized = is_authorized_many(current_user, 'read', objects)
+        related = None
+        if request.args.get('related'):
+            related = self._load_related(
+                [item for item, ok, can_read in zip(objects, verified,
+                                                    authorized)
+                 if ok and can_read])
+        items = []
+        for (item, headline, rank), ok, can_read in zip(results, verified,
+                                                         authorized):
+            if not (ok and can_read):
+                continue
+            datum = self._create_dict_from_model(item, related)
+            if headline:
+                datum['headline'] = headline
+            if rank:
+                datum['rank'] = rank
+            items.append(datum)
         if oid is not None:
             if not items:
                 raise Forbidden('Forbidden')
@@ -172,41 +207,57 @@ class APIBase(MethodView):
             items = items[0]
         return json.dumps(items)
 
-    def _create_dict_from_model(self, model):
-        return self._select_attributes(self._add_hateoas_links(model))
-
-    def _add_hateoas_links(self, item):
+    def _create_dict_from_model(self, model, related=None):
+        return self._select_attributes(self._add_hateoas_links(model,
+                                                               related))
+
+    def _load_related(self, items):
+        """Return the task runs, tasks and results related to items, read
+        with one query per relation and grouped by task id."""
+        cls_name = self.__class__.__name__
+        if cls_name == 'Task':
+            task_ids = set(item.id for item in items)
+        elif cls_name in ('TaskRun', 'Result'):
+            task_ids = set(item.task_id for item in items)
+        else:
+            return None
+        related = dict(task_runs=defaultdict(list), tasks=dict(),
+                       results=dict())
+        if cls_name in ('Task', 'Result'):
+            limit = current_app.config.get('API_RELATED_TASK_RUNS_LIMIT')
+            for task_run in task_repo.get_task_runs_by_task_ids(list(task_ids),
+                                                                limit):
+                related['task_runs'][task_run.task_id].append(task_run)
+        if cls_name in ('TaskRun', 'Result'):
+            for task in task_repo.get_tasks_by_ids(list(task_ids)):
+                related['tasks'][task.id] = task
+        if cls_name in ('Task', 'TaskRun'):
+            for result in result_repo.get_last_versions_by_task_ids(
+                    list(task_ids)):
+                related['results'][result.task_id] = result
+        return related
+
+    def _add_hateoas_links(self, item, related=None):
         obj = item.dictize()
-        related = request.args.get('related')
-        if related:
+        if related is not None:
             if item.__class__.__name__ == 'Task':
-                obj['task_runs'] = []
-                obj['result'] = None
-                task_runs = task_repo.filter_task_runs_by(task_id=item.id)
-                results = result_repo.filter_by(task_id=item.id, last_version=True)
-                for tr in task_runs:
-                    obj['task_runs'].append(tr.dictize())
-                for r in results:
-                    obj['result'] = r.dictize()
+                obj['task_runs'] = [tr.dictize() for tr in
+                                    related['task_runs'].get(item.id, [])]
+                result = related['results'].get(item.id)
+                obj['result'] = result.dictize() if result else None
 
             if item.__class__.__name__ == 'TaskRun':
-                tasks = task_repo.filter_tasks_by(id=item.task_id)
-                results = result_repo.filter_by(task_id=item.task_id, last_version=True)
-                obj['task'] = None
-                obj['result'] = None
-                for t in tasks:
-                    obj['task'] = t.dictize()
-                for r in results:
-                    obj['result'] = r.dictize()
+                task = related['tasks'].get(item.task_id)
+                result = related['results'].get(item.task_id)
+                obj['task'] = task.dictize() if task else None
+                obj['result'] = result.dictize() if result else None
 
             if item.__class__.__name__ == 'Result':
-                tasks = task_repo.filter_tasks_by(id=item.task_id)
-                task_runs = task_repo.filter_task_runs_by(task_id=item.task_id)
-                obj['task_runs'] = []
-                for t in tasks:
-                    obj['task'] = t.dictize()
-                for tr in task_runs:
-                    obj['task_runs'].append(tr.dictize())
+                task = related['tasks'].get(item.task_id)
+                if task:
+                    obj['task'] = task.dictize()
+                obj['task_runs'] = [tr.dictize() for tr in
+                                    related['task_runs'].get(item.task_id, [])]
 
         links, link = self.hateoas.create_links(item)
         if links:
@@ -239,7 +290,7 @@ class APIBase(MethodView):
         for k in request.args.keys():
             if k not in ['limit', 'offset', 'api_key', 'last_id', 'all',
                          'fulltextsearch', 'desc', 'orderby', 'related',
-                         'participated', 'full']:
+                         'participated', 'full', 'cursor']:
                 # Raise an error if the k arg is not a column
                 if self.__class__ == Task and k == 'external_uid':
                     pass
@@ -256,7 +307,17 @@ class APIBase(MethodView):
         fulltextsearch = request.args.get('fulltextsearch')
         desc = request.args.get('desc') if request.args.get('desc') else False
         desc = fuzzyboolean(desc)
-        if last_id:
+        cursor = request.args.get('cursor')
+        if cursor is not None:
+            keyset = self._cursor_keyset(cursor, orderby, desc,
+                                         fulltextsearch)
+            results = getattr(repo, query_func)(limit=limit, desc=desc,
+                                                orderby=orderby,
+                                                keyset=keyset,
+                                                **filters)
+            self.next_cursor = self._next_cursor(results, limit, orderby,
+                                                 desc, keyset)
+        elif last_id:
             results = getattr(repo, query_func)(limit=limit, last_id=last_id,
                                                 fulltextsearch=fulltextsearch,
                                                 desc=False,
@@ -270,6 +331,42 @@ class APIBase(MethodView):
                                                 **filters)
         return results
 
+    def _cursor_keyset(self, cursor, orderby, desc, fulltextsearch):
+        """Return the keyset of the cursor argument for the listing in
+        (orderby, id) order."""
+        if fulltextsearch:
+            raise BadRequest('cursor cannot be used with fulltextsearch')
+        if orderby != 'id':
+            orders = cursor_orders.get(self.__class__.__name__, [])
+            if orderby not in orders:
+                raise BadRequest('cursor cannot be used with orderby=%s'
+                                 % orderby)
+            if not request.args.get('project_id', '').isdigit():
+                raise BadRequest('cursor with orderby=%s needs a project_id'
+                                 % orderby)
+        decoded = decode_cursor(cursor)
+        if decoded is None:
+            return (False, None, None)
+        cursor_orderby, cursor_desc, nulls, value, last_id = decoded
+        if (cursor_orderby, cursor_desc) != (orderby, desc):
+            raise BadRequest('cursor does not match orderby and desc')
+        if not isinstance(last_id, (int, long, type(None))):
+            raise BadRequest('Invalid cursor')
+        return (nulls, value, last_id)
+
+    def _next_cursor(self, results, limit, orderby, desc, keyset):
+        """Return the cursor of the page following results, or None for
+        the last one."""
+        nulls = keyset[0] or orderby == 'id'
+        if len(results) == limit and results:
+            last = results[-1]
+            value = None if nulls else getattr(last, orderby)
+            return encode_cursor(orderby, desc, nulls, value, last.id)
+        if not nulls:
+            # Continue with the items without orderby value.
+            return encode_cursor(orderby, desc, True, None, None)
+        return None
+
     def _set_limit_and_offset(self):
         try:
             limit = min(100, int(request.args.get('limit')))
@@ -560,6 +657,10 @@ class APIBase(MethodView):
         """
         return True
 
+    def _verify_auth_many(self, items):
+        """Return the _verify_auth checks of a list of items"""
+        return [self._verify_auth(item) for item in items]
+
     def _sign_item(self, item):
         """Apply custom signature"""
         pass
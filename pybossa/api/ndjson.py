@@ -0,0 +1,88 @@
+# -*- coding: utf8 -*-
+# This file is part of PYBOSSA.
+#
+# Copyright (C) 2018 Scifabric LTD.
+#
+# PYBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PYBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Newline-delimited JSON exports of the tasks, task runs and results of a
+project for the API.
+
+Every export is one query read through a server-side cursor, checked for
+authorization once and written as one JSON object per line, gzipped when
+the client accepts it.
+"""
+import json
+import zlib
+
+import dateutil.parser
+import dateutil.tz
+from flask import Response, current_app, request, stream_with_context
+from werkzeug.exceptions import BadRequest
+
+
+def parse_since(value):
+    """Return the timestamp value as an ISO string in UTC, as the
+    timestamps of the models are stored."""
+    if not value:
+        return None
+    try:
+        since = dateutil.parser.parse(value)
+    except (ValueError, OverflowError):
+        raise BadRequest('Invalid since timestamp')
+    if since.tzinfo is not None:
+        since = since.astimezone(dateutil.tz.tzutc()).replace(tzinfo=None)
+    return since.isoformat()
+
+
+def parse_since_id(value):
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise BadRequest('Invalid since_id')
+
+
+def ndjson_chunks(items, serialize, lines_per_chunk):
+    """Yield the serialized items, lines_per_chunk lines at a time."""
+    lines = []
+    for item in items:
+        lines.append(json.dumps(serialize(item)))
+        if len(lines) == lines_per_chunk:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        # Flush every chunk so that the client can start reading.
+        yield (compressor.compress(chunk) +
+               compressor.flush(zlib.Z_SYNC_FLUSH))
+    yield compressor.flush()
+
+
+def ndjson_response(items, serialize):
+    """Return a streamed response with a line per item."""
+    chunks = ndjson_chunks(items, serialize,
+                           current_app.config.get('NDJSON_YIELD_PER'))
+    headers = {'Vary': 'Accept-Encoding', 'X-Accel-Buffering': 'no'}
+    if request.accept_encodings['gzip']:
+        chunks = gzip_chunks(chunks)
+        headers['Content-Encoding'] = 'gzip'
+    return Response(stream_with_context(chunks),
+                    mimetype='application/x-ndjson', headers=headers)
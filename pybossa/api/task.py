@@ -89,15 +89,27 @@ class TaskAPI(APIBase):
             except Exception as e:
                 raise BadRequest('Invalid gold_answers')
 
-    def _verify_auth(self, item):
+    def _verify_auth(self, item, project_data=None):
         if not current_user.is_authenticated():
             return False
         if current_user.admin or current_user.subadmin:
             return True
-        project = Project(**get_project_data(item.project_id))
+        if project_data is None:
+            project_data = get_project_data(item.project_id)
+        project = Project(**project_data)
         pwd_manager = get_pwd_manager(project)
         return not pwd_manager.password_needed(project, get_user_id_or_ip())
 
+    def _verify_auth_many(self, items):
+        projects = {}
+        if (current_user.is_authenticated() and
+                not (current_user.admin or current_user.subadmin)):
+            # Read the projects of all the items at once
+            projects = get_project_data.many(
+                set(item.project_id for item in items))
+        return [self._verify_auth(item, projects.get(item.project_id))
+                for item in items]
+
     def _sign_item(self, item):
         project_id = item['project_id']
         if current_user.admin or \
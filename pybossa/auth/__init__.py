@@ -82,6 +82,20 @@ def is_authorized(user, action, resource, **kwargs):
     return auth.can(user, action, resource, **kwargs)
 
 
+def is_authorized_many(user, action, resources):
+    """Return whether user can do action on each of resources, which are
+    instances of the same class. Authorizers with a can_many method check
+    them all at once."""
+    if not resources:
+        return []
+    auth = _authorizer_for(resources[0].__class__.__name__.lower())
+    actions = _actions + auth.specific_actions
+    assert action in actions, "%s is not a valid action" % action
+    if hasattr(auth, 'can_many'):
+        return auth.can_many(user, action, resources)
+    return [auth.can(user, action, resource) for resource in resources]
+
+
 def ensure_authorized_to(action, resource, **kwargs):
     authorized = is_authorized(current_user, action, resource, **kwargs)
     if authorized is False:
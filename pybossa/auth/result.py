@@ -16,6 +16,8 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
 
+from pybossa.cache import project_descriptors
+
 
 class ResultAuth(object):
     _specific_actions = []
@@ -37,10 +39,26 @@ class ResultAuth(object):
         project = self.project_repo.get(result.project_id)
         return user.id in project.owners_ids
 
+    def admin_subadmin_proj_owners_many(self, user, results):
+        if user.is_anonymous():
+            return [False] * len(results)
+        if user.admin or user.subadmin:
+            return [True] * len(results)
+        projects = project_descriptors.get_many(
+            result.project_id for result in results)
+        return [result.project_id in projects and
+                user.id in projects[result.project_id].owners_ids
+                for result in results]
+
     def can(self, user, action, result=None):
         action = ''.join(['_', action])
         return getattr(self, action)(user, result)
 
+    def can_many(self, user, action, results):
+        if action == 'read':
+            return self.admin_subadmin_proj_owners_many(user, results)
+        return [self.can(user, action, result) for result in results]
+
     def _create(self, user, result):
         return not user.is_anonymous() and user.admin
 
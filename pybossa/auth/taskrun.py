@@ -17,6 +17,7 @@
 # along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
 
 from flask import abort
+from pybossa.cache import project_descriptors
 
 
 class TaskRunAuth(object):
@@ -36,15 +37,31 @@ class TaskRunAuth(object):
             return False
         if user.admin or user.subadmin:
             return True
-        project = self.project_repo.get(taskrun.project_id)
+        project = project_descriptors.get(taskrun.project_id)
         return user.id in project.owners_ids
 
+    def admin_subadmin_proj_owners_many(self, user, taskruns):
+        if user.is_anonymous():
+            return [False] * len(taskruns)
+        if user.admin or user.subadmin:
+            return [True] * len(taskruns)
+        projects = project_descriptors.get_many(
+            taskrun.project_id for taskrun in taskruns)
+        return [taskrun.project_id in projects and
+                user.id in projects[taskrun.project_id].owners_ids
+                for taskrun in taskruns]
+
     def can(self, user, action, taskrun=None):
         action = ''.join(['_', action])
         return getattr(self, action)(user, taskrun)
 
+    def can_many(self, user, action, taskruns):
+        if action == 'read':
+            return self.admin_subadmin_proj_owners_many(user, taskruns)
+        return [self.can(user, action, taskrun) for taskrun in taskruns]
+
     def _create(self, user, taskrun):
-        project = self.project_repo.get(taskrun.project_id)
+        project = project_descriptors.get(taskrun.project_id)
         if (user.is_anonymous() and
                 project.allow_anonymous_contributors is False):
             return False
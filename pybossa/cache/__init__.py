@@ -25,17 +25,20 @@ It exports:
     * delete_cached: to remove a cached value
     * delete_memoized: to remove a cached value from the memoize decorator
 
+When CACHE_LOCAL is enabled the values read from Redis are also kept for a
+few seconds in a per process LRU (see pybossa.cache.local_cache).
+
 """
 import os
+import math
+import random
+import time
 import hashlib
 from functools import wraps
 from pybossa.core import sentinel
 from pybossa.sentinel import keys, scan_iter
-
-try:
-    import cPickle as pickle
-except ImportError:  # pragma: no cover
-    import pickle
+from pybossa.cache.local_cache import LocalCache, LocalCacheInvalidator
+from pybossa.cache.serialization import Serializer
 
 try:
     import settings_local as settings
@@ -49,6 +52,63 @@ HALF_HOUR = 30 * 60
 FIVE_MINUTES = 5 * 60
 ONE_WEEK = 7 * ONE_DAY
 
+serializer = Serializer(getattr(settings, 'CACHE_SERIALIZER', 'pickle'),
+                        getattr(settings, 'CACHE_COMPRESS_THRESHOLD', 0))
+local_cache = LocalCache(getattr(settings, 'CACHE_LOCAL_MAX_SIZE', 10000),
+                         getattr(settings, 'CACHE_LOCAL_TIMEOUT', 5))
+local_invalidator = LocalCacheInvalidator(
+    local_cache, '%s:cache_invalidation' % settings.REDIS_KEYPREFIX)
+
+
+def get_key_prefix():
+    """Return the prefix of the cache keys.
+
+    Bumping CACHE_KEY_VERSION moves the cache to new keys, e.g. to roll out a
+    new CACHE_SERIALIZER while workers with the old one are still running.
+    """
+    version = getattr(settings, 'CACHE_KEY_VERSION', None)
+    if version:
+        return '%s:v%s' % (settings.REDIS_KEYPREFIX, version)
+    return settings.REDIS_KEYPREFIX
+
+
+def local_cache_enabled():
+    return bool(getattr(settings, 'CACHE_LOCAL', False))
+
+
+def get_cached_value(key, timeout):
+    """Return the raw cached value, trying the local tier before Redis."""
+    if not local_cache_enabled():
+        return sentinel.slave.get(key)
+    local_invalidator.ensure_listening(sentinel.master)
+    output = local_cache.get(key)
+    if output is None:
+        output = sentinel.slave.get(key)
+        if output:
+            local_cache.set(key, output, timeout)
+    return output
+
+
+def get_cached_values(keys, timeout):
+    """Return the raw cached values of keys with a single MGET."""
+    if not local_cache_enabled():
+        return sentinel.slave.mget(keys) if keys else []
+    local_invalidator.ensure_listening(sentinel.master)
+    outputs = [local_cache.get(key) for key in keys]
+    missing = [i for i, output in enumerate(outputs) if output is None]
+    if missing:
+        values = sentinel.slave.mget([keys[i] for i in missing])
+        for i, output in zip(missing, values):
+            if output:
+                local_cache.set(keys[i], output, timeout)
+            outputs[i] = output
+    return outputs
+
+
+def invalidate_local(kind, keys):
+    if local_cache_enabled():
+        local_invalidator.publish(sentinel.master, kind, keys)
+
 
 def get_key_to_hash(*args, **kwargs):
     """Return key to hash for *args and **kwargs."""
@@ -70,10 +130,12 @@ def get_hash_key(prefix, key_to_hash):
 
 
 def get_cache_group_key(key):
-    return '{}:memoize_cache_group:{}'.format(settings.REDIS_KEYPREFIX, key)
+    return '{}:memoize_cache_group:{}'.format(get_key_prefix(), key)
 
 
-def add_key_to_cache_groups(key_to_add, cache_group_keys_arg, *args, **kwargs):
+def get_cache_groups(cache_group_keys_arg, *args, **kwargs):
+    """Return the cache group keys a call with *args and **kwargs belongs to."""
+    groups = []
     for cache_group_key_arg in (cache_group_keys_arg or []):
         cache_group_key = None
         if isinstance(cache_group_key_arg, list):
@@ -85,8 +147,13 @@ def add_key_to_cache_groups(key_to_add, cache_group_keys_arg, *args, **kwargs):
         elif cache_group_key_arg is not None:
             raise Exception('Invalid cache_group_key_arg: {}'.format(cache_group_key_arg))
         else:
-            return
-        key = get_cache_group_key(cache_group_key)
+            break
+        groups.append(get_cache_group_key(cache_group_key))
+    return groups
+
+
+def add_key_to_cache_groups(key_to_add, cache_group_keys_arg, *args, **kwargs):
+    for key in get_cache_groups(cache_group_keys_arg, *args, **kwargs):
         sentinel.master.sadd(key, key_to_add)
 
 
@@ -94,69 +161,199 @@ def delete_cache_group(cache_group_key):
     key = get_cache_group_key(cache_group_key)
     keys_to_delete = list(sentinel.slave.smembers(key)) + [key]
     sentinel.master.delete(*keys_to_delete)
+    invalidate_local(LocalCacheInvalidator.KEY, keys_to_delete)
+
+
+class StampedeProtection(object):
+
+    """Avoid concurrent recomputations of an expired cache value.
+
+    With lock_timeout, only the worker holding a short Redis lock on the key
+    recomputes a missing value. The others poll the key for up to
+    lock_timeout seconds and only compute it themselves if it never shows up.
+
+    With early_refresh (the beta of the XFetch algorithm, 1 is a sensible
+    value) the value is stored with the time it took to compute, and each
+    read recomputes it ahead of its expiration with a probability that grows
+    as the expiration gets closer. Combined with lock_timeout, only one
+    worker refreshes while the others keep serving the current value.
+    """
+
+    POLL_INTERVAL = 0.05
+
+    def __init__(self, lock_timeout=None, early_refresh=None):
+        self.lock_timeout = lock_timeout
+        self.early_refresh = early_refresh
+
+    def wrap(self, output, delta, timeout):
+        if self.early_refresh is None:
+            return serializer.dumps(output)
+        return serializer.dumps((output, delta, time.time() + timeout))
+
+    def unwrap(self, data):
+        """Return (value, whether it should be refreshed now)."""
+        if self.early_refresh is None:
+            return serializer.loads(data), False
+        envelope = serializer.loads(data)
+        if not isinstance(envelope, tuple) or len(envelope) != 3:
+            # Stored before early_refresh was enabled for the function.
+            return envelope, False
+        output, delta, expiry = envelope
+        gap = -delta * self.early_refresh * math.log(1 - random.random())
+        return output, time.time() + gap >= expiry
+
+    def acquire(self, key):
+        if not self.lock_timeout:
+            return True
+        return bool(sentinel.master.set(key + ':lock', 1, nx=True,
+                                        px=int(self.lock_timeout * 1000)))
+
+    def release(self, key):
+        if self.lock_timeout:
+            sentinel.master.delete(key + ':lock')
+
+    def wait(self, key, timeout):
+        """Poll the key while another worker computes it."""
+        deadline = time.time() + self.lock_timeout
+        while time.time() < deadline:
+            time.sleep(self.POLL_INTERVAL)
+            output = get_cached_value(key, timeout)
+            if output:
+                return output
 
 
-def cache(key_prefix, timeout=300, cache_group_keys=None):
+def cached_call(key, timeout, cache_group_keys, stampede, f, *args, **kwargs):
+    """Return f(*args, **kwargs) from the cache, computing it when needed."""
+    locked = False
+    if os.environ.get('PYBOSSA_REDIS_CACHE_DISABLED') is None:
+        output = get_cached_value(key, timeout)
+        if output:
+            value, refresh = stampede.unwrap(output)
+            if not refresh or not stampede.acquire(key):
+                return value
+            locked = True
+        elif stampede.acquire(key):
+            locked = True
+        else:
+            output = stampede.wait(key, timeout)
+            if output:
+                return stampede.unwrap(output)[0]
+    try:
+        start = time.time()
+        output = f(*args, **kwargs)
+        delta = time.time() - start
+        sentinel.master.setex(key, timeout,
+                              stampede.wrap(output, delta, timeout))
+        add_key_to_cache_groups(key, cache_group_keys, *args, **kwargs)
+        return output
+    finally:
+        if locked:
+            stampede.release(key)
+
+
+def cache(key_prefix, timeout=300, cache_group_keys=None, lock_timeout=None,
+          early_refresh=None):
     """
     Decorator for caching functions.
 
     Returns the function value from cache, or the function if cache disabled
 
+    See StampedeProtection for lock_timeout and early_refresh.
+
     """
     if timeout is None:
         timeout = 300
+    stampede = StampedeProtection(lock_timeout, early_refresh)
     def decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
-            key = "%s::%s" % (settings.REDIS_KEYPREFIX, key_prefix)
-            if os.environ.get('PYBOSSA_REDIS_CACHE_DISABLED') is None:
-                output = sentinel.slave.get(key)
-                if output:
-                    return pickle.loads(output)
-                output = f(*args, **kwargs)
-                sentinel.master.setex(key, timeout, pickle.dumps(output))
-                add_key_to_cache_groups(key, cache_group_keys, *args, **kwargs)
-                return output
-            output = f(*args, **kwargs)
-            sentinel.master.setex(key, timeout, pickle.dumps(output))
-            add_key_to_cache_groups(key, cache_group_keys, *args, **kwargs)
-            return output
+            key = "%s::%s" % (get_key_prefix(), key_prefix)
+            return cached_call(key, timeout, cache_group_keys, stampede,
+                               f, *args, **kwargs)
         return wrapper
     return decorator
 
 
-def memoize(timeout=300, cache_group_keys=None):
+def memoize(timeout=300, cache_group_keys=None, lock_timeout=None,
+            early_refresh=None):
     """
     Decorator for caching functions using its arguments as part of the key.
 
     Returns the cached value, or the function if the cache is disabled
 
+    Functions of a single argument also get a many(args) method returning a
+    dict with the value for every argument. It reads the cache with one MGET
+    and stores the misses with one pipeline. The misses are computed with the
+    function registered through the batch decorator, which receives the list
+    of missing arguments and returns a dict, or one call at a time otherwise.
+
+    See StampedeProtection for lock_timeout and early_refresh.
+
     """
     if timeout is None:
         timeout = 300
+    stampede = StampedeProtection(lock_timeout, early_refresh)
     def decorator(f):
+        def get_key(*args, **kwargs):
+            key = "%s:%s_args:" % (get_key_prefix(), f.__name__)
+            key_to_hash = get_key_to_hash(*args, **kwargs)
+            return get_hash_key(key, key_to_hash)
+
         @wraps(f)
         def wrapper(*args, **kwargs):
-            key = "%s:%s_args:" % (settings.REDIS_KEYPREFIX, f.__name__)
-            key_to_hash = get_key_to_hash(*args, **kwargs)
-            key = get_hash_key(key, key_to_hash)
-            if os.environ.get('PYBOSSA_REDIS_CACHE_DISABLED') is None:
-                output = sentinel.slave.get(key)
-                if output:
-                    return pickle.loads(output)
-                output = f(*args, **kwargs)
-                sentinel.master.setex(key, timeout, pickle.dumps(output))
-                add_key_to_cache_groups(key, cache_group_keys, *args, **kwargs)
-                return output
-            output = f(*args, **kwargs)
-            sentinel.master.setex(key, timeout, pickle.dumps(output))
-            add_key_to_cache_groups(key, cache_group_keys, *args, **kwargs)
-            return output
+            key = get_key(*args, **kwargs)
+            return cached_call(key, timeout, cache_group_keys, stampede,
+                               f, *args, **kwargs)
+
+        def many(args):
+            args = list(args)
+            keys = [get_key(arg) for arg in args]
+            outputs = dict()
+            missing = []
+            enabled = os.environ.get('PYBOSSA_REDIS_CACHE_DISABLED') is None
+            if enabled:
+                for arg, key, output in zip(args, keys,
+                                            get_cached_values(keys, timeout)):
+                    if output is not None:
+                        outputs[arg] = stampede.unwrap(output)[0]
+                    else:
+                        missing.append((arg, key))
+            else:
+                missing = zip(args, keys)
+            if not missing:
+                return outputs
+            missing_args = [arg for arg, _ in missing]
+            start = time.time()
+            if wrapper.batch_func:
+                computed = wrapper.batch_func(missing_args)
+            else:
+                computed = dict((arg, f(arg)) for arg in missing_args)
+            delta = time.time() - start
+            for arg, _ in missing:
+                outputs[arg] = computed[arg]
+            if enabled:
+                pipeline = sentinel.master.pipeline(transaction=False)
+                for arg, key in missing:
+                    pipeline.setex(key, timeout,
+                                   stampede.wrap(computed[arg], delta, timeout))
+                    for group in get_cache_groups(cache_group_keys, arg):
+                        pipeline.sadd(group, key)
+                pipeline.execute()
+            return outputs
+
+        def batch(batch_func):
+            wrapper.batch_func = batch_func
+            return batch_func
+
+        wrapper.batch_func = None
+        wrapper.many = many
+        wrapper.batch = batch
         return wrapper
     return decorator
 
 
-def memoize_essentials(timeout=300, essentials=None, cache_group_keys=None):
+def memoize_essentials(timeout=300, essentials=None, cache_group_keys=None,
+                       lock_timeout=None, early_refresh=None):
     """
     Decorator for caching functions using its arguments as part of the key.
 
@@ -164,35 +361,36 @@ def memoize_essentials(timeout=300, essentials=None, cache_group_keys=None):
 
     Returns the cached value, or the function if the cache is disabled
 
+    See StampedeProtection for lock_timeout and early_refresh.
+
     """
     if timeout is None:
         timeout = 300
+    stampede = StampedeProtection(lock_timeout, early_refresh)
     if essentials is None:
         essentials = []
     def decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
-            key = "%s:%s_args:" % (settings.REDIS_KEYPREFIX, f.__name__)
+            key = "%s:%s_args:" % (get_key_prefix(), f.__name__)
             essential_args = [args[i] for i in essentials]
             key += get_key_to_hash(*essential_args) + ":"
             key_to_hash = get_key_to_hash(*args, **kwargs)
             key = get_hash_key(key, key_to_hash)
-            if os.environ.get('PYBOSSA_REDIS_CACHE_DISABLED') is None:
-                output = sentinel.slave.get(key)
-                if output:
-                    return pickle.loads(output)
-                output = f(*args, **kwargs)
-                sentinel.master.setex(key, timeout, pickle.dumps(output))
-                add_key_to_cache_groups(key, cache_group_keys, *args, **kwargs)
-                return output
-            output = f(*args, **kwargs)
-            sentinel.master.setex(key, timeout, pickle.dumps(output))
-            add_key_to_cache_groups(key, cache_group_keys, *args, **kwargs)
-            return output
+            return cached_call(key, timeout, cache_group_keys, stampede,
+                               f, *args, **kwargs)
         return wrapper
     return decorator
 
 
+def delete_prefix(prefix):
+    """Delete every cached value whose key starts with prefix."""
+    keys_to_delete = list(scan_iter(sentinel.slave, match=prefix + '*', count=10000))
+    deleted = keys_to_delete and sentinel.master.delete(*keys_to_delete)
+    invalidate_local(LocalCacheInvalidator.PREFIX, [prefix])
+    return bool(deleted)
+
+
 def delete_cached(key):
     """
     Delete a cached value from the cache.
@@ -201,8 +399,10 @@ def delete_cached(key):
 
     """
     if os.environ.get('PYBOSSA_REDIS_CACHE_DISABLED') is None:
-        key = "%s::%s" % (settings.REDIS_KEYPREFIX, key)
-        return bool(sentinel.master.delete(key))
+        key = "%s::%s" % (get_key_prefix(), key)
+        deleted = sentinel.master.delete(key)
+        invalidate_local(LocalCacheInvalidator.KEY, [key])
+        return bool(deleted)
     return True
 
 
@@ -214,15 +414,14 @@ def delete_memoized(function, *args, **kwargs):
 
     """
     if os.environ.get('PYBOSSA_REDIS_CACHE_DISABLED') is None:
-        key = "%s:%s_args:" % (settings.REDIS_KEYPREFIX, function.__name__)
+        key = "%s:%s_args:" % (get_key_prefix(), function.__name__)
         if args or kwargs:
             key_to_hash = get_key_to_hash(*args, **kwargs)
             key = get_hash_key(key, key_to_hash)
-            return bool(sentinel.master.delete(key))
-        keys_to_delete = list(scan_iter(sentinel.slave, match=key + '*', count=10000))
-        if not keys_to_delete:
-            return False
-        return bool(sentinel.master.delete(*keys_to_delete))
+            deleted = sentinel.master.delete(key)
+            invalidate_local(LocalCacheInvalidator.KEY, [key])
+            return bool(deleted)
+        return delete_prefix(key)
     return True
 
 
@@ -234,11 +433,8 @@ def delete_memoized_essential(function, *args, **kwargs):
 
     """
     if os.environ.get('PYBOSSA_REDIS_CACHE_DISABLED') is None:
-        key = "%s:%s_args:" % (settings.REDIS_KEYPREFIX, function.__name__)
+        key = "%s:%s_args:" % (get_key_prefix(), function.__name__)
         if args or kwargs:
             key += get_key_to_hash(*args, **kwargs)
-        keys_to_delete = list(scan_iter(sentinel.slave, match=key + '*', count=10000))
-        if not keys_to_delete:
-            return False
-        return bool(sentinel.master.delete(*keys_to_delete))
+        return delete_prefix(key)
     return True
@@ -0,0 +1,98 @@
+# -*- coding: utf8 -*-
+# This file is part of PYBOSSA.
+#
+# Copyright (C) 2018 Scifabric LTD.
+#
+# PYBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PYBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+"""Number of tasks of a project a contributor can still contribute to.
+
+Counting them is an anti-join over all the tasks of the project, and the
+project listings need it for every project they show. The counts are kept
+in a Redis hash per project and contributor, under a project generation:
+
+    * a task run decrements the counts of its contributor;
+    * any other change to the tasks of a project (new, updated, completed or
+      deleted tasks, redundancy updates) bumps the generation, so all the
+      counts of the project are computed again on their next read.
+"""
+import os
+
+from flask import current_app
+
+from pybossa.core import sentinel
+
+
+GENERATION_KEY = 'pybossa:available_tasks:{0}:generation'
+COUNTS_KEY = 'pybossa:available_tasks:{0}:{1}:{2}'
+
+DECREMENT = '''
+for i, field in ipairs(redis.call('HKEYS', KEYS[1])) do
+    if tonumber(redis.call('HGET', KEYS[1], field)) > 0 then
+        redis.call('HINCRBY', KEYS[1], field, -1)
+    end
+end
+'''
+
+
+def is_enabled():
+    return os.environ.get('PYBOSSA_REDIS_CACHE_DISABLED') is None
+
+
+def contributor(user_id=None, user_ip=None):
+    """Return the contributor part of the key, as n_available_tasks picks
+    it: the user id, or the IP for anonymous contributions."""
+    if user_id and not user_ip:
+        return 'user:{0}'.format(user_id)
+    return 'ip:{0}'.format(user_ip or '127.0.0.1')
+
+
+def _counts_key(redis_conn, project_id, user_id, user_ip):
+    generation = redis_conn.get(GENERATION_KEY.format(project_id)) or 0
+    return COUNTS_KEY.format(project_id, generation,
+                             contributor(user_id, user_ip))
+
+
+def get(project_id, user_id, user_ip, field, count):
+    """Return the cached count stored as field for the contributor, or
+    count() when there is none. None is returned but not cached."""
+    if not is_enabled():
+        return count()
+    redis_conn = sentinel.master
+    key = _counts_key(redis_conn, project_id, user_id, user_ip)
+    value = redis_conn.hget(key, field)
+    if value is not None:
+        return int(value)
+    value = count()
+    if value is not None:
+        pipe = redis_conn.pipeline()
+        pipe.hset(key, field, value)
+        pipe.expire(key, current_app.config.get('AVAILABLE_TASKS_CACHE_TTL'))
+        pipe.execute()
+    return value
+
+
+def task_submitted(project_id, user_id, user_ip):
+    """Count one task less for the contributor of a new task run."""
+    if not is_enabled():
+        return
+    redis_conn = sentinel.master
+    key = _counts_key(redis_conn, project_id, user_id, user_ip)
+    redis_conn.eval(DECREMENT, 1, key)
+
+
+def project_changed(project_id):
+    """Drop the counts of every contributor to the project."""
+    if not is_enabled():
+        return
+    sentinel.master.incr(GENERATION_KEY.format(project_id))
@@ -17,6 +17,7 @@
 # along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
 """Cache module with helper functions."""
 
+import hashlib
 from flask import current_app
 from sqlalchemy.sql import text
 from pybossa.core import db
@@ -24,6 +25,7 @@ from pybossa.cache import memoize, ONE_HOUR
 from pybossa.cache.projects import n_results, overall_progress
 from pybossa.model.project_stats import ProjectStats
 from pybossa.cache import users as cached_users
+from pybossa.cache import available_tasks
 from pybossa.data_access import get_data_access_db_clause_for_task_assignment
 
 session = db.slave_session
@@ -35,6 +37,12 @@ def n_available_tasks(project_id, user_id=None, user_ip=None):
     based on the completion of the project tasks, and previous task_runs
     submitted by the user.
     """
+    return available_tasks.get(
+        project_id, user_id, user_ip, 'all',
+        lambda: _n_available_tasks(project_id, user_id, user_ip))
+
+
+def _n_available_tasks(project_id, user_id=None, user_ip=None):
     if user_id and not user_ip:
         query = text('''SELECT COUNT(*) AS n_tasks FROM task
                         WHERE project_id=:project_id AND state !='completed'
@@ -194,15 +202,21 @@ def n_available_tasks_for_user(project, user_id=None, user_ip=None):
                AND (user_pref IS NULL OR {}) {} ;
                '''.format(user_pref_list, allowed_task_levels_clause)
     sqltext = text(sql)
-    try:
-        result = session.execute(sqltext, dict(project_id=project.id, user_id=user_id))
-    except Exception as e:
-        current_app.logger.exception('Exception in get_user_pref_task {0}, sql: {1}'.format(str(e), str(sqltext)))
-        return None
 
-    for row in result:
-        n_tasks = row.n_tasks
-    return n_tasks
+    def count():
+        try:
+            result = session.execute(sqltext, dict(project_id=project.id, user_id=user_id))
+        except Exception as e:
+            current_app.logger.exception('Exception in get_user_pref_task {0}, sql: {1}'.format(str(e), str(sqltext)))
+            return None
+        n_tasks = 0
+        for row in result:
+            n_tasks = row.n_tasks
+        return n_tasks
+
+    # The user preferences and access levels are part of the query.
+    field = 'for_user:' + hashlib.md5(sql.encode('utf-8')).hexdigest()
+    return available_tasks.get(project.id, user_id, None, field, count)
 
 
 def latest_submission_task_date(project_id):
@@ -0,0 +1,140 @@
+# -*- coding: utf8 -*-
+# This file is part of PYBOSSA.
+#
+# Copyright (C) 2018 Scifabric LTD.
+#
+# PYBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PYBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+"""In-process tier in front of the Redis cache.
+
+Every worker keeps a bounded LRU of the raw (serialized) values it read from
+Redis for a few seconds. Deleting a key from Redis publishes it on a pub/sub
+channel, and a daemon thread in every worker drops it from its own LRU.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+log = logging.getLogger(__name__)
+
+
+class LocalCache(object):
+
+    """Bounded LRU with a timeout per entry."""
+
+    def __init__(self, max_size=10000, timeout=5):
+        self.max_size = max_size
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        """Return the stored value, or None if missing or expired."""
+        with self._lock:
+            item = self._data.pop(key, None)
+            if item is None or item[0] < time.time():
+                return None
+            self._data[key] = item
+            return item[1]
+
+    def set(self, key, value, timeout=None):
+        timeout = min(timeout or self.timeout, self.timeout)
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (time.time() + timeout, value)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def delete_prefix(self, *prefixes):
+        with self._lock:
+            for key in [key for key in self._data
+                        if key.startswith(prefixes)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class LocalCacheInvalidator(object):
+
+    """Propagate Redis cache deletions to the LocalCache of every worker.
+
+    Messages are the kind of invalidation ('key' or 'prefix') followed by the
+    affected keys, one per line.
+    """
+
+    KEY = 'key'
+    PREFIX = 'prefix'
+    RETRY_DELAY = 1
+
+    def __init__(self, local_cache, channel):
+        self.local_cache = local_cache
+        self.channel = channel
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure_listening(self, redis_conn):
+        """Start the subscriber thread of the current process if needed."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # Forked workers inherit the entries but not the thread.
+            self.local_cache.clear()
+            thread = threading.Thread(target=self._listen, args=(redis_conn,))
+            thread.daemon = True
+            thread.start()
+            self._pid = os.getpid()
+
+    def publish(self, redis_conn, kind, keys):
+        """Invalidate keys here and in every other worker."""
+        if not keys:
+            return
+        message = '\n'.join([kind] + list(keys))
+        self.apply(message)
+        redis_conn.publish(self.channel, message)
+
+    def apply(self, message):
+        lines = message.split('\n')
+        kind, keys = lines[0], lines[1:]
+        if kind == self.KEY:
+            self.local_cache.delete(*keys)
+        elif kind == self.PREFIX:
+            self.local_cache.delete_prefix(*keys)
+
+    def _listen(self, redis_conn):
+        while True:
+            try:
+                pubsub = redis_conn.pubsub()
+                pubsub.subscribe(self.channel)
+                for message in pubsub.listen():
+                    if message['type'] == 'message':
+                        self.apply(message['data'])
+            except Exception:
+                log.exception('Local cache invalidation listener failed')
+            # Invalidations may have been missed while disconnected.
+            self.local_cache.clear()
+            time.sleep(self.RETRY_DELAY)
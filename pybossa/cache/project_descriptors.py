@@ -0,0 +1,147 @@
+# -*- coding: utf8 -*-
+# This file is part of PYBOSSA.
+#
+# Copyright (C) 2018 Scifabric LTD.
+#
+# PYBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PYBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+"""Project metadata read on every contribution.
+
+Submitting a task run checks the scheduler, timeout, owners and anonymous
+contributions of its project several times. Those columns are loaded once
+into a ProjectDescriptor, that is kept:
+
+    * for the rest of the request, in flask.g;
+    * in a LRU of every process, along with the version it was loaded at.
+
+The version of a project is a random token in Redis, replaced whenever the
+project is saved, updated or deleted (see event_listeners), so every process
+loads the project again on its next read.
+"""
+import os
+import uuid
+from collections import namedtuple
+
+from flask import g, has_request_context
+from sqlalchemy.sql import text
+
+from pybossa.core import db, sentinel
+from pybossa.cache import FIVE_MINUTES
+from pybossa.cache.local_cache import LocalCache
+
+
+VERSION_KEY = 'pybossa:project_descriptor:{0}:version'
+INFO_KEYS = ['sched', 'timeout', 'data_access']
+
+ProjectDescriptor = namedtuple('ProjectDescriptor', [
+    'id', 'short_name', 'owner_id', 'owners_ids', 'published', 'webhook',
+    'allow_anonymous_contributors', 'info'])
+
+descriptors = LocalCache(max_size=10000, timeout=FIVE_MINUTES)
+
+
+def is_enabled():
+    return os.environ.get('PYBOSSA_REDIS_CACHE_DISABLED') is None
+
+
+def _request_descriptors():
+    if not has_request_context():
+        return None
+    if not hasattr(g, 'project_descriptors'):
+        g.project_descriptors = {}
+    return g.project_descriptors
+
+
+def _load(project_ids):
+    sql = text('''SELECT id, short_name, owner_id, owners_ids, published,
+                  webhook, allow_anonymous_contributors, info->'sched' AS sched,
+                  info->'timeout' AS timeout,
+                  info->'data_access' AS data_access
+                  FROM project WHERE id = ANY(:project_ids)''')
+    rows = db.session.execute(sql, dict(project_ids=list(project_ids)))
+    loaded = dict()
+    for row in rows:
+        info = dict((key, row[key]) for key in INFO_KEYS
+                    if row[key] is not None)
+        loaded[row.id] = ProjectDescriptor(
+            row.id, row.short_name, row.owner_id, list(row.owners_ids or []),
+            row.published, row.webhook, row.allow_anonymous_contributors,
+            info)
+    return loaded
+
+
+def _versions(project_ids):
+    keys = [VERSION_KEY.format(project_id) for project_id in project_ids]
+    versions = sentinel.master.mget(keys)
+    for i, key in enumerate(keys):
+        if versions[i] is None:
+            version = uuid.uuid4().hex
+            if not sentinel.master.set(key, version, nx=True):
+                version = sentinel.master.get(key)
+            versions[i] = version
+    return dict(zip(project_ids, versions))
+
+
+def _get(project_ids):
+    if not is_enabled():
+        return _load(project_ids)
+    found = dict()
+    missing = []
+    for project_id, version in _versions(project_ids).iteritems():
+        item = descriptors.get(project_id)
+        if item is not None and item[0] == version:
+            found[project_id] = item[1]
+        else:
+            missing.append((project_id, version))
+    if missing:
+        loaded = _load([project_id for project_id, _ in missing])
+        for project_id, version in missing:
+            if project_id in loaded:
+                descriptors.set(project_id, (version, loaded[project_id]))
+        found.update(loaded)
+    return found
+
+
+def get_many(project_ids):
+    """Return a dict with the ProjectDescriptor of every existing project of
+    project_ids, loading the missing ones with a single query."""
+    in_request = _request_descriptors()
+    found = dict()
+    missing = []
+    for project_id in set(project_ids):
+        if in_request is not None and project_id in in_request:
+            found[project_id] = in_request[project_id]
+        else:
+            missing.append(project_id)
+    if missing:
+        loaded = _get(missing)
+        if in_request is not None:
+            in_request.update(loaded)
+        found.update(loaded)
+    return found
+
+
+def get(project_id):
+    """Return the ProjectDescriptor of a project, or None if it does not
+    exist."""
+    return get_many([project_id]).get(project_id)
+
+
+def project_changed(project_id):
+    """Load the project again on its next read, in every process."""
+    descriptors.delete(project_id)
+    in_request = _request_descriptors()
+    if in_request is not None:
+        in_request.pop(project_id, None)
+    if is_enabled():
+        sentinel.master.delete(VERSION_KEY.format(project_id))
@@ -44,6 +44,11 @@ def n_tasks(project_id):
     return projects.n_tasks(project_id)
 
 
+# Rollup rows whose hour overlaps the period.
+IN_PERIOD = '''AND hour >= date_trunc('hour',
+                   (NOW() - :period ::INTERVAL) AT TIME ZONE 'UTC')'''
+
+
 @memoize(timeout=ONE_HOUR)
 def stats_users(project_id, period=None):
     """Return users's stats for a given project_id."""
@@ -51,97 +56,45 @@ def stats_users(project_id, period=None):
     auth_users = []
     anon_users = []
 
-    # Get Authenticated Users
     params = dict(project_id=project_id)
-    sql = text('''SELECT task_run.user_id AS user_id,
-               COUNT(task_run.id) as n_tasks FROM task_run
-               WHERE task_run.user_id IS NOT NULL AND
-               task_run.user_ip IS NULL AND
-               task_run.project_id=:project_id
-               GROUP BY task_run.user_id
-               ORDER BY n_tasks DESC;''')\
-        .execution_options(stream=True)
+    period_filter = ''
     if period:
-        sql = text('''SELECT task_run.user_id AS user_id,
-                   COUNT(task_run.id) as n_tasks FROM task_run
-                   WHERE task_run.user_id IS NOT NULL AND
-                   task_run.user_ip IS NULL AND
-                   task_run.project_id=:project_id AND
-                   TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-                   >= NOW() - :period ::INTERVAL
-                   GROUP BY task_run.user_id
-                   ORDER BY n_tasks DESC;''')\
-            .execution_options(stream=True)
+        period_filter = IN_PERIOD
         params['period'] = period
 
+    # Get Authenticated Users
+    sql = text('''SELECT user_id, CAST(SUM(n_task_runs) AS INTEGER) AS n_tasks
+               FROM project_hourly_stats
+               WHERE user_id IS NOT NULL AND user_ip IS NULL AND
+               project_id=:project_id {}
+               GROUP BY user_id HAVING SUM(n_task_runs) > 0
+               ORDER BY n_tasks DESC;'''.format(period_filter))\
+        .execution_options(stream=True)
+
     results = session.execute(sql, params)
 
     for row in results:
         auth_users.append([row.user_id, row.n_tasks])
-
-    sql = text('''SELECT count(distinct(task_run.user_id)) AS user_id
-               FROM task_run WHERE task_run.user_id IS NOT NULL AND
-               task_run.user_ip IS NULL AND
-               task_run.project_id=:project_id;''')
-    if period:
-        sql = text('''SELECT count(distinct(task_run.user_id)) AS user_id
-                   FROM task_run WHERE task_run.user_id IS NOT NULL AND
-                   task_run.user_ip IS NULL AND
-                   task_run.project_id=:project_id AND
-                   TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-                   >= NOW() - :period ::INTERVAL
-                   ;''')
-
-    results = session.execute(sql, params)
-    for row in results:
-        users['n_auth'] = row[0]
+    users['n_auth'] = len(auth_users)
 
     if app_settings.config.get('DISABLE_ANONYMOUS_ACCESS'):
         users['n_anon'] = 0
         return users, anon_users, auth_users
 
     # Get all Anonymous Users
-    sql = text('''SELECT task_run.user_ip AS user_ip,
-               COUNT(task_run.id) as n_tasks FROM task_run
-               WHERE task_run.user_ip IS NOT NULL AND
-               task_run.user_id IS NULL AND
-               task_run.project_id=:project_id
-               GROUP BY task_run.user_ip ORDER BY n_tasks DESC;''')\
+    sql = text('''SELECT user_ip, CAST(SUM(n_task_runs) AS INTEGER) AS n_tasks
+               FROM project_hourly_stats
+               WHERE user_ip IS NOT NULL AND user_id IS NULL AND
+               project_id=:project_id {}
+               GROUP BY user_ip HAVING SUM(n_task_runs) > 0
+               ORDER BY n_tasks DESC;'''.format(period_filter))\
         .execution_options(stream=True)
 
-    if period:
-        sql = text('''SELECT task_run.user_ip AS user_ip,
-                   COUNT(task_run.id) as n_tasks FROM task_run
-                   WHERE task_run.user_ip IS NOT NULL AND
-                   task_run.user_id IS NULL AND
-                   task_run.project_id=:project_id AND
-                   TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-                   >= NOW() - :period ::INTERVAL
-                   GROUP BY task_run.user_ip ORDER BY n_tasks DESC;''')\
-            .execution_options(stream=True)
-
     results = session.execute(sql, params)
 
     for row in results:
         anon_users.append([row.user_ip, row.n_tasks])
-
-    sql = text('''SELECT COUNT(DISTINCT(task_run.user_ip)) AS user_ip
-               FROM task_run WHERE task_run.user_ip IS NOT NULL AND
-               task_run.user_id IS NULL AND
-               task_run.project_id=:project_id;''')
-    if period:
-        sql = text('''SELECT COUNT(DISTINCT(task_run.user_ip)) AS user_ip
-                   FROM task_run WHERE task_run.user_ip IS NOT NULL AND
-                   task_run.user_id IS NULL AND
-                   task_run.project_id=:project_id AND
-                   TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-                   >= NOW() - :period ::INTERVAL
-                   ;''')
-
-    results = session.execute(sql, params)
-
-    for row in results:
-        users['n_anon'] = row[0]
+    users['n_anon'] = len(anon_users)
 
     return users, anon_users, auth_users
 
@@ -175,33 +128,20 @@ def stats_dates(project_id, period='15 day'):
 
     params = dict(project_id=project_id, period=period)
 
-    # Get all completed tasks
+    # Get the tasks by the day of their last answer in the period
     sql = text('''
-               WITH myquery AS (
-               SELECT task.id, coalesce(ct, 0) as n_task_runs, task.n_answers
-               FROM task LEFT OUTER JOIN
-               (SELECT task_id, COUNT(id) AS ct FROM task_run
-               WHERE project_id=:project_id AND
-               TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-               >= NOW() - :period :: INTERVAL
-               GROUP BY task_id) AS log_counts
-               ON task.id=log_counts.task_id
-               WHERE task.project_id=:project_id ORDER BY id ASC)
-               select myquery.id, max(task_run.finish_time) as day
-               from task_run, myquery where task_run.task_id=myquery.id
-               and
-               TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-               >= NOW() - :period :: INTERVAL
-               group by myquery.id order by day;
-               ''').execution_options(stream=True)
+               SELECT substr(last_finish_time, 1, 10) AS day,
+               COUNT(task_id) AS count
+               FROM task_stats WHERE project_id=:project_id AND
+               last_finish_time >= to_char((NOW() AT TIME ZONE 'UTC')
+                                           - :period ::INTERVAL,
+                                           'YYYY-MM-DD"T"HH24:MI:SS')
+               GROUP BY day;
+               ''')
 
     results = session.execute(sql, params)
     for row in results:
-        day = row.day[:10]
-        if day in dates.keys():
-            dates[day] += 1
-        else:
-            dates[day] = 1
+        dates[row.day] = row.count
 
     # No completed tasks in the last period
     def _fill_empty_days(days, obj):
@@ -218,42 +158,26 @@ def stats_dates(project_id, period='15 day'):
         dates_auth = dates # all users are auth users
         return dates, dates_anon, dates_auth
 
-    # Get all answers per date for auth
+    # Get all answers per date for auth and anon
     sql = text('''
-                WITH myquery AS (
-                    SELECT TO_DATE(finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-                    as d, COUNT(id)
-                    FROM task_run WHERE project_id=:project_id
-                    AND user_ip IS NULL AND
-                    TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-                    >= NOW() - :period :: INTERVAL
-                    GROUP BY d)
-                SELECT to_char(d, 'YYYY-MM-DD') as d, count from myquery;
-               ''').execution_options(stream=True)
+               SELECT to_char(hour, 'YYYY-MM-DD') AS d,
+               CAST(SUM(n_task_runs) FILTER (WHERE user_ip IS NULL)
+                    AS INTEGER) AS auth,
+               CAST(SUM(n_task_runs) FILTER (WHERE user_id IS NULL)
+                    AS INTEGER) AS anon
+               FROM project_hourly_stats WHERE project_id=:project_id
+               {}
+               GROUP BY d;
+               '''.format(IN_PERIOD))
 
     results = session.execute(sql, params)
     for row in results:
-        dates_auth[row.d] = row.count
+        if row.auth is not None:
+            dates_auth[row.d] = row.auth
+        if row.anon is not None:
+            dates_anon[row.d] = row.anon
 
     dates_auth = _fill_empty_days(dates_auth.keys(), dates_auth)
-
-    # Get all answers per date for anon
-    sql = text('''
-                WITH myquery AS (
-                    SELECT TO_DATE(finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-                    as d, COUNT(id)
-                    FROM task_run WHERE project_id=:project_id
-                    AND user_id IS NULL AND
-                    TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-                    >= NOW() - :period :: INTERVAL
-                    GROUP BY d)
-               SELECT to_char(d, 'YYYY-MM-DD') as d, count  from myquery;
-               ''').execution_options(stream=True)
-
-    results = session.execute(sql, params)
-    for row in results:
-        dates_anon[row.d] = row.count
-
     dates_anon = _fill_empty_days(dates_anon.keys(), dates_anon)
 
     return dates, dates_anon, dates_auth
@@ -276,130 +200,38 @@ def stats_hours(project_id, period='2 week'):
         hours_auth[str(i).zfill(2)] = 0
 
     params = dict(project_id=project_id, period=period)
-    # Get hour stats for all users
+    # Get hour stats for all, anonymous and authenticated users
     sql = text('''
-               WITH myquery AS
-                (SELECT to_char(
-                    DATE_TRUNC('hour',
-                        TO_TIMESTAMP(finish_time, 'YYYY-MM-DD"T"HH24:MI:SS.US')
-                    ),
-                    'HH24') AS h, COUNT(id)
-                    FROM task_run WHERE project_id=:project_id AND
-                    TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-                    >= NOW() - :period :: INTERVAL
-                    GROUP BY h)
-               SELECT h, count from myquery;
-               ''').execution_options(stream=True)
-
-    results = session.execute(sql, params)
-
-    for row in results:
+               SELECT to_char(hour, 'HH24') AS h,
+               CAST(SUM(n_task_runs) AS INTEGER) AS count,
+               CAST(SUM(n_task_runs) FILTER (WHERE user_id IS NULL)
+                    AS INTEGER) AS anon,
+               CAST(SUM(n_task_runs) FILTER (WHERE user_ip IS NULL)
+                    AS INTEGER) AS auth
+               FROM project_hourly_stats WHERE project_id=:project_id
+               {}
+               GROUP BY h;
+               '''.format(IN_PERIOD))
+
+    rows = session.execute(sql, params).fetchall()
+
+    for row in rows:
         hours[row.h] = row.count
-
-    # Get maximum stats for all users
-    sql = text('''
-               WITH myquery AS
-                (SELECT to_char(
-                    DATE_TRUNC('hour',
-                        TO_TIMESTAMP(finish_time, 'YYYY-MM-DD"T"HH24:MI:SS.US')
-                    ),
-                    'HH24') AS h, COUNT(id)
-                    FROM task_run WHERE project_id=:project_id  AND
-                    TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-                    >= NOW() - :period :: INTERVAL
-                    GROUP BY h)
-               SELECT max(count) from myquery;
-               ''').execution_options(stream=True)
-
-    results = session.execute(sql, params)
-    for row in results:
-        max_hours = row.max
+    max_hours = max([row.count for row in rows] or [None])
 
     if app_settings.config.get('DISABLE_ANONYMOUS_ACCESS'):
         return hours, hours_anon, hours_auth, max_hours, max_hours_anon, \
             max_hours_auth
 
-    # Get hour stats for Anonymous users
-    sql = text('''
-               WITH myquery AS
-                (SELECT to_char(
-                    DATE_TRUNC('hour',
-                        TO_TIMESTAMP(finish_time, 'YYYY-MM-DD"T"HH24:MI:SS.US')
-                    ),
-                    'HH24') AS h, COUNT(id)
-                    FROM task_run WHERE project_id=:project_id
-                    AND user_id IS NULL AND
-                    TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-                    >= NOW() - :period :: INTERVAL
-                    GROUP BY h)
-               SELECT h, count from myquery;
-               ''').execution_options(stream=True)
-
-    results = session.execute(sql, params)
-
-    for row in results:
-        hours_anon[row.h] = row.count
-
-    # Get maximum stats for Anonymous users
-    sql = text('''
-               WITH myquery AS
-                (SELECT to_char(
-                    DATE_TRUNC('hour',
-                        TO_TIMESTAMP(finish_time, 'YYYY-MM-DD"T"HH24:MI:SS.US')
-                    ),
-                    'HH24') AS h, COUNT(id)
-                    FROM task_run WHERE project_id=:project_id
-                    AND user_id IS NULL AND
-                    TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-                    >= NOW() - :period :: INTERVAL
-                    GROUP BY h)
-               SELECT max(count) from myquery;
-               ''').execution_options(stream=True)
-
-    results = session.execute(sql, params)
-    for row in results:
-        max_hours_anon = row.max
-
-    # Get hour stats for Auth users
-    sql = text('''
-               WITH myquery AS
-                (SELECT to_char(
-                    DATE_TRUNC('hour',
-                        TO_TIMESTAMP(finish_time, 'YYYY-MM-DD"T"HH24:MI:SS.US')
-                    ),
-                    'HH24') AS h, COUNT(id)
-                    FROM task_run WHERE project_id=:project_id
-                    AND user_ip IS NULL AND
-                    TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-                    >= NOW() - :period :: INTERVAL
-                    GROUP BY h)
-               SELECT h, count from myquery;
-               ''').execution_options(stream=True)
-
-    results = session.execute(sql, params)
-
-    for row in results:
-        hours_auth[row.h] = row.count
+    anon = [row for row in rows if row.anon is not None]
+    for row in anon:
+        hours_anon[row.h] = row.anon
+    max_hours_anon = max([row.anon for row in anon] or [None])
 
-    # Get hour stats for Anon users
-    sql = text('''
-               WITH myquery AS
-                (SELECT to_char(
-                    DATE_TRUNC('hour',
-                        TO_TIMESTAMP(finish_time, 'YYYY-MM-DD"T"HH24:MI:SS.US')
-                    ),
-                    'HH24') AS h, COUNT(id)
-                    FROM task_run WHERE project_id=:project_id
-                    AND user_ip IS NULL AND
-                    TO_DATE(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-                    >= NOW() - :period :: INTERVAL
-                    GROUP BY h)
-               SELECT max(count) from myquery;
-               ''').execution_options(stream=True)
-
-    results = session.execute(sql, params)
-    for row in results:
-        max_hours_auth = row.max
+    auth = [row for row in rows if row.auth is not None]
+    for row in auth:
+        hours_auth[row.h] = row.auth
+    max_hours_auth = max([row.auth for row in auth] or [None])
 
     return hours, hours_anon, hours_auth, max_hours, max_hours_anon, \
         max_hours_auth
@@ -16,13 +16,15 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
 """Cache module for projects."""
+import json
 from sqlalchemy.sql import text
 from pybossa.core import db, timeouts
 from pybossa.model.project import Project
 from pybossa.util import pretty_date, static_vars, convert_utc_to_est
 from pybossa.cache import memoize, cache, delete_memoized, delete_cached, \
     memoize_essentials, delete_memoized_essential, delete_cache_group
-from pybossa.cache.task_browse_helpers import get_task_filters, allowed_fields
+from pybossa.cache.task_browse_helpers import get_task_filters, \
+    allowed_fields, get_keyset_query, encode_cursor
 import app_settings
 
 
@@ -42,51 +44,66 @@ def get_top(n=4):
                AND project.published=True
                AND (project.info->>'passwd_hash') IS NULL
                GROUP BY project.id ORDER BY total DESC LIMIT :limit;''')
-    results = session.execute(sql, dict(limit=n))
+    results = session.execute(sql, dict(limit=n)).fetchall()
+    project_ids = [row.id for row in results]
+    volunteers = n_volunteers_many(project_ids)
+    completed = n_completed_tasks.many(project_ids)
     top_projects = []
     for row in results:
         project = dict(id=row.id, name=row.name, short_name=row.short_name,
                        description=row.description,
                        info=row.info,
-                       n_volunteers=n_volunteers(row.id),
-                       n_completed_tasks=n_completed_tasks(row.id))
+                       n_volunteers=volunteers[row.id],
+                       n_completed_tasks=completed[row.id])
 
         top_projects.append(Project().to_public_json(project))
     return top_projects
 
 
 @memoize_essentials(timeout=timeouts.get('BROWSE_TASKS_TIMEOUT'), essentials=[0],
-                    cache_group_keys=[[0]])
+                    cache_group_keys=[[0]], lock_timeout=10)
 @static_vars(allowed_fields=allowed_fields)
 def browse_tasks(project_id, args):
-    """Cache browse tasks view for a project."""
+    """Cache browse tasks view for a project.
+
+    When args has an 'after' key the page is read with keyset pagination:
+    offset is ignored, rows are sought past the decoded cursor and every
+    task gets the cursor of its own position.
+    """
     tasks = []
-    total_count = task_count(project_id, args)
+    total_count = browse_tasks_count(project_id, args)
     if not total_count:
         return total_count, tasks
 
     filters, filter_params = get_task_filters(args)
+    keyset = 'after' in args
+    limit = args.get('records_per_page') or 10
+    params = dict(project_id=project_id, limit=limit, **filter_params)
+    if keyset:
+        select, seek, order_by, seek_params = get_keyset_query(args)
+        filters += seek
+        params.update(seek_params)
+        paging = " LIMIT :limit"
+    else:
+        select = ''
+        order_by = args.get('order_by') or 'id ASC'
+        params['offset'] = args.get('offset') or 0
+        paging = " LIMIT :limit OFFSET :offset"
+
     sql = text('''
                SELECT task.id,
                coalesce(ct, 0) as n_task_runs, task.n_answers, ft,
-               priority_0, task.created, task.calibration
+               priority_0, task.created, task.calibration''' + select + '''
                FROM task LEFT OUTER JOIN
-               (SELECT task_id, CAST(COUNT(id) AS FLOAT) AS ct,
-               MAX(finish_time) as ft FROM task_run
-               WHERE project_id=:project_id GROUP BY task_id) AS log_counts
+               (SELECT task_id, CAST(n_task_runs AS FLOAT) AS ct,
+               last_finish_time as ft FROM task_stats
+               WHERE project_id=:project_id) AS log_counts
                ON task.id=log_counts.task_id
                WHERE task.project_id=:project_id''' + filters +
-               " ORDER BY %s" % (args.get('order_by') or 'id ASC') +
-               " LIMIT :limit OFFSET :offset"
+               " ORDER BY %s" % order_by + paging
                )
 
-    limit = args.get('records_per_page') or 10
-    offset = args.get('offset') or 0
-
-    results = session.execute(sql, dict(project_id=project_id,
-                                        limit=limit,
-                                        offset=offset,
-                                        **filter_params))
+    results = session.execute(sql, params)
 
     for row in results:
         # TODO: use Jinja filters to format date
@@ -100,6 +117,9 @@ def browse_tasks(project_id, args):
                     finish_time=finish_time, created=created,
                     calibration=row.calibration)
         task['pct_status'] = _pct_status(row.n_task_runs, row.n_answers)
+        if keyset:
+            task['cursor'] = encode_cursor([row[key] for key in row.keys()
+                                            if key.startswith('keyset_')])
         tasks.append(task)
     return total_count, tasks
 
@@ -109,19 +129,15 @@ def task_count(project_id, args):
     filters, filter_params = get_task_filters(args)
     sql = text('''
                 SELECT COUNT(*) AS total_count
-                FROM task WHERE task.id IN
-                (
-                SELECT task.id FROM task LEFT OUTER JOIN
+                FROM task LEFT OUTER JOIN
                     (
-                    SELECT task_id, CAST(COUNT(id) AS FLOAT) AS ct,
-                    MAX(finish_time) as ft FROM task_run
-                    WHERE project_id=:project_id GROUP BY task_id
+                    SELECT task_id, CAST(n_task_runs AS FLOAT) AS ct,
+                    last_finish_time as ft FROM task_stats
+                    WHERE project_id=:project_id
                     ) AS log_counts
                     ON task.id=log_counts.task_id
                     WHERE task.project_id=:project_id {}
-                )
                '''.format(filters))
-
     results = session.execute(sql, dict(project_id=project_id,
                                         **filter_params))
 
@@ -129,6 +145,56 @@ def task_count(project_id, args):
     return row.total_count if row else 0
 
 
+def estimate_task_count(project_id, args):
+    """Return the planner estimate of task_count(project_id, args)."""
+    filters, filter_params = get_task_filters(args)
+    sql = text('''
+               EXPLAIN (FORMAT JSON)
+               SELECT task.id
+               FROM task LEFT OUTER JOIN
+                   (
+                   SELECT task_id, CAST(n_task_runs AS FLOAT) AS ct,
+                   last_finish_time as ft FROM task_stats
+                   WHERE project_id=:project_id
+                   ) AS log_counts
+                   ON task.id=log_counts.task_id
+                   WHERE task.project_id=:project_id {}
+               '''.format(filters))
+    plan = session.execute(sql, dict(project_id=project_id,
+                                     **filter_params)).scalar()
+    if isinstance(plan, basestring):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+# Arguments that change the page but not the set of matching tasks.
+paging_args = ('offset', 'records_per_page', 'after', 'order_by',
+               'order_by_dict', 'display_columns', 'display_info_columns')
+
+
+@memoize_essentials(timeout=timeouts.get('BROWSE_TASKS_TIMEOUT'),
+                    essentials=[0], cache_group_keys=[[0]])
+def cached_task_count(project_id, filter_args):
+    """Cache task_count per project and set of filters."""
+    return task_count(project_id, filter_args)
+
+
+def browse_tasks_count(project_id, args):
+    """Return the number of tasks matching the filters of a browse page.
+
+    Counts are cached per set of filters, so paging through the results does
+    not count them again. Projects with more tasks than
+    BROWSE_TASKS_COUNT_ESTIMATE_THRESHOLD get the planner estimate instead.
+    """
+    filter_args = dict((key, value) for key, value in args.iteritems()
+                       if key not in paging_args)
+    threshold = app_settings.config.get(
+        'BROWSE_TASKS_COUNT_ESTIMATE_THRESHOLD')
+    if threshold and n_tasks(project_id) > threshold:
+        return estimate_task_count(project_id, filter_args)
+    return cached_task_count(project_id, filter_args)
+
+
 def _pct_status(n_task_runs, n_answers):
     """Return percentage status."""
     if n_answers != 0 and n_answers is not None:
@@ -139,6 +205,14 @@ def _pct_status(n_task_runs, n_answers):
     return float(0)
 
 
+def _count_many(sql, project_ids):
+    """Return a dict project_id -> count from a query grouped by project."""
+    results = session.execute(sql, dict(project_ids=list(project_ids)))
+    counts = dict.fromkeys(project_ids, 0)
+    counts.update((row[0], row[1]) for row in results)
+    return counts
+
+
 @memoize(timeout=timeouts.get('APP_TIMEOUT'))
 def first_task_id(project_id):
     """Return the oldest task id of a project"""
@@ -161,6 +235,14 @@ def n_tasks(project_id):
     return n_tasks
 
 
+@n_tasks.batch
+def _n_tasks_many(project_ids):
+    sql = text('''SELECT project_id, COUNT(task.id) AS n_tasks FROM task
+                  WHERE task.project_id = ANY(:project_ids)
+                  GROUP BY project_id;''')
+    return _count_many(sql, project_ids)
+
+
 @memoize(timeout=timeouts.get('APP_TIMEOUT'), cache_group_keys=[[0]])
 def n_completed_tasks(project_id):
     """Return number of completed tasks of a project."""
@@ -175,6 +257,16 @@ def n_completed_tasks(project_id):
     return n_completed_tasks
 
 
+@n_completed_tasks.batch
+def _n_completed_tasks_many(project_ids):
+    sql = text('''SELECT project_id, COUNT(task.id) AS n_completed_tasks
+                FROM task
+                WHERE task.project_id = ANY(:project_ids)
+                AND task.state=\'completed\'
+                GROUP BY project_id;''')
+    return _count_many(sql, project_ids)
+
+
 @memoize(timeout=timeouts.get('APP_TIMEOUT'), cache_group_keys=[[0]])
 def n_results(project_id):
     """Return number of results of a project."""
@@ -210,6 +302,17 @@ def n_registered_volunteers(project_id):
     return n_registered_volunteers
 
 
+@n_registered_volunteers.batch
+def _n_registered_volunteers_many(project_ids):
+    sql = text('''SELECT project_id, COUNT(DISTINCT(task_run.user_id))
+               AS n_registered_volunteers FROM task_run
+               WHERE task_run.user_id IS NOT NULL AND
+               task_run.user_ip IS NULL AND
+               task_run.project_id = ANY(:project_ids)
+               GROUP BY project_id;''')
+    return _count_many(sql, project_ids)
+
+
 @memoize(timeout=timeouts.get('ANON_USERS_TIMEOUT'), cache_group_keys=[[0]])
 def n_anonymous_volunteers(project_id):
     """Return number of anonymous users that have participated in a project."""
@@ -226,6 +329,17 @@ def n_anonymous_volunteers(project_id):
     return n_anonymous_volunteers
 
 
+@n_anonymous_volunteers.batch
+def _n_anonymous_volunteers_many(project_ids):
+    sql = text('''SELECT project_id, COUNT(DISTINCT(task_run.user_ip))
+               AS n_anonymous_volunteers FROM task_run
+               WHERE task_run.user_ip IS NOT NULL AND
+               task_run.user_id IS NULL AND
+               task_run.project_id = ANY(:project_ids)
+               GROUP BY project_id;''')
+    return _count_many(sql, project_ids)
+
+
 def n_volunteers(project_id):
     """Return total number of volunteers of a project."""
     total = n_registered_volunteers(project_id)
@@ -234,6 +348,16 @@ def n_volunteers(project_id):
     return total
 
 
+def n_volunteers_many(project_ids):
+    """Return a dict with the number of volunteers of each project."""
+    totals = n_registered_volunteers.many(project_ids)
+    if not app_settings.config.get('DISABLE_ANONYMOUS_ACCESS'):
+        anonymous = n_anonymous_volunteers.many(project_ids)
+        totals = dict((project_id, total + anonymous[project_id])
+                      for project_id, total in totals.iteritems())
+    return totals
+
+
 @memoize(timeout=timeouts.get('APP_TIMEOUT'), cache_group_keys=[[0]])
 def n_task_runs(project_id):
     """Return number of task_runs of a project."""
@@ -250,12 +374,9 @@ def n_task_runs(project_id):
 @memoize(timeout=timeouts.get('APP_TIMEOUT'))
 def n_remaining_task_runs(project_id):
     """Return total number of tasks runs currently remaining for a project."""
-    sql = text('''SELECT SUM(task.n_answers - COALESCE(t.actual_answers, 0))
+    sql = text('''SELECT SUM(task.n_answers - COALESCE(task_stats.n_task_runs, 0))
                   FROM task
-                  LEFT JOIN (SELECT task_id, COUNT(id) AS actual_answers
-                             FROM task_run
-                             GROUP BY task_id) AS t
-                  ON task.id = t.task_id
+                  LEFT JOIN task_stats ON task.id = task_stats.task_id
                   WHERE task.project_id=:project_id AND task.state = 'ongoing';''')
     return session.execute(sql, dict(project_id=project_id)).scalar() or 0
 
@@ -287,11 +408,47 @@ def last_activity(project_id):
             return None
 
 
+@last_activity.batch
+def _last_activity_many(project_ids):
+    sql = text('''SELECT DISTINCT ON (project_id) project_id, finish_time
+               FROM task_run WHERE project_id = ANY(:project_ids)
+               ORDER BY project_id, finish_time DESC''')
+    results = session.execute(sql, dict(project_ids=list(project_ids)))
+    activity = dict.fromkeys(project_ids)
+    activity.update((row.project_id, row.finish_time) for row in results)
+    return activity
+
+
+def listing_stats(project_ids, with_activity=True):
+    """Return the stats shown in project listings for many projects.
+
+    Every counter is read with a single batched cache lookup, and the
+    projects missing from the cache are computed with one grouped query.
+    """
+    tasks = n_tasks.many(project_ids)
+    completed = n_completed_tasks.many(project_ids)
+    volunteers = n_volunteers_many(project_ids)
+    if with_activity:
+        activity = last_activity.many(project_ids)
+    stats = dict()
+    for project_id in project_ids:
+        progress = 0
+        if tasks[project_id] != 0:
+            progress = (completed[project_id] * 100) / tasks[project_id]
+        stats[project_id] = dict(overall_progress=progress,
+                                 n_tasks=tasks[project_id],
+                                 n_volunteers=volunteers[project_id])
+        if with_activity:
+            stats[project_id].update(
+                last_activity=pretty_date(activity[project_id]),
+                last_activity_raw=activity[project_id])
+    return stats
+
+
 @memoize(timeout=timeouts.get('APP_TIMEOUT'))
 def average_contribution_time(project_id):
     sql = text('''SELECT
-        AVG(to_timestamp(finish_time, 'YYYY-MM-DD"T"HH24-MI-SS.US') -
-            to_timestamp(created, 'YYYY-MM-DD"T"HH24-MI-SS.US')) AS average_time
+        AVG(finish_time_ts - created_ts) AS average_time
         FROM task_run
         WHERE project_id=:project_id;''')
 
@@ -344,19 +501,16 @@ def get_all_featured(category=None):
            AND "user".restrict=false
            GROUP BY project.id, "user".id;''')
 
-    results = session.execute(sql)
+    results = session.execute(sql).fetchall()
+    stats = listing_stats([row.id for row in results])
     projects = []
     for row in results:
         project = dict(id=row.id, name=row.name, short_name=row.short_name,
                        created=row.created, description=row.description,
                        updated=row.updated,
-                       last_activity=pretty_date(last_activity(row.id)),
-                       last_activity_raw=last_activity(row.id),
                        owner=row.owner,
-                       overall_progress=overall_progress(row.id),
-                       n_tasks=n_tasks(row.id),
-                       n_volunteers=n_volunteers(row.id),
                        info=row.info)
+        project.update(stats[row.id])
         projects.append(Project().to_public_json(project))
     return projects
 
@@ -404,7 +558,8 @@ def get_all_draft(category=None):
            AND "user".restrict=false
            AND project.published=false;''')
 
-    results = session.execute(sql)
+    results = session.execute(sql).fetchall()
+    stats = listing_stats([row.id for row in results])
     projects = []
     for row in results:
         project = dict(id=row.id, name=row.name, short_name=row.short_name,
@@ -412,12 +567,8 @@ def get_all_draft(category=None):
                        updated=row.updated,
                        description=row.description,
                        owner=row.owner,
-                       last_activity=pretty_date(last_activity(row.id)),
-                       last_activity_raw=last_activity(row.id),
-                       overall_progress=overall_progress(row.id),
-                       n_tasks=n_tasks(row.id),
-                       n_volunteers=n_volunteers(row.id),
                        info=row.info)
+        project.update(stats[row.id])
         projects.append(Project().to_public_json(project))
     return projects
 
@@ -472,7 +623,8 @@ def get_all(category):
            AND coalesce(project.hidden, false)=false
            GROUP BY project.id, "user".id ORDER BY project.name;''')
 
-    results = session.execute(sql, dict(category=category))
+    results = session.execute(sql, dict(category=category)).fetchall()
+    stats = listing_stats([row.id for row in results])
     projects = []
     for row in results:
         project = dict(id=row.id,
@@ -482,12 +634,8 @@ def get_all(category):
                        description=row.description,
                        owner=row.owner,
                        featured=row.featured,
-                       last_activity=pretty_date(last_activity(row.id)),
-                       last_activity_raw=last_activity(row.id),
-                       overall_progress=overall_progress(row.id),
-                       n_tasks=n_tasks(row.id),
-                       n_volunteers=n_volunteers(row.id),
                        info=row.info)
+        project.update(stats[row.id])
         projects.append(Project().to_public_json(project))
     return projects
 
@@ -548,7 +696,8 @@ def text_search(search_text, show_unpublished=True, show_hidden=True):
         ORDER BY project.name;'''.format(
           'AND project.published=true' if not show_unpublished else '',
           'AND coalesce(project.hidden, false)=false' if not show_hidden else ''))
-    results = session.execute(sql, dict(search_text=search_text))
+    results = session.execute(sql, dict(search_text=search_text)).fetchall()
+    stats = listing_stats([row.id for row in results])
     projects = []
     for row in results:
         project = dict(id=row.id,
@@ -558,12 +707,8 @@ def text_search(search_text, show_unpublished=True, show_hidden=True):
                        description=row.description,
                        owner=row.owner,
                        featured=row.featured,
-                       last_activity=pretty_date(last_activity(row.id)),
-                       last_activity_raw=last_activity(row.id),
-                       overall_progress=overall_progress(row.id),
-                       n_tasks=n_tasks(row.id),
-                       n_volunteers=n_volunteers(row.id),
                        info=row.info)
+        project.update(stats[row.id])
         projects.append(Project().to_public_json(project))
     return projects
 
@@ -601,6 +746,16 @@ def get_project_data(project_id):
     return session.execute(sql, dict(project_id=project_id)).first()
 
 
+@get_project_data.batch
+def _get_project_data_many(project_ids):
+    sql = text('''SELECT id, short_name, info, owners_ids FROM project
+                WHERE id = ANY(:project_ids);''')
+    data = dict((project_id, None) for project_id in project_ids)
+    for row in session.execute(sql, dict(project_ids=project_ids)):
+        data[row.id] = row
+    return data
+
+
 def reset():
     """Clean the cache"""
     delete_cached('front_page_top_projects')
@@ -619,6 +774,7 @@ def reset():
 def delete_browse_tasks(project_id):
     """Reset browse_tasks value in cache"""
     delete_memoized_essential(browse_tasks, project_id)
+    delete_memoized_essential(cached_task_count, project_id)
 
 
 def delete_n_tasks(project_id):
@@ -691,8 +847,7 @@ def get_project_report_projectdata(project_id):
             (SELECT MIN(finish_time) FROM task_run WHERE project_id = p.id) AS first_task_submission,
             (SELECT MAX(finish_time) FROM task_run WHERE project_id = p.id) AS last_task_submission,
             (SELECT MAX(n_answers) FROM task WHERE project_id = p.id) AS redundancy,
-            (SELECT coalesce(AVG(to_timestamp(finish_time, 'YYYY-MM-DD"T"HH24-MI-SS.US') -
-            to_timestamp(created, 'YYYY-MM-DD"T"HH24-MI-SS.US')), interval '0s') FROM task_run WHERE project_id=p.id)
+            (SELECT coalesce(AVG(finish_time_ts - created_ts), interval '0s') FROM task_run WHERE project_id=p.id)
             AS average_time
             FROM project p
             WHERE p.id=:project_id;
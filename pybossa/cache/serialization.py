@@ -0,0 +1,132 @@
+# -*- coding: utf8 -*-
+# This file is part of PYBOSSA.
+#
+# Copyright (C) 2018 Scifabric LTD.
+#
+# PYBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PYBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+"""Pluggable serialization of the values stored in Redis.
+
+Plain pickles are written as they are, so they stay readable by older
+workers. Any other payload starts with a NUL byte (never the first byte of a
+pickle), the id of the codec and a flag telling whether the body is zlib
+compressed.
+
+Values that a codec cannot reproduce exactly (datetimes, tuples, int dict
+keys with JSON...) are pickled instead.
+"""
+import json
+import zlib
+
+try:
+    import cPickle as pickle
+except ImportError:  # pragma: no cover
+    import pickle
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+HEADER = '\x00'
+COMPRESSED = 'z'
+UNCOMPRESSED = '-'
+
+
+class PickleCodec(object):
+
+    id = 'p'
+
+    def dumps(self, obj):
+        return pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+
+    def loads(self, data):
+        return pickle.loads(data)
+
+
+class JSONCodec(object):
+
+    id = 'j'
+
+    def dumps(self, obj):
+        return json.dumps(obj, separators=(',', ':'))
+
+    def loads(self, data):
+        return json.loads(data)
+
+
+class MsgpackCodec(object):
+
+    id = 'm'
+
+    def __init__(self):
+        if msgpack is None:
+            raise ValueError('msgpack is not installed')
+
+    def dumps(self, obj):
+        return msgpack.packb(obj, use_bin_type=True)
+
+    def loads(self, data):
+        return msgpack.unpackb(data, raw=False)
+
+
+CODECS = dict(pickle=PickleCodec, json=JSONCodec, msgpack=MsgpackCodec)
+
+
+class Serializer(object):
+
+    """Encode values with the configured codec, optionally compressed."""
+
+    def __init__(self, codec='pickle', compress_threshold=0):
+        if codec not in CODECS:
+            raise ValueError('Unknown cache serializer: {}'.format(codec))
+        self._pickle = PickleCodec()
+        self.codec = self._pickle if codec == 'pickle' else CODECS[codec]()
+        self.compress_threshold = compress_threshold or 0
+        self._codecs = {self._pickle.id: self._pickle,
+                        self.codec.id: self.codec}
+
+    def dumps(self, obj):
+        codec, body = self._encode(obj)
+        if self.compress_threshold and len(body) >= self.compress_threshold:
+            return HEADER + codec.id + COMPRESSED + zlib.compress(body)
+        if codec is self._pickle:
+            return body
+        return HEADER + codec.id + UNCOMPRESSED + body
+
+    def loads(self, data):
+        if not data.startswith(HEADER):
+            return pickle.loads(data)
+        codec = self._codec(data[1])
+        body = data[3:]
+        if data[2] == COMPRESSED:
+            body = zlib.decompress(body)
+        return codec.loads(body)
+
+    def _encode(self, obj):
+        if self.codec is not self._pickle:
+            try:
+                body = self.codec.dumps(obj)
+                if self.codec.loads(body) == obj:
+                    return self.codec, body
+            except (TypeError, ValueError, OverflowError):
+                pass
+        return self._pickle, self._pickle.dumps(obj)
+
+    def _codec(self, codec_id):
+        if codec_id not in self._codecs:
+            # Written by a worker configured with another codec.
+            for codec_class in CODECS.values():
+                if codec_class.id == codec_id:
+                    self._codecs[codec_id] = codec_class()
+        return self._codecs[codec_id]
@@ -102,7 +102,7 @@ def get_top5_projects_24_hours():
     sql = text('''SELECT project.id, project.name, project.short_name, project.info,
                COUNT(task_run.project_id) AS n_answers FROM project, task_run
                WHERE project.id=task_run.project_id
-               AND DATE(task_run.finish_time) > current_timestamp - interval '1 day'
+               AND task_run.finish_time_ts > current_timestamp - interval '1 day'
                GROUP BY project.id
                ORDER BY n_answers DESC LIMIT 5;''')
 
@@ -123,7 +123,7 @@ def get_top5_users_24_hours():
                "user".restrict,
                COUNT(task_run.project_id) AS n_answers FROM "user", task_run
                WHERE "user".restrict=false AND "user".id=task_run.user_id
-               AND DATE(task_run.finish_time) > current_timestamp - interval '1 day'
+               AND task_run.finish_time_ts > current_timestamp - interval '1 day'
                GROUP BY "user".id
                ORDER BY n_answers DESC LIMIT 5;''')
 
@@ -152,9 +152,7 @@ def number_of_created_jobs(days=30):
     """Number of created jobs"""
     sql = text('''
         SELECT COUNT(id) FROM project
-        WHERE
-        clock_timestamp() - to_timestamp(created, 'YYYY-MM-DD"T"HH24:MI:SS.US')
-            < interval ':days days';
+        WHERE created_ts > clock_timestamp() - interval ':days days';
     ''')
     return session.execute(sql, dict(days=days)).scalar()
 
@@ -164,15 +162,8 @@ def number_of_created_jobs(days=30):
 def number_of_active_jobs(days=30):
     """Number of jobs with submissions"""
     sql = text('''
-        WITH activity AS (SELECT project.id as id,
-               MAX(task_run.finish_time) as last_activity
-            FROM project LEFT JOIN task_run
-            ON project.id = task_run.project_id
-            GROUP BY project.id)
-        SELECT COUNT(id) FROM activity
-        WHERE clock_timestamp() -
-              to_timestamp(last_activity, 'YYYY-MM-DD"T"HH24:MI:SS.US')
-            < interval ':days days';
+        SELECT COUNT(DISTINCT project_id) FROM task_run
+        WHERE finish_time_ts > clock_timestamp() - interval ':days days';
         ''')
     return session.execute(sql, dict(days=days)).scalar()
 
@@ -183,9 +174,7 @@ def number_of_created_tasks(days=30):
     """Number of created tasks"""
     sql = text('''
         SELECT count(id) FROM task
-        WHERE
-        clock_timestamp() - to_timestamp(created, 'YYYY-MM-DD"T"HH24:MI:SS.US')
-            < interval ':days days';
+        WHERE created_ts > clock_timestamp() - interval ':days days';
         ''')
     return session.execute(sql, dict(days=days)).scalar()
 
@@ -199,9 +188,8 @@ def number_of_completed_tasks(days=30):
             ON task.id = task_run.task_id
             WHERE task.state = 'completed'
             GROUP BY task.id
-            HAVING clock_timestamp() -
-                   to_timestamp(MAX(finish_time), 'YYYY-MM-DD"T"HH24:MI:SS.US')
-                   < interval ':days days')
+            HAVING MAX(finish_time_ts) >
+                   clock_timestamp() - interval ':days days')
         SELECT count(id) FROM completed;
         ''')
     return session.execute(sql, dict(days=days)).scalar()
@@ -213,9 +201,8 @@ def number_of_active_users(days=30):
     """Number of active users"""
     sql = text('''
         WITH active_users AS (SELECT DISTINCT(user_id) as id FROM task_run
-            WHERE clock_timestamp() -
-                  to_timestamp(task_run.finish_time, 'YYYY-MM-DD"T"HH24:MI:SS.US')
-                  < interval ':days days')
+            WHERE task_run.finish_time_ts >
+                  clock_timestamp() - interval ':days days')
         SELECT COUNT(id) FROM active_users;
     ''')
     return session.execute(sql, dict(days=days)).scalar()
@@ -229,9 +216,8 @@ def categories_with_new_projects(days=30):
         WITH active_categories AS(
             SELECT category.id as id FROM category JOIN project
             ON category.id = project.category_id
-            WHERE clock_timestamp() -
-                  to_timestamp(project.created, 'YYYY-MM-DD"T"HH24:MI:SS.US')
-                  < interval ':days days'
+            WHERE project.created_ts >
+                  clock_timestamp() - interval ':days days'
             GROUP BY category.id)
         SELECT COUNT(id) from active_categories;
     ''')
@@ -244,14 +230,12 @@ def avg_time_to_complete_task(days=30):
     """Average time to complete a task"""
     sql = text('''SELECT
         to_char(
-            AVG(to_timestamp(finish_time, 'YYYY-MM-DD"T"HH24-MI-SS.US') -
-                to_timestamp(created, 'YYYY-MM-DD"T"HH24-MI-SS.US')),
+            AVG(finish_time_ts - created_ts),
             'MI"m" SS"s"'
         )
         AS average_time
-        FROM task_run WHERE clock_timestamp() -
-            to_timestamp(finish_time, 'YYYY-MM-DD"T"HH24-MI-SS.US')
-            < interval ':days days';''')
+        FROM task_run
+        WHERE finish_time_ts > clock_timestamp() - interval ':days days';''')
     return session.execute(sql, dict(days=days)).scalar() or 'N/A'
 
 
@@ -263,7 +247,7 @@ def avg_task_per_job(days=0):
             project.id, count(task.id) AS ct
             FROM project LEFT OUTER JOIN task
             ON project.id = task.project_id
-            WHERE to_timestamp(task.created, 'YYYY-MM-DD"T"HH24-MI-SS.US') <
+            WHERE task.created_ts <
                 clock_timestamp() - interval ':days days'
             GROUP BY project.id) as t;
         ''')
@@ -280,7 +264,7 @@ def tasks_per_category(days=0):
             ON project.category_id = category.id
             LEFT OUTER JOIN task
             ON task.project_id = project.id
-            WHERE to_timestamp(task.created, 'YYYY-MM-DD"T"HH24-MI-SS.US') <
+            WHERE task.created_ts <
                   clock_timestamp() - interval ':days days'
             GROUP BY category.id) as t;
     ''')
@@ -302,7 +286,7 @@ def project_chart():
         )
         SELECT date, count(project.id) as num_created FROM
         dates LEFT JOIN project ON
-            to_timestamp(project.created, 'YYYY-MM-DD"T"HH24:MI:SS.US') < dates.date
+            project.created_ts < dates.date
         GROUP BY date ORDER  BY date ASC;
         ''')
     rows = session.execute(sql).fetchall()
@@ -342,7 +326,7 @@ def task_chart():
     """
     sql = text('''
         SELECT  count(id),
-        date_trunc('month', to_timestamp(created, 'YYYY-MM-DD"T"HH24:MI:SS.US'::text))
+        date_trunc('month', created_ts AT TIME ZONE 'UTC')
         AS created_monthly
         FROM task
         GROUP BY created_monthly
@@ -362,7 +346,7 @@ def submission_chart():
     """
     sql = text('''
         SELECT  count(id),
-        date_trunc('month', to_timestamp(finish_time, 'YYYY-MM-DD"T"HH24:MI:SS.US'::text))
+        date_trunc('month', finish_time_ts AT TIME ZONE 'UTC')
         AS task_run_monthly
         FROM task_run
         GROUP BY task_run_monthly
@@ -1,3 +1,4 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
 from collections import defaultdict
 import json
 import re
@@ -138,7 +139,7 @@ def is_valid_searchable_column(column_name):
     return is_valid
 
 
-@memoize(ONE_WEEK)
+@memoize(ONE_WEEK, lock_timeout=30, early_refresh=1)
 def get_searchable_columns(project_id):
     sql = text('''SELECT distinct jsonb_object_keys(info) AS col
                   FROM task
@@ -149,6 +150,78 @@ def get_searchable_columns(project_id):
         row.col for row in results if is_valid_searchable_column(row.col))
 
 
+# Sort key of every order_by expression for keyset pagination. Nullable
+# columns are sorted by (IS NULL, COALESCE) so that the row comparison of the
+# seek never meets a NULL, while keeping NULLS LAST for ASC and FIRST for DESC.
+# Every one has a matching (project_id, keys..., id) index on task. The
+# finish_time and pcomplete orders come from task_stats and cannot be
+# indexed with the task, so they keep offset pagination.
+keyset_fields = {
+    'id': ['task.id'],
+    'priority_0': ['priority_0 IS NULL', 'COALESCE(priority_0, 0)'],
+    'task.created': ['task.created IS NULL', "COALESCE(task.created, '')"]
+}
+
+_order_by_clause = re.compile(r'\s*(%s)\s+(asc|desc)\s*(?:,|$)' % '|'.join(
+    re.escape(field) for field in keyset_fields))
+
+
+def get_keyset(order_by):
+    """Return the sort keys and direction to seek through a browse order.
+
+    The task id is always the last key, so that the order is total. Return
+    None when order_by mixes directions, which a row comparison can not seek,
+    or has a field without an index to seek.
+    """
+    order_by = order_by or 'id asc'
+    clauses = []
+    pos = 0
+    while pos < len(order_by):
+        match = _order_by_clause.match(order_by, pos)
+        if not match:
+            return None
+        clauses.append(match.groups())
+        pos = match.end()
+    directions = set(direction for _, direction in clauses)
+    if len(directions) != 1:
+        return None
+    keys = [key for field, _ in clauses for key in keyset_fields[field]]
+    if 'task.id' not in keys:
+        keys.append('task.id')
+    return keys, directions.pop()
+
+
+def get_keyset_query(args):
+    """Return the select, seek filter, order by and params of a keyset page."""
+    keys, direction = get_keyset(args.get('order_by'))
+    names = ['keyset_%s' % i for i in range(len(keys))]
+    select = ''.join(', %s AS %s' % (key, name)
+                     for key, name in zip(keys, names))
+    order_by = ', '.join('%s %s' % (key, direction) for key in keys)
+    seek = ''
+    params = {}
+    if args.get('after'):
+        seek = ' AND (%s) %s (%s)' % (', '.join(keys),
+                                      '>' if direction == 'asc' else '<',
+                                      ', '.join(':' + name for name in names))
+        params = dict(zip(names, args['after']))
+    return select, seek, order_by, params
+
+
+def encode_cursor(values):
+    return urlsafe_b64encode(json.dumps(values))
+
+
+def decode_cursor(cursor):
+    try:
+        values = json.loads(urlsafe_b64decode(str(cursor)))
+    except (TypeError, ValueError):
+        raise ValueError('invalid cursor')
+    if not isinstance(values, list):
+        raise ValueError('invalid cursor')
+    return values
+
+
 allowed_fields = {
     'task_id': 'id',
     'priority': 'priority_0',
@@ -251,6 +324,17 @@ def parse_tasks_browse_args(args):
         if args['gold_task'] == 'N':
             parsed_args['gold_task'] = 0
 
+    if 'cursor' in args:
+        keyset = get_keyset(parsed_args.get('order_by'))
+        if keyset is None:
+            raise ValueError('order_by cannot be paginated with a cursor')
+        after = None
+        if args['cursor']:
+            after = decode_cursor(args['cursor'])
+            if len(after) != len(keyset[0]):
+                raise ValueError('invalid cursor')
+        parsed_args['after'] = after
+
     return parsed_args
 
 def validate_user_preferences(user_pref):
@@ -22,7 +22,7 @@ from pybossa.core import db, timeouts
 from pybossa.cache import cache, memoize, delete_memoized, ONE_DAY, ONE_WEEK
 from pybossa.util import pretty_date, exists_materialized_view
 from pybossa.model.user import User
-from pybossa.cache.projects import overall_progress, n_tasks, n_volunteers
+from pybossa.cache.projects import n_tasks, listing_stats
 from pybossa.cache.projects import n_total_tasks
 from pybossa.model.project import Project
 from pybossa.leaderboard.data import get_leaderboard as gl
@@ -139,17 +139,16 @@ def projects_contributed(user_id, order_by='name'):
                FROM project, projects_contributed
                WHERE project.id=projects_contributed.project_id ORDER BY {} DESC;
                '''.format(order_by))
-    results = session.execute(sql, dict(user_id=user_id))
+    results = session.execute(sql, dict(user_id=user_id)).fetchall()
+    stats = listing_stats([row.id for row in results], with_activity=False)
     projects_contributed = []
     for row in results:
         project = dict(id=row.id, name=row.name, short_name=row.short_name,
                        owner_id=row.owner_id,
                        owners_ids=row.owners_ids,
                        description=row.description,
-                       overall_progress=overall_progress(row.id),
-                       n_tasks=n_tasks(row.id),
-                       n_volunteers=n_volunteers(row.id),
                        info=row.info)
+        project.update(stats[row.id])
         projects_contributed.append(project)
     return projects_contributed
 
@@ -204,16 +203,15 @@ def published_projects(user_id, args=None):
                order by {column} {order};
                '''.format(**sort_args))
     projects_published = []
-    results = session.execute(sql, dict(user_id=user_id))
+    results = session.execute(sql, dict(user_id=user_id)).fetchall()
+    stats = listing_stats([row.id for row in results], with_activity=False)
     for row in results:
         project = dict(id=row.id, name=row.name, short_name=row.short_name,
                        owner_id=row.owner_id,
                        owners_ids=row.owners_ids,
                        description=row.description,
-                       overall_progress=overall_progress(row.id),
-                       n_tasks=n_tasks(row.id),
-                       n_volunteers=n_volunteers(row.id),
                        info=row.info)
+        project.update(stats[row.id])
         projects_published.append(project)
     return projects_published
 
@@ -254,16 +252,15 @@ def draft_projects(user_id):
                AND :user_id = ANY (project.owners_ids::int[]);
                ''')
     projects_draft = []
-    results = session.execute(sql, dict(user_id=user_id))
+    results = session.execute(sql, dict(user_id=user_id)).fetchall()
+    stats = listing_stats([row.id for row in results], with_activity=False)
     for row in results:
         project = dict(id=row.id, name=row.name, short_name=row.short_name,
                        owner_id=row.owner_id,
                        owners_ids=row.owners_ids,
                        description=row.description,
-                       overall_progress=overall_progress(row.id),
-                       n_tasks=n_tasks(row.id),
-                       n_volunteers=n_volunteers(row.id),
                        info=row.info)
+        project.update(stats[row.id])
         projects_draft.append(project)
     return projects_draft
 
@@ -355,8 +352,7 @@ def get_users_for_report():
                 MIN(finish_time) AS first_submission_date,
                 MAX(finish_time) AS last_submission_date,
                 (SELECT COUNT(id) FROM task_run WHERE user_id = u.id)AS completed_tasks,
-                (SELECT coalesce(AVG(to_timestamp(finish_time, 'YYYY-MM-DD"T"HH24-MI-SS.US') -
-                to_timestamp(created, 'YYYY-MM-DD"T"HH24-MI-SS.US')), interval '0s')
+                (SELECT coalesce(AVG(finish_time_ts - created_ts), interval '0s')
                 FROM task_run WHERE user_id = u.id) AS avg_time_per_task, u.consent, u.restrict
                 FROM task_run t RIGHT JOIN "user" u ON t.user_id = u.id
                 WHERE u.restrict=False and u.email_addr not like 'del-%@del.com'
@@ -397,8 +393,7 @@ def get_project_report_userdata(project_id):
             ((SELECT count(id) FROM task_run WHERE user_id = u.id AND project_id =:project_id) * 100 / :total_tasks) AS percent_completed_tasks,
             (SELECT min(finish_time) FROM task_run WHERE user_id = u.id AND project_id=:project_id) AS first_submission_date,
             (SELECT max(finish_time) FROM task_run WHERE user_id = u.id AND project_id=:project_id) AS last_submission_date,
-            (SELECT coalesce(AVG(to_timestamp(finish_time, 'YYYY-MM-DD"T"HH24-MI-SS.US') -
-            to_timestamp(created, 'YYYY-MM-DD"T"HH24-MI-SS.US')), interval '0s')
+            (SELECT coalesce(AVG(finish_time_ts - created_ts), interval '0s')
             FROM task_run WHERE user_id = u.id AND project_id=:project_id) AS avg_time_per_task
             FROM "user" u WHERE id IN
             (SELECT DISTINCT user_id FROM task_run tr GROUP BY project_id, user_id HAVING project_id=:project_id);
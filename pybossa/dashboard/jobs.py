@@ -48,12 +48,11 @@ def active_users_week():
     else:
         sql = text('''CREATE MATERIALIZED VIEW dashboard_week_users AS
                    WITH crafters_per_day AS
-                        (select to_date(task_run.finish_time,
-                                        'YYYY-MM-DD\THH24:MI:SS.US') AS day,
+                        (select (task_run.finish_time_ts
+                                 AT TIME ZONE 'UTC')::date AS day,
                                 user_id, COUNT(task_run.user_id) AS day_crafters
                         FROM task_run
-                        WHERE to_date(task_run.finish_time,
-                                      'YYYY-MM-DD\THH24:MI:SS.US')
+                        WHERE task_run.finish_time_ts
                             >= NOW() - ('1 week'):: INTERVAL
                         GROUP BY day, task_run.user_id)
                    SELECT day, COUNT(crafters_per_day.user_id) AS n_users
@@ -70,12 +69,11 @@ def active_anon_week():
     else:
         sql = text('''CREATE MATERIALIZED VIEW dashboard_week_anon AS
                    WITH crafters_per_day AS
-                        (select to_date(task_run.finish_time,
-                                        'YYYY-MM-DD\THH24:MI:SS.US') AS day,
+                        (select (task_run.finish_time_ts
+                                 AT TIME ZONE 'UTC')::date AS day,
                                 user_ip, COUNT(task_run.user_ip) AS day_crafters
                         FROM task_run
-                        WHERE to_date(task_run.finish_time,
-                                      'YYYY-MM-DD\THH24:MI:SS.US')
+                        WHERE task_run.finish_time_ts
                             >= NOW() - ('1 week'):: INTERVAL
                         GROUP BY day, task_run.user_ip)
                    SELECT day, COUNT(crafters_per_day.user_ip) AS n_users
@@ -91,13 +89,11 @@ def draft_projects_week():
         return _refresh_materialized_view('dashboard_week_project_draft')
     else:
         sql = text('''CREATE MATERIALIZED VIEW dashboard_week_project_draft AS
-                   SELECT TO_DATE(project.created, 'YYYY-MM-DD\THH24:MI:SS.US') AS day,
+                   SELECT (project.created_ts AT TIME ZONE 'UTC')::date AS day,
                    project.id, short_name, project.name,
                    owner_id, "user".name AS u_name, "user".email_addr
                    FROM project, "user"
-                   WHERE TO_DATE(project.created,
-                                'YYYY-MM-DD\THH24:MI:SS.US') >= now() -
-                                ('1 week')::INTERVAL
+                   WHERE project.created_ts >= now() - ('1 week')::INTERVAL
                    AND "user".id = project.owner_id
                    AND "user".restrict = false
                    AND project.published = false
@@ -158,11 +154,9 @@ def new_tasks_week():
         return _refresh_materialized_view('dashboard_week_new_task')
     else:
         sql = text('''CREATE MATERIALIZED VIEW dashboard_week_new_task AS
-                      SELECT TO_DATE(task.created,
-                                     'YYYY-MM-DD\THH24:MI:SS.US') AS day,
+                      SELECT (task.created_ts AT TIME ZONE 'UTC')::date AS day,
                       COUNT(task.id) AS day_tasks
-                      FROM task WHERE TO_DATE(task.created,
-                                              'YYYY-MM-DD\THH24:MI:SS.US')
+                      FROM task WHERE task.created_ts
                                           >= now() - ('1 week'):: INTERVAL
                       GROUP BY day ORDER BY day ASC;''')
         db.session.execute(sql)
@@ -176,11 +170,10 @@ def new_task_runs_week():
         return _refresh_materialized_view('dashboard_week_new_task_run')
     else:
         sql = text('''CREATE MATERIALIZED VIEW dashboard_week_new_task_run AS
-                      SELECT TO_DATE(task_run.finish_time,
-                                     'YYYY-MM-DD\THH24:MI:SS.US') AS day,
+                      SELECT (task_run.finish_time_ts
+                              AT TIME ZONE 'UTC')::date AS day,
                       COUNT(task_run.id) AS day_task_runs
-                      FROM task_run WHERE TO_DATE(task_run.finish_time,
-                                              'YYYY-MM-DD\THH24:MI:SS.US')
+                      FROM task_run WHERE task_run.finish_time_ts
                                           >= now() - ('1 week'):: INTERVAL
                       GROUP BY day;''')
         db.session.execute(sql)
@@ -214,11 +207,10 @@ def returning_users_week():
     else:
         sql = text('''CREATE MATERIALIZED VIEW dashboard_week_returning_users AS
                    WITH data AS (
-                    SELECT user_id, TO_DATE(task_run.finish_time,
-                    'YYYY-MM-DD\THH24:MI:SS.US') AS day
+                    SELECT user_id,
+                    (task_run.finish_time_ts AT TIME ZONE 'UTC')::date AS day
                    FROM task_run
-                   WHERE TO_DATE(task_run.finish_time,
-                   'YYYY-MM-DD\THH24:MI:SS.US') >= NOW()
+                   WHERE task_run.finish_time_ts >= NOW()
                    - ('1 week')::INTERVAL GROUP BY day, task_run.user_id)
                    SELECT user_id, COUNT(user_id) AS n_days
                    FROM data GROUP BY user_id HAVING(count(user_id) > 1)
@@ -63,6 +63,20 @@ REDIS_DB = 0
 
 REDIS_KEYPREFIX = 'pybossa_cache'
 
+# In-process LRU in front of the Redis cache; entries live for at most
+# CACHE_LOCAL_TIMEOUT seconds and are invalidated through Redis pub/sub
+CACHE_LOCAL = False
+CACHE_LOCAL_TIMEOUT = 5
+CACHE_LOCAL_MAX_SIZE = 10000
+
+# Codec of the cached values: pickle, json or msgpack (values the codec
+# cannot reproduce are pickled). Payloads of CACHE_COMPRESS_THRESHOLD bytes
+# or more are zlib compressed, 0 disables it. Bump CACHE_KEY_VERSION when
+# changing the codec to move to new keys instead of flushing Redis.
+CACHE_SERIALIZER = 'pickle'
+CACHE_COMPRESS_THRESHOLD = 0
+CACHE_KEY_VERSION = None
+
 ## Default cache timeouts
 # Project cache
 AVATAR_TIMEOUT = 30 * 24 * 60 * 60
@@ -74,6 +88,8 @@ STATS_APP_TIMEOUT = 12 * 60 * 60
 STATS_DRAFT_TIMEOUT = 24 * 60 * 60
 N_APPS_PER_CATEGORY_TIMEOUT = 60 * 60
 BROWSE_TASKS_TIMEOUT = 3 * 60 * 60
+# Use planner estimates to count the browse tasks of bigger projects
+BROWSE_TASKS_COUNT_ESTIMATE_THRESHOLD = None
 # Category cache
 CATEGORY_TIMEOUT = 24 * 60 * 60
 # User cache
@@ -104,6 +120,19 @@ ACCOUNT_LINK_EXPIRATION = 5 * 60 * 60
 # Rate limits default values
 LIMIT = 300
 PER = 15 * 60
+# Rate limiter: 'fixed_window' or 'gcra' (sliding window)
+RATE_LIMIT_BACKEND = 'fixed_window'
+# With gcra, requests of authenticated users reserved at once and counted in
+# the process for up to RATE_LIMIT_LOCAL_TIMEOUT seconds
+RATE_LIMIT_LOCAL_BATCH = None
+RATE_LIMIT_LOCAL_TIMEOUT = 5
+
+# Task runs embedded per task in API responses with related=True (None for
+# all of them)
+API_RELATED_TASK_RUNS_LIMIT = None
+
+# Rows read per round trip, and lines per chunk, of the NDJSON exports
+NDJSON_YIELD_PER = 1000
 
 # Disable new account confirmation (via email)
 ACCOUNT_CONFIRMATION_DISABLED = True
@@ -113,6 +142,13 @@ WEEKLY_UPDATE_STATS = 'Sunday'
 
 # Enable Server Sent Events
 SSE = False
+# Seconds between heartbeat comments of idle event streams, and messages an
+# event stream can fall behind before it is closed
+SSE_HEARTBEAT = 15
+SSE_CLIENT_QUEUE_SIZE = 100
+# Address of the event streams gateway (sse_gateway.py)
+SSE_GATEWAY_HOST = '127.0.0.1'
+SSE_GATEWAY_PORT = 5001
 
 # Pro user features. False will make the feature available to all regular users,
 # while True will make it available only to pro users
@@ -150,8 +186,33 @@ GCM_SENDER_ID = "482941778795"
 # Unpublish inactive projects
 UNPUBLISH_PROJECTS = True
 
+# Keep the open tasks of each project in a Redis sorted set so the locked
+# schedulers do not scan the whole project on every newtask request
+SCHED_READY_QUEUE = False
+SCHED_READY_QUEUE_SYNC_TTL = 24 * 60 * 60
+SCHED_READY_QUEUE_MAX_WINDOWS = 10
+
+# Seconds the per user counts of available tasks are kept in Redis; they
+# are also reset when the tasks of the project change
+AVAILABLE_TASKS_CACHE_TTL = 10 * 60
+
+# Task imports store this many rows per transaction and keep their progress
+# for this many seconds, so a failed import job resumes when run again
+IMPORT_TASKS_BATCH_SIZE = 1000
+IMPORT_TASKS_CHECKPOINT_TTL = 24 * 60 * 60
+
+# Bulk task deletes run in transactions of this many tasks, pausing while
+# the replica lags more than this many seconds behind (None to never pause)
+BULK_DELETE_BATCH_SIZE = 1000
+BULK_DELETE_MAX_REPLICATION_LAG = 10
+
 # TTL for ZIP files of personal data
 TTL_ZIP_SEC_FILES = 3
 
+# Deflate level (0-9) of exported ZIP files
+EXPORT_COMPRESS_LEVEL = 6
+# Bigger exports are uploaded and linked instead of attached to the email
+EXPORT_MAX_ATTACHMENT_SIZE = None
+
 # Default cryptopan key
 CRYPTOPAN_KEY = '32-char-str-for-AES-key-and-pad.'
@@ -29,6 +29,7 @@ import json
 from pybossa.core import uploader, task_repo, result_repo
 import tempfile
 from pybossa.uploader import local
+from pybossa.exporter.zip_stream import ZipStream
 from unidecode import unidecode
 from flask import url_for, safe_join, send_file, redirect, current_app
 from werkzeug.utils import secure_filename
@@ -131,6 +132,9 @@ class Exporter(object):
         _zip = zipfile.ZipFile(file=filename, mode='w', compression=zip_compression, allowZip64=True)
         return _zip
 
+    def _zip_compresslevel(self):
+        return current_app.config.get('EXPORT_COMPRESS_LEVEL', 6)
+
     def _make_zip(self, project, ty):
         """Generate a ZIP of a certain type and upload it"""
         pass
@@ -212,20 +216,18 @@ class Exporter(object):
         """
         name = self._project_name_latin_encoded(project)
         if obj_generator is not None:
-            with tempfile.NamedTemporaryFile() as datafile:
-                for line in obj_generator:
-                    datafile.write(str(line))
-                datafile.flush()
+            zipped_datafile = tempfile.TemporaryFile()
+            try:
+                with ZipStream(zipped_datafile,
+                               self._zip_compresslevel()) as _zip:
+                    _zip.write_iter(secure_filename('{0}_{1}.{2}'
+                                                    .format(name, obj,
+                                                            file_format)),
+                                    obj_generator)
+            finally:
                 obj_generator.close()
+            zipped_datafile.seek(0)
 
-                zipped_datafile = tempfile.NamedTemporaryFile()
-
-                with self._zip_factory(zipped_datafile.name) as _zip:
-                    _zip.write(datafile.name,
-                               secure_filename('{0}_{1}.{2}'
-                                               .format(name, obj, file_format)))
-                    _zip.content_type = 'application/zip'
-
-                filename = self.download_name(project, obj)
-                fs = FileStorage(filename=filename, stream=zipped_datafile)
-                return closing(fs)
+            filename = self.download_name(project, obj)
+            fs = FileStorage(filename=filename, stream=zipped_datafile)
+            return closing(fs)
@@ -62,6 +62,10 @@ TASK_GOLD_FIELD = [
    'task.gold_answers AS {}gold_answers'
 ]
 
+# Fields holding JSON documents, whose nested keys are exported as columns.
+JSON_FIELDS = ['task_run.info', 'task.info', 'task.user_pref',
+               'task.gold_answers', '"user".user_pref']
+
 session = db.slave_session
 
 
@@ -69,86 +73,140 @@ def _field_mapreducer(fields, prefix=''):
     return ',\n'.join(field.format(prefix) for field in fields)
 
 
-def browse_tasks_export(obj, project_id, expanded, filters):
-    """Export tasks from the browse tasks view for a project
-    using the same filters that are selected by the user
-    in the UI.
+def _browse_tasks_export_query(obj, expanded, conditions):
+    """Return the (fields, prefix) pairs and the FROM clause of the export
+    of obj, or (None, None) if obj cannot be exported.
     """
-    conditions, filter_params = get_task_filters(filters)
     if obj == 'task':
-        sql = text('''
-                   SELECT {0}
-                        , {1}
+        fields = [(TASK_FIELDS, ''), (TASK_GOLD_FIELD, '')]
+        from_clause = '''
                      FROM task
                      LEFT OUTER JOIN (
                        SELECT task_id
-                            , CAST(COUNT(id) AS FLOAT) AS ct
-                            , MAX(finish_time) as ft
-                         FROM task_run
+                            , CAST(n_task_runs AS FLOAT) AS ct
+                            , last_finish_time as ft
+                         FROM task_stats
                            WHERE project_id = :project_id
-                           GROUP BY task_id
                        ) AS log_counts
                        ON task.id = log_counts.task_id
                      WHERE project_id = :project_id
-                     {2}
-                   '''.format(_field_mapreducer(TASK_FIELDS, ''),
-                              _field_mapreducer(TASK_GOLD_FIELD, ''),
-                              conditions)
-                  )
+                     {0}
+                     '''
     elif obj == 'task_run':
         if expanded:
-           sql = text('''
-                      SELECT {0}
-                           , {1}
-                           , {2}
-                           , {3}
+            fields = [(TASKRUN_FIELDS, ''), (TASK_FIELDS, 'task__'),
+                      (USER_FIELDS, 'user__'), (TASK_GOLD_FIELD, 'task__')]
+            from_clause = '''
                         FROM task_run
                         LEFT JOIN task
                           ON task_run.task_id = task.id
                         LEFT OUTER JOIN (
                           SELECT task_id
-                               , CAST(COUNT(id) AS FLOAT) AS ct
-                               , MAX(finish_time) as ft
-                            FROM task_run
+                               , CAST(n_task_runs AS FLOAT) AS ct
+                               , last_finish_time as ft
+                            FROM task_stats
                               WHERE project_id = :project_id
-                              GROUP BY task_id
                           ) AS log_counts
                           ON task.id = log_counts.task_id
                         LEFT JOIN "user"
                           ON task_run.user_id = "user".id
                         WHERE task_run.project_id = :project_id
-                        {4}
-                      '''.format(_field_mapreducer(TASKRUN_FIELDS, ''),
-                                 _field_mapreducer(TASK_FIELDS, 'task__'),
-                                 _field_mapreducer(USER_FIELDS, 'user__'),
-                                 _field_mapreducer(TASK_GOLD_FIELD, 'task__'),
-                                 conditions)
-                     )
+                        {0}
+                        '''
         else:
-           sql = text('''
-                      SELECT {0}
-                           , {1}
+            fields = [(TASKRUN_FIELDS, ''), (TASK_GOLD_FIELD, 'task__')]
+            from_clause = '''
                         FROM task_run
                         LEFT JOIN task
                           ON task_run.task_id = task.id
                         LEFT OUTER JOIN (
                           SELECT task_id
-                               , CAST(COUNT(id) AS FLOAT) AS ct
-                               , MAX(finish_time) as ft
-                            FROM task_run
+                               , CAST(n_task_runs AS FLOAT) AS ct
+                               , last_finish_time as ft
+                            FROM task_stats
                               WHERE project_id = :project_id
-                              GROUP BY task_id
                           ) AS log_counts
                           ON task_run.task_id = log_counts.task_id
                         WHERE task_run.project_id = :project_id
-                        {2}
-                      '''.format(_field_mapreducer(TASKRUN_FIELDS, ''),
-                                 _field_mapreducer(TASK_GOLD_FIELD, 'task__'),
-                                 conditions)
-                     )
+                        {0}
+                        '''
     else:
+        return None, None
+    return fields, from_clause.format(conditions)
+
+
+def export_snapshot():
+    """Return a connection of the replica in a REPEATABLE READ
+    transaction, so that all the queries of an export see the same rows.
+    Closing it ends the transaction."""
+    conn = session.get_bind().connect().execution_options(
+        isolation_level='REPEATABLE READ')
+    conn.begin()
+    return conn
+
+
+def browse_tasks_export(obj, project_id, expanded, filters, conn=None):
+    """Export tasks from the browse tasks view for a project
+    using the same filters that are selected by the user
+    in the UI.
+    """
+    conditions, filter_params = get_task_filters(filters)
+    fields, from_clause = _browse_tasks_export_query(obj, expanded,
+                                                     conditions)
+    if fields is None:
+        return
+    sql = text('SELECT {0} {1}'.format(
+        ', '.join(_field_mapreducer(*field) for field in fields),
+        from_clause))
+    # Server side cursor: rows are fetched in batches while they are written.
+    sql = sql.execution_options(stream_results=True)
+    return (conn or session).execute(sql, dict(project_id=project_id,
+                                               **filter_params))
+
+
+def browse_tasks_export_keys(obj, project_id, expanded, filters, conn=None):
+    """Return the paths to the nested keys of the JSON fields of an export.
+
+    Paths are tuples starting with the field name, e.g.
+    ('task__info', 'answer'). The database walks the documents, so a CSV
+    export knows all its columns without reading the rows twice or keeping
+    them in memory.
+    """
+    conditions, filter_params = get_task_filters(filters)
+    fields, from_clause = _browse_tasks_export_query(obj, expanded,
+                                                     conditions)
+    if fields is None:
         return
-    return session.execute(sql, dict(project_id=project_id, **filter_params))
+    columns = []
+    for field_list, prefix in fields:
+        columns += [field.format(prefix) for field in field_list
+                    if field.split(' AS ')[0].strip() in JSON_FIELDS]
+    names = [column.split(' AS ')[1].strip() for column in columns]
+    sql = text('''
+               WITH RECURSIVE documents AS (
+                   SELECT {0} {1}
+               ), keys(path, value) AS (
+                   SELECT ARRAY[document.name, item.key],
+                   CASE jsonb_typeof(item.value)
+                   WHEN 'object' THEN item.value END
+                   FROM documents,
+                   LATERAL (VALUES {2}) AS document(name, doc),
+                   jsonb_each(CASE jsonb_typeof(document.doc)
+                              WHEN 'object' THEN document.doc END) AS item
+                   UNION ALL
+                   SELECT keys.path || item.key,
+                   CASE jsonb_typeof(item.value)
+                   WHEN 'object' THEN item.value END
+                   FROM keys, jsonb_each(keys.value) AS item
+                   WHERE keys.value IS NOT NULL
+               )
+               SELECT DISTINCT path FROM keys;
+               '''.format(', '.join(columns), from_clause,
+                          ', '.join("('{0}', documents.{0})".format(name)
+                                    for name in names)))
+    results = (conn or session).execute(sql, dict(project_id=project_id,
+                                                  **filter_params))
+    return [tuple(row.path) for row in results]
 
 
 def browse_tasks_export_count(obj, project_id, expanded, filters):
@@ -163,11 +221,10 @@ def browse_tasks_export_count(obj, project_id, expanded, filters):
                      FROM task
                      LEFT OUTER JOIN (
                        SELECT task_id
-                            , CAST(COUNT(id) AS FLOAT) AS ct
-                            , MAX(finish_time) as ft
-                         FROM task_run
+                            , CAST(n_task_runs AS FLOAT) AS ct
+                            , last_finish_time as ft
+                         FROM task_stats
                            WHERE project_id = :project_id
-                           GROUP BY task_id
                        ) AS log_counts
                        ON task.id = log_counts.task_id
                      WHERE project_id = :project_id
@@ -182,11 +239,10 @@ def browse_tasks_export_count(obj, project_id, expanded, filters):
                       ON task_run.task_id = task.id
                     LEFT OUTER JOIN (
                       SELECT task_id
-                           , CAST(COUNT(id) AS FLOAT) AS ct
-                           , MAX(finish_time) as ft
-                        FROM task_run
+                           , CAST(n_task_runs AS FLOAT) AS ct
+                           , last_finish_time as ft
+                        FROM task_stats
                           WHERE project_id = :project_id
-                          GROUP BY task_id
                       ) AS log_counts
                       ON task.id = log_counts.task_id
                     WHERE task_run.project_id = :project_id
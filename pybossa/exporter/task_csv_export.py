@@ -17,13 +17,47 @@
 # along with PyBossa.  If not, see <http://www.gnu.org/licenses/>.
 # Cache global variables for timeouts
 
-import tempfile
+import csv
+import json
+from cStringIO import StringIO
+from operator import itemgetter
 from flask import url_for, safe_join, send_file, redirect
 from pybossa.uploader import local
 from pybossa.exporter.csv_export import CsvExporter
 from pybossa.core import uploader, task_repo
-from pybossa.util import UnicodeWriter
-from export_helpers import browse_tasks_export
+from export_helpers import browse_tasks_export, browse_tasks_export_keys
+from export_helpers import export_snapshot
+
+
+def column_values(rows, index, keys):
+    """Return the values at index of rows, following keys into the nested
+    dictionaries, with None where a key is missing."""
+    values = map(itemgetter(index), rows)
+    for key in keys:
+        values = [value.get(key) if type(value) is dict else None
+                  for value in values]
+    return values
+
+
+def _encode_other(value):
+    return unicode(value).encode('utf-8')
+
+
+# Same output as UnicodeWriter, without a round trip per cell.
+CELL_ENCODERS = {dict: json.JSONEncoder().encode, int: str, long: str,
+                 float: str, bool: str, type(None): str,
+                 unicode: lambda value: value.encode('utf-8')}
+
+
+def encode_column(values):
+    """Encode the values of a column for the csv module."""
+    types = set(map(type, values))
+    if types == set([unicode]):
+        return [value.encode('utf-8') for value in values]
+    if len(types) == 1:
+        return map(CELL_ENCODERS.get(types.pop(), _encode_other), values)
+    get = CELL_ENCODERS.get
+    return [get(type(value), _encode_other)(value) for value in values]
 
 
 class TaskCsvExporter(CsvExporter):
@@ -31,6 +65,9 @@ class TaskCsvExporter(CsvExporter):
     for a project.
     """
 
+    CHUNK_SIZE = 64 * 1024
+    BATCH_SIZE = 1000
+
     @classmethod
     def get_keys(self, row, ty='', parent_key=''):
         """Recursively get keys from a dictionary.
@@ -150,21 +187,63 @@ class TaskCsvExporter(CsvExporter):
                                              headers=headers))
     def _get_csv_with_filters(self, out, writer, table, project_id,
                               expanded, filters):
-        objs = browse_tasks_export(table, project_id, expanded, filters)
-        rows = [obj for obj in objs]
+        # The header and the rows are read from one snapshot, so that no row
+        # has keys missing from the header.
+        conn = export_snapshot()
+        try:
+            paths = browse_tasks_export_keys(table, project_id, expanded,
+                                             filters, conn)
+            objs = browse_tasks_export(table, project_id, expanded, filters,
+                                       conn)
+            headers, plan = self._compile_plan(table, objs.keys(), paths)
+            writer.writerow(encode_column(headers))
+
+            for batch in iter(lambda: objs.fetchmany(self.BATCH_SIZE), []):
+                writer.writerows(self._format_batch(batch, plan))
+                if out.tell() >= self.CHUNK_SIZE:
+                    yield self._flush(out)
+            yield self._flush(out)
+        finally:
+            conn.close()
 
-        headers = self._get_all_headers(objs=rows,
-                                        expanded=expanded,
-                                        table=table,
-                                        from_obj=False)
-        writer.writerow(headers)
+    @staticmethod
+    def _compile_plan(table, columns, paths):
+        """Return the sorted headers of an export and, for each header, the
+        index of its column in the rows of the export query and the keys
+        leading to its value.
+
+        columns are the names of the columns of the query and paths the
+        paths to the nested keys of its JSON columns, as returned by
+        browse_tasks_export_keys.
+        """
+        columns = list(columns)
+        plan = {}
+        # Shorter paths first: they win if keys containing '__' make two
+        # paths share a header.
+        for path in [(column,) for column in columns] + sorted(paths,
+                                                              key=len):
+            header = table + '__' + '__'.join(path)
+            if header not in plan:
+                plan[header] = (columns.index(path[0]), path[1:])
+        headers = sorted(plan)
+        return headers, [plan[header] for header in headers]
 
-        for row in rows:
-            row = self.process_filtered_row(dict(row))
-            writer.writerow(self._format_csv_row(row, headers))
+    @staticmethod
+    def _format_batch(rows, plan):
+        """Return the encoded CSV rows of a batch of query rows, building
+        them a column at a time."""
+        columns = [encode_column(column_values(rows, index, keys))
+                   for index, keys in plan]
+        return zip(*columns)
 
+    @staticmethod
+    def _flush(out):
+        """Return what was written to out and empty it."""
+        out.seek(0)
+        chunk = out.read()
         out.seek(0)
-        yield out.read()
+        out.truncate()
+        return chunk
 
     def _get_all_headers(self, objs, expanded, table=None, from_obj=True):
         """Construct headers to **guarantee** that all headers
@@ -203,8 +282,8 @@ class TaskCsvExporter(CsvExporter):
         return headers
 
     def _respond_csv(self, ty, project_id, expanded=False, filters=None):
-        out = tempfile.TemporaryFile()
-        writer = UnicodeWriter(out)
+        out = StringIO()
+        writer = csv.writer(out)
 
         return self._get_csv_with_filters(
                     out, writer, ty, project_id, expanded, filters)
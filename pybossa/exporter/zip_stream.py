@@ -0,0 +1,168 @@
+# -*- coding: utf8 -*-
+# This file is part of PYBOSSA.
+#
+# Copyright (C) 2018 Scifabric LTD.
+#
+# PYBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PYBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+"""Write ZIP archives from iterables of chunks in a single pass.
+
+zipfile.ZipFile needs the whole member on disk (or in memory) before it can
+write its header. ZipStream writes the header first, deflates the chunks as
+they come and puts the sizes and CRC in a data descriptor after the data, so
+an export goes straight from the database cursor into one compressed file.
+Every member uses the zip64 extensions, so there is no 4 GB limit.
+"""
+import struct
+import time
+import zlib
+
+
+LOCAL_HEADER = struct.Struct('<4s2B4HL2L2H')
+DATA_DESCRIPTOR = struct.Struct('<4sLQQ')
+CENTRAL_DIRECTORY = struct.Struct('<4s4B4HL2L5H2L')
+END_OF_CENTRAL_DIRECTORY = struct.Struct('<4s4H2LH')
+ZIP64_END_OF_CENTRAL_DIRECTORY = struct.Struct('<4sQ2H2L4Q')
+ZIP64_LOCATOR = struct.Struct('<4sLQL')
+
+ZIP64_VERSION = 45
+ZIP64_EXTRA = 0x0001
+ZIP_DEFLATED = 8
+# General purpose flags: sizes in a data descriptor, UTF-8 file names.
+FLAG_DATA_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+ZIP32_LIMIT = 0xFFFFFFFF
+ZIP32_COUNT_LIMIT = 0xFFFF
+CREATE_SYSTEM_UNIX = 3
+
+
+class ZipStream(object):
+
+    """Write a deflated, zip64 ZIP archive to a file object.
+
+    The file object is only written to, never sought, so it can be a
+    temporary file as well as a socket or an upload stream.
+    """
+
+    def __init__(self, fileobj, compresslevel=zlib.Z_DEFAULT_COMPRESSION):
+        self.fileobj = fileobj
+        self.compresslevel = compresslevel
+        self._offset = 0
+        self._members = []
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write_iter(self, arcname, chunks):
+        """Add a member with the concatenation of chunks as its content.
+
+        Unicode chunks are encoded as UTF-8.
+        """
+        if isinstance(arcname, unicode):
+            arcname = arcname.encode('utf-8')
+        flags = FLAG_DATA_DESCRIPTOR
+        try:
+            arcname.decode('ascii')
+        except UnicodeDecodeError:
+            flags |= FLAG_UTF8
+        dostime, dosdate = self._dos_timestamp()
+        header_offset = self._offset
+        extra = struct.pack('<2H2Q', ZIP64_EXTRA, 16, 0, 0)
+        self._write(LOCAL_HEADER.pack(
+            'PK\003\004', ZIP64_VERSION, 0, flags, ZIP_DEFLATED, dostime,
+            dosdate, 0, ZIP32_LIMIT, ZIP32_LIMIT, len(arcname), len(extra)))
+        self._write(arcname)
+        self._write(extra)
+
+        compressor = zlib.compressobj(self.compresslevel, zlib.DEFLATED, -15)
+        crc = 0
+        file_size = 0
+        compress_size = 0
+        for chunk in chunks:
+            if isinstance(chunk, unicode):
+                chunk = chunk.encode('utf-8')
+            else:
+                chunk = str(chunk)
+            if not chunk:
+                continue
+            crc = zlib.crc32(chunk, crc)
+            file_size += len(chunk)
+            data = compressor.compress(chunk)
+            compress_size += len(data)
+            self._write(data)
+        data = compressor.flush()
+        compress_size += len(data)
+        self._write(data)
+        crc &= 0xFFFFFFFF
+
+        self._write(DATA_DESCRIPTOR.pack('PK\007\010', crc, compress_size,
+                                         file_size))
+        self._members.append((arcname, flags, dostime, dosdate, crc,
+                              compress_size, file_size, header_offset))
+
+    def writestr(self, arcname, data):
+        self.write_iter(arcname, [data])
+
+    def close(self):
+        """Write the central directory. The file object is left open."""
+        if self._closed:
+            return
+        self._closed = True
+        directory_offset = self._offset
+        for (arcname, flags, dostime, dosdate, crc, compress_size, file_size,
+             header_offset) in self._members:
+            extra = [file_size, compress_size]
+            if header_offset >= ZIP32_LIMIT:
+                extra.append(header_offset)
+                header_offset = ZIP32_LIMIT
+            extra = struct.pack('<2H%dQ' % len(extra), ZIP64_EXTRA,
+                                8 * len(extra), *extra)
+            self._write(CENTRAL_DIRECTORY.pack(
+                'PK\001\002', ZIP64_VERSION, CREATE_SYSTEM_UNIX,
+                ZIP64_VERSION, 0, flags, ZIP_DEFLATED, dostime, dosdate, crc,
+                ZIP32_LIMIT, ZIP32_LIMIT, len(arcname), len(extra), 0, 0, 0,
+                0600 << 16, header_offset))
+            self._write(arcname)
+            self._write(extra)
+        directory_size = self._offset - directory_offset
+
+        count = len(self._members)
+        if (count >= ZIP32_COUNT_LIMIT or directory_offset >= ZIP32_LIMIT or
+                directory_size >= ZIP32_LIMIT):
+            zip64_offset = self._offset
+            self._write(ZIP64_END_OF_CENTRAL_DIRECTORY.pack(
+                'PK\006\006', ZIP64_END_OF_CENTRAL_DIRECTORY.size - 12,
+                ZIP64_VERSION, ZIP64_VERSION, 0, 0, count, count,
+                directory_size, directory_offset))
+            self._write(ZIP64_LOCATOR.pack('PK\006\007', 0, zip64_offset, 1))
+            count = min(count, ZIP32_COUNT_LIMIT)
+            directory_size = min(directory_size, ZIP32_LIMIT)
+            directory_offset = min(directory_offset, ZIP32_LIMIT)
+        self._write(END_OF_CENTRAL_DIRECTORY.pack(
+            'PK\005\006', 0, 0, count, count, directory_size,
+            directory_offset, 0))
+
+    def _write(self, data):
+        self.fileobj.write(data)
+        self._offset += len(data)
+
+    @staticmethod
+    def _dos_timestamp():
+        now = time.localtime()
+        dosdate = (now.tm_year - 1980) << 9 | now.tm_mon << 5 | now.tm_mday
+        dostime = now.tm_hour << 11 | now.tm_min << 5 | now.tm_sec // 2
+        return dostime, dosdate
@@ -33,7 +33,10 @@ from flask import current_app
 from pybossa.util import check_password_strength, valid_or_no_s3_bucket
 from flask.ext.login import current_user
 from werkzeug.datastructures import MultiDict
+from rq.timeouts import JobTimeoutException
 import copy
+import hashlib
+import itertools
 import json
 from pybossa.util import delete_import_csv_file
 
@@ -154,19 +157,34 @@ class Importer(object):
 
         validator = TaskImportValidator()
         n_answers = project.get_default_n_answers()
-        for task_data in tasks:
-            task = Task(project_id=project.id, n_answers=n_answers)
-            [setattr(task, k, v) for k, v in task_data.iteritems()]
-            found = task_repo.find_duplicate(project_id=project.id,
-                                             info=task.info)
-            if found is None:
+        checkpoint = ImportCheckpoint(project.id, form_data)
+        n_rows, n, fingerprint = checkpoint.load()
+        batch_size = current_app.config.get('IMPORT_TASKS_BATCH_SIZE')
+        tasks = iter(tasks)
+        # Rows before the checkpoint were stored by an earlier, failed run.
+        # Skip them only if the source still starts with the same rows;
+        # otherwise read it again from the start and let the duplicate
+        # check leave out the tasks that were already stored.
+        if n_rows:
+            skipped = checkpoint.fingerprint(itertools.islice(tasks, n_rows))
+            if skipped != fingerprint:
+                tasks = iter(importer.tasks())
+                n_rows, fingerprint = 0, None
+        while True:
+            rows = list(itertools.islice(tasks, batch_size))
+            if not rows:
+                break
+            batch = []
+            for task_data in rows:
+                task = Task(project_id=project.id, n_answers=n_answers)
+                [setattr(task, k, v) for k, v in task_data.iteritems()]
                 if validator.validate(task):
-                    try:
-                        task_repo.save(task)
-                        n += 1
-                    except Exception as e:
-                        current_app.logger.exception(msg)
-                        validator.add_error(e.message)
+                    batch.append(task)
+            n += self._save_tasks(task_repo, project, batch, validator)
+            n_rows += len(rows)
+            fingerprint = checkpoint.fingerprint(rows, fingerprint)
+            checkpoint.save(n_rows, n, fingerprint)
+        checkpoint.clear()
 
         if form_data.get('type') == 'localCSV':
             csv_filename = form_data.get('csv_filename')
@@ -183,6 +201,29 @@ class Importer(object):
 
         return ImportReport(message=msg, metadata=metadata, total=n)
 
+    def _save_tasks(self, task_repo, project, tasks, validator):
+        """Save a batch of tasks in bulk or, if that fails, one by one so
+        that only the faulty tasks are left out."""
+        try:
+            return task_repo.save_many(project, tasks)
+        except JobTimeoutException:
+            raise
+        except Exception:
+            current_app.logger.exception('Bulk import of %d tasks to project '
+                                         '%d failed', len(tasks), project.id)
+        n = 0
+        for task in tasks:
+            found = task_repo.find_duplicate(project_id=project.id,
+                                             info=task.info)
+            if found is None:
+                try:
+                    task_repo.save(task)
+                    n += 1
+                except Exception as e:
+                    current_app.logger.exception(e)
+                    validator.add_error(e.message)
+        return n
+
     def count_tasks_to_import(self, **form_data):
         """Count tasks to import."""
         return self._create_importer_for(**form_data).count_tasks()
@@ -210,6 +251,48 @@ class Importer(object):
              if key in importers}
 
 
+class ImportCheckpoint(object):
+
+    """Number of source rows of a task import already stored, and of tasks
+    created from them, kept in Redis so that a failed import job resumes
+    where it stopped when it runs again with the same form data and the
+    source still starts with the same rows."""
+
+    KEY_PREFIX = 'pybossa:task_import:{0}:{1}'
+
+    def __init__(self, project_id, form_data):
+        from pybossa.core import sentinel
+        digest = hashlib.md5(json.dumps(form_data, sort_keys=True,
+                                        default=unicode)).hexdigest()
+        self.key = self.KEY_PREFIX.format(project_id, digest)
+        self.redis = sentinel.master
+        self.ttl = current_app.config.get('IMPORT_TASKS_CHECKPOINT_TTL')
+
+    @staticmethod
+    def fingerprint(rows, fingerprint=None):
+        """Return a digest of the source rows chained onto fingerprint."""
+        for row in rows:
+            row = json.dumps(row, sort_keys=True, default=unicode)
+            fingerprint = hashlib.md5((fingerprint or '') + row).hexdigest()
+        return fingerprint
+
+    def load(self):
+        """Return (rows, tasks, fingerprint) stored so far."""
+        checkpoint = self.redis.hgetall(self.key)
+        return (int(checkpoint.get('rows', 0)), int(checkpoint.get('tasks', 0)),
+                checkpoint.get('fingerprint'))
+
+    def save(self, rows, tasks, fingerprint):
+        pipe = self.redis.pipeline()
+        pipe.hmset(self.key, dict(rows=rows, tasks=tasks,
+                                  fingerprint=fingerprint))
+        pipe.expire(self.key, self.ttl)
+        pipe.execute()
+
+    def clear(self):
+        self.redis.delete(self.key)
+
+
 class ImportReport(object):
 
     def __init__(self, message, metadata, total):
@@ -16,10 +16,12 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
 """Jobs module for running background tasks in PYBOSSA server."""
-from datetime import datetime
+from datetime import datetime, timedelta
 import math
+import uuid
 import requests
-from flask import current_app, render_template
+from flask import current_app, render_template, url_for
+from werkzeug.datastructures import FileStorage
 from flask.ext.mail import Message, Attachment
 from pybossa.core import mail, task_repo, importer, create_app
 from pybossa.model.webhook import Webhook
@@ -149,6 +151,9 @@ def get_default_jobs():  # pragma: no cover
                timeout=timeout, queue='low')
     yield dict(name=send_email_notifications, args=[], kwargs={},
                timeout=timeout, queue='super')
+    if current_app.config.get('SCHED_READY_QUEUE'):
+        yield dict(name=sync_ready_queues, args=[], kwargs={},
+                   timeout=timeout, queue='low')
 
 
 def get_maintenance_jobs():
@@ -231,10 +236,8 @@ def get_inactive_users_jobs(queue='quaterly'):
     # First users that have participated once but more than 3 months ago
     sql = text('''SELECT user_id FROM task_run
                WHERE user_id IS NOT NULL
-               AND to_date(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-               >= NOW() - '12 month'::INTERVAL
-               AND to_date(task_run.finish_time, 'YYYY-MM-DD\THH24:MI:SS.US')
-               < NOW() - '3 month'::INTERVAL
+               AND task_run.finish_time_ts >= NOW() - '12 month'::INTERVAL
+               AND task_run.finish_time_ts < NOW() - '3 month'::INTERVAL
                GROUP BY user_id ORDER BY user_id;''')
     results = db.slave_session.execute(sql)
 
@@ -469,6 +472,21 @@ def warm_cache():  # pragma: no cover
     return True
 
 
+def sync_ready_queues(project_ids=None):
+    """Reconcile the scheduler ready queues of project_ids, or of the active
+    projects, with the DB."""
+    from pybossa import ready_queue
+    queue = ready_queue.get_ready_queue()
+    if project_ids is None:
+        project_ids = queue.synced_project_ids()
+    for project_id in project_ids:
+        n_tasks = ready_queue.sync_project(project_id)
+        queue.clear_sync_request(project_id)
+        current_app.logger.info(u'sync_ready_queues - project {} : {} tasks'
+                                .format(project_id, n_tasks))
+    return True
+
+
 def get_non_updated_projects():
     """Return a list of non updated projects excluding completed ones."""
     from sqlalchemy.sql import text
@@ -552,10 +570,7 @@ def send_mail(message_dict, mail_all=False):
 
 def delete_bulk_tasks(data):
     """Delete tasks in bulk from project."""
-    from sqlalchemy.sql import text
-    from pybossa.core import db
-    import pybossa.cache.projects as cached_projects
-    from pybossa.cache.task_browse_helpers import get_task_filters
+    from rq import get_current_job
 
     project_id = data['project_id']
     project_name = data['project_name']
@@ -563,89 +578,25 @@ def delete_bulk_tasks(data):
     coowners = data['coowners']
     current_user_fullname = data['current_user_fullname']
     force_reset = data['force_reset']
-    params = {}
-
-    # bulkdel db conn is with db user having session_replication_role
-    # when bulkdel is not configured, make explict sql query to set
-    # session replication role to replica
-    sql_session_repl = ''
-    if not 'bulkdel' in current_app.config.get('SQLALCHEMY_BINDS'):
-        sql_session_repl = 'SET session_replication_role TO replica;'
-
-    # lock tasks for given project with SELECT FOR UPDATE
-    # create temp table with all tasks to be deleted
-    # during transaction, disable constraints check with session_replication_role
-    # delete rows from child talbes first and then from parent
+    job = get_current_job()
+
+    def progress(n_deleted):
+        current_app.logger.info('Deleted %d tasks from project %d',
+                                n_deleted, project_id)
+        if job:
+            job.meta['deleted'] = n_deleted
+            job.save()
+
+    task_repo.delete_tasks_in_batches(project_id, force_reset,
+                                      data.get('filters', {}), progress)
     if not force_reset:
-        """Delete only tasks that have no results associated."""
-        sql = text('''
-                BEGIN;
-                SELECT task_id FROM counter WHERE project_id=:project_id FOR UPDATE;
-                SELECT task_id FROM task_run WHERE project_id=:project_id FOR UPDATE;
-                SELECT id FROM task WHERE project_id=:project_id FOR UPDATE;
-
-                {}
-
-                CREATE TEMP TABLE to_delete ON COMMIT DROP AS (
-                    SELECT task.id as id FROM task WHERE project_id=:project_id
-                    AND task.id NOT IN
-                    (SELECT task_id FROM result
-                    WHERE result.project_id=:project_id
-                    GROUP BY result.task_id)
-                );
-
-                DELETE FROM counter WHERE project_id=:project_id
-                        AND task_id IN (SELECT id FROM to_delete);
-                DELETE FROM task_run WHERE project_id=:project_id
-                        AND task_id IN (SELECT id FROM to_delete);
-                DELETE FROM task WHERE project_id=:project_id
-                        AND id IN (SELECT id FROM to_delete);
-
-                COMMIT;
-                '''.format(sql_session_repl))
         msg = ("Tasks and taskruns with no associated results have been "
                "deleted from project {0} by {1}"
                .format(project_name, current_user_fullname))
     else:
-        args = data.get('filters', {})
-        conditions, params = get_task_filters(args)
-        sql = text('''
-                BEGIN;
-                SELECT task_id FROM counter WHERE project_id=:project_id FOR UPDATE;
-                SELECT task_id FROM result WHERE project_id=:project_id FOR UPDATE;
-                SELECT task_id FROM task_run WHERE project_id=:project_id FOR UPDATE;
-                SELECT id FROM task WHERE project_id=:project_id FOR UPDATE;
-
-                {}
-
-                CREATE TEMP TABLE to_delete ON COMMIT DROP AS (
-                    SELECT task.id as id,
-                    coalesce(ct, 0) as n_task_runs, task.n_answers, ft,
-                    priority_0, task.created
-                    FROM task LEFT OUTER JOIN
-                    (SELECT task_id, CAST(COUNT(id) AS FLOAT) AS ct,
-                    MAX(finish_time) as ft FROM task_run
-                    WHERE project_id=:project_id GROUP BY task_id) AS log_counts
-                    ON task.id=log_counts.task_id
-                    WHERE task.project_id=:project_id {}
-                );
-
-                DELETE FROM counter WHERE project_id=:project_id
-                        AND task_id IN (SELECT id FROM to_delete);
-                DELETE FROM result WHERE project_id=:project_id
-                       AND task_id in (SELECT id FROM to_delete);
-                DELETE FROM task_run WHERE project_id=:project_id
-                       AND task_id in (SELECT id FROM to_delete);
-                DELETE FROM task WHERE task.project_id=:project_id
-                       AND id in (SELECT id FROM to_delete);
-
-                COMMIT;
-                '''.format(sql_session_repl, conditions))
         msg = ("Tasks, taskruns and results associated have been "
                "deleted from project {0} as requested by {1}"
                .format(project_name, current_user_fullname))
-    db.bulkdel_session.execute(sql, dict(project_id=project_id, **params))
-    cached_projects.clean_project(project_id)
     subject = 'Tasks deletion from %s' % project_name
     body = 'Hello,\n\n' + msg + '\n\nThe %s team.'\
         % current_app.config.get('BRAND')
@@ -698,9 +649,7 @@ def _num_tasks_imported(project_id):
     sql = text('''
         SELECT COUNT(*) FROM task WHERE
         project_id=:project_id AND
-            clock_timestamp()
-                - to_timestamp(task.created, 'YYYY-MM-DD"T"HH24:MI:SS.US')
-            < INTERVAL ':seconds seconds'
+            task.created_ts > clock_timestamp() - INTERVAL ':seconds seconds'
         ''')
     params = dict(seconds=IMPORT_TASKS_TIMEOUT + 10, project_id=project_id)
     return db.session.execute(sql, params).scalar()
@@ -800,10 +749,21 @@ def export_tasks(current_user_email_addr, short_name,
                          body=body)
         message = Message(**mail_dict)
 
-        # Attach export file to message
+        # Attach export file to message, or link it when it is too big
         if export_fn is not None:
             with export_fn(project, ty, expanded, filters) as fp:
-                message.attach(fp.filename, "application/zip", fp.read())
+                max_size = current_app.config.get('EXPORT_MAX_ATTACHMENT_SIZE')
+                if max_size and _file_size(fp.stream) > max_size:
+                    container = 'user_%d' % project.owner_id
+                    link = upload_export(fp, container)
+                    days = current_app.config.get('TTL_ZIP_SEC_FILES', 3)
+                    msg = (u'Your exported data is too big to be attached. ' +
+                           u'You can download it from {0} during the ' +
+                           u'next {1} days.').format(link, days)
+                    message.body = u'Hello,\n\n{0}\n\nThe {1} team.'.format(
+                        msg, current_app.config.get('BRAND'))
+                else:
+                    message.attach(fp.filename, "application/zip", fp.read())
 
         mail.send(message)
         job_response = u'{0} {1} file was successfully exported for: {2}'
@@ -825,6 +785,36 @@ def export_tasks(current_user_email_addr, short_name,
         raise
 
 
+def _file_size(fp):
+    position = fp.tell()
+    fp.seek(0, os.SEEK_END)
+    size = fp.tell()
+    fp.seek(position)
+    return size
+
+
+def upload_export(fp, container):
+    """Upload an export with an unguessable name and return its URL.
+
+    The file is deleted after TTL_ZIP_SEC_FILES days.
+    """
+    from pybossa.exporter.json_export import scheduler
+    filename = '%s_sec_%s' % (uuid.uuid1(), fp.filename)
+    _file = FileStorage(filename=filename, stream=fp.stream)
+    if not uploader.upload_file(_file, container=container):
+        raise IOError('Export upload failed: %s' % filename)
+    days = current_app.config.get('TTL_ZIP_SEC_FILES', 3)
+    scheduler.enqueue_in(timedelta(days=days), uploader.delete_file,
+                         filename, container)
+    upload_method = current_app.config.get('UPLOAD_METHOD')
+    if upload_method == 'local':
+        return url_for('uploads.uploaded_file',
+                       filename='%s/%s' % (container, filename),
+                       _external=True)
+    return url_for(upload_method, filename=filename, container=container,
+                   _external=True)
+
+
 def webhook(url, payload=None, oid=None):
     """Post to a webhook."""
     from flask import current_app
@@ -1009,10 +999,7 @@ def news():
     import feedparser
     from pybossa.core import sentinel
     from pybossa.news import get_news, notify_news_admins, FEED_KEY
-    try:
-        import cPickle as pickle
-    except ImportError:  # pragma: no cover
-        import pickle
+    from pybossa.cache import serializer
     urls = ['https://github.com/Scifabric/pybossa/releases.atom',
             'http://scifabric.com/blog/all.atom.xml']
     score = 0
@@ -1025,7 +1012,7 @@ def news():
         if (d.entries and (len(tmp) == 0)
            or (tmp[0]['updated'] != d.entries[0]['updated'])):
             sentinel.master.zadd(FEED_KEY, float(score),
-                                 pickle.dumps(d.entries[0]))
+                                 serializer.dumps(d.entries[0]))
             notify = True
         score += 1
     if notify:
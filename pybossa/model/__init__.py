@@ -19,6 +19,7 @@
 import datetime
 import uuid
 
+from sqlalchemy import event, DDL
 from sqlalchemy.orm import class_mapper
 
 import logging
@@ -111,3 +112,44 @@ def update_target_timestamp(mapper, conn, target):
     sql_query = ("update %s set updated='%s' where id=%s" %
                  (target.__tablename__, make_timestamp(), target.id))
     conn.execute(sql_query)
+
+
+# A plain cast: text that is not a timestamp fails the INSERT or UPDATE
+# writing it instead of leaving an empty copy. Empty text has no timestamp.
+TEXT_TO_TIMESTAMPTZ = '''
+    CREATE OR REPLACE FUNCTION text_to_timestamptz(value TEXT)
+    RETURNS TIMESTAMPTZ AS $$
+        SELECT NULLIF(value, '')::TIMESTAMP AT TIME ZONE 'UTC'
+    $$ LANGUAGE sql STABLE;
+    '''
+
+
+def add_timestamp_shadows(table, *columns):
+    """Keep a TIMESTAMPTZ copy named <column>_ts of Text timestamp columns.
+
+    The copies are filled by a trigger, so they are not mapped and raw SQL
+    can use them for indexable time range predicates. Production databases
+    get them from the matching alembic migration. The shadowed columns are
+    listed in table.info['timestamp_shadows'].
+    """
+    name = table.name
+    table.info.setdefault('timestamp_shadows', set()).update(columns)
+    assignments = ' '.join('NEW.{0}_ts := text_to_timestamptz(NEW.{0});'
+                           .format(column) for column in columns)
+    statements = [TEXT_TO_TIMESTAMPTZ]
+    statements += ['ALTER TABLE {0} ADD COLUMN {1}_ts TIMESTAMPTZ'
+                   .format(name, column) for column in columns]
+    statements.append('''
+        CREATE OR REPLACE FUNCTION {0}_timestamps() RETURNS TRIGGER AS $$
+        BEGIN
+            {1}
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+        '''.format(name, assignments))
+    statements.append('''
+        CREATE TRIGGER {0}_timestamps BEFORE INSERT OR UPDATE OF {1}
+        ON {0} FOR EACH ROW EXECUTE PROCEDURE {0}_timestamps();
+        '''.format(name, ', '.join(columns)))
+    for statement in statements:
+        event.listen(table, 'after_create', DDL(statement))
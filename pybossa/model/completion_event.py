@@ -1,4 +1,6 @@
 from pybossa.core import db, project_repo, task_repo
+from pybossa import ready_queue
+from pybossa.cache import available_tasks
 
 def mark_if_complete(task_id, project_id):
     project = project_repo.get(project_id)
@@ -9,16 +11,15 @@ def mark_if_complete(task_id, project_id):
 
     if project.published and is_task_completed(task_id):
         update_task_state(task_id)
+        ready_queue.task_completed(project_id, task_id)
+        available_tasks.project_changed(project_id)
 
 
 def is_task_completed(task_id):
-    sql_query = ('select count(id) from task_run \
-                 where task_run.task_id=:task_id')
-    n_answers = db.session.scalar(sql_query, dict(task_id=task_id))
-    sql_query = ('select n_answers from task \
+    sql_query = ('select task_stats.n_task_runs >= task.n_answers \
+                 from task join task_stats on task.id=task_stats.task_id \
                  where task.id=:task_id')
-    task_n_answers = db.session.scalar(sql_query, dict(task_id=task_id))
-    return n_answers >= task_n_answers
+    return bool(db.session.scalar(sql_query, dict(task_id=task_id)))
 
 
 def update_task_state(task_id):
@@ -20,6 +20,8 @@ from flask import current_app
 
 from rq import Queue
 from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+from sqlalchemy.sql import text
 
 from flask import url_for
 
@@ -34,18 +36,25 @@ from pybossa.model.webhook import Webhook
 from pybossa.model.user import User
 from pybossa.model.result import Result
 from pybossa.model.counter import Counter
+from pybossa.model.task_stats import TaskStats
+from pybossa.model.project_hourly_stats import ProjectHourlyStats
 from pybossa.core import result_repo, db, task_repo
 from pybossa.jobs import webhook, notify_blog_users
 from pybossa.jobs import push_notification
 from pybossa.cache import projects as cached_projects
+from pybossa.cache import available_tasks
+from pybossa.cache import project_descriptors
 
 from pybossa.core import sentinel
 from pybossa.sched import Schedulers
+from pybossa import ready_queue
 
 webhook_queue = Queue('high', connection=sentinel.master)
 mail_queue = Queue('email', connection=sentinel.master)
 webpush_queue = Queue('webpush', connection=sentinel.master)
 
+AFTER_COMMIT_KEY = 'pybossa_after_commit'
+
 
 @event.listens_for(Blogpost, 'after_insert')
 def add_blog_event(mapper, conn, target):
@@ -106,15 +115,36 @@ def add_project_event(mapper, conn, target):
     conn.execute(sql_query)
 
 
-@event.listens_for(Task, 'before_insert')
-def before_add_task_event(mapper, conn, target):
+@event.listens_for(Project, 'after_insert')
+@event.listens_for(Project, 'after_update')
+@event.listens_for(Project, 'after_delete')
+def reset_project_descriptor(mapper, conn, target):
+    """Reload the project descriptor once the changes are committed."""
+    after_commit(target, project_descriptors.project_changed, target.id)
+
+
+def mark_updated_project(project_id):
+    """Flag a project that is about to get new tasks, so its contributors
+    are told about them."""
     redis_conn = sentinel.master
-    if cached_projects.get_project_scheduler(target.project_id) == Schedulers.user_pref:
-        if not redis_conn.hget('updated_project_ids', target.project_id):
-            redis_conn.hset('updated_project_ids', target.project_id, make_timestamp())
+    if cached_projects.get_project_scheduler(project_id) == Schedulers.user_pref:
+        if not redis_conn.hget('updated_project_ids', project_id):
+            redis_conn.hset('updated_project_ids', project_id, make_timestamp())
     else:
-        if cached_projects.overall_progress(target.project_id) == 100:
-            redis_conn.hset('updated_project_ids', target.project_id, make_timestamp())
+        if cached_projects.overall_progress(project_id) == 100:
+            redis_conn.hset('updated_project_ids', project_id, make_timestamp())
+
+
+def add_tasks_event(project):
+    """Update PYBOSSA feed with new tasks of project (a dict)."""
+    obj = dict(action_updated='Task')
+    obj.update(Project().to_public_json(project))
+    update_feed(obj)
+
+
+@event.listens_for(Task, 'before_insert')
+def before_add_task_event(mapper, conn, target):
+    mark_updated_project(target.project_id)
 
 
 @event.listens_for(Task, 'after_insert')
@@ -123,16 +153,13 @@ def add_task_event(mapper, conn, target):
     sql_query = ('select name, short_name, info from project \
                  where id=%s') % target.project_id
     results = conn.execute(sql_query)
-    obj = dict(action_updated='Task')
     tmp = dict()
     for r in results:
         tmp['id'] = target.project_id
         tmp['name'] = r.name
         tmp['short_name'] = r.short_name
         tmp['info'] = r.info
-    tmp = Project().to_public_json(tmp)
-    obj.update(tmp)
-    update_feed(obj)
+    add_tasks_event(tmp)
 
 
 @event.listens_for(User, 'after_insert')
@@ -143,45 +170,90 @@ def add_user_event(mapper, conn, target):
     update_feed(obj)
 
 
-def add_user_contributed_to_feed(conn, user_id, project_obj):
-    if user_id is not None:
-        sql_query = ('select fullname, name, info from "user" \
-                     where id=%s and restrict=false') % user_id
-        results = conn.execute(sql_query)
-        tmp = None
-        for r in results:
-            tmp = dict(id=user_id,
-                       name=r.name,
-                       fullname=r.fullname,
-                       info=r.info)
-            tmp = User().to_public_json(tmp)
-            tmp['project_name'] = project_obj['name']
-            tmp['project_short_name'] = project_obj['short_name']
-            tmp['action_updated'] = 'UserContribution'
-        if tmp:
-            update_feed(tmp)
-
-
-def is_task_completed(conn, task_id, project_id):
-    sql_query = ('select count(id) from task_run \
-                 where task_run.task_id=%s and \
-                 task_run.project_id=%s') % (task_id, project_id)
-    n_answers = conn.scalar(sql_query)
-    sql_query = ('select n_answers from task \
-                 where task.id=%s') % task_id
-    task_n_answers = conn.scalar(sql_query)
-    return (n_answers) >= task_n_answers
-
-
-def update_task_state(conn, task_id):
-    task = task_repo.get_task(id=task_id)
-    if task and task.calibration == 1:
-        set_task_export(task_id)
-        return
+def after_commit(target, func, *args):
+    """Call func(*args) once the session that flushed target commits.
+
+    Side effects that leave the database (feed, webhooks, Redis queues) must
+    not fire for a transaction that is later rolled back. Callbacks are kept
+    per transaction, so rolling back a SAVEPOINT only drops its own ones.
+    Targets that are not attached to a session run the callback straight
+    away.
+    """
+    session = object_session(target)
+    if session is None:
+        return func(*args)
+    callbacks = session.info.setdefault(AFTER_COMMIT_KEY, {})
+    owner = _owner(session.transaction)
+    callbacks.setdefault(owner, []).append((func, args))
 
-    sql_query = ("UPDATE task SET state=\'completed\' \
-                 where id=%s") % task_id
-    conn.execute(sql_query)
+
+def _owner(transaction):
+    """Return the SAVEPOINT or root transaction that transaction is part of."""
+    while transaction.parent is not None and not transaction.nested:
+        transaction = transaction.parent
+    return transaction
+
+
+@event.listens_for(Session, 'after_commit')
+def run_after_commit_callbacks(session):
+    transaction = _owner(session.transaction)
+    if transaction.nested:
+        # Released SAVEPOINTs hand theirs over in after_transaction_end.
+        return
+    callbacks = session.info.get(AFTER_COMMIT_KEY, {}).pop(transaction, [])
+    for func, args in callbacks:
+        try:
+            func(*args)
+        except Exception:
+            current_app.logger.exception('after_commit callback %r failed',
+                                         func)
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_after_commit_callbacks(session):
+    transaction = _owner(session.transaction)
+    session.info.get(AFTER_COMMIT_KEY, {}).pop(transaction, None)
+
+
+@event.listens_for(Session, 'after_transaction_end')
+def hand_over_after_commit_callbacks(session, transaction):
+    callbacks = session.info.get(AFTER_COMMIT_KEY, {})
+    pending = callbacks.pop(transaction, None)
+    if pending and transaction.nested:
+        # A released SAVEPOINT commits with its enclosing transaction.
+        callbacks.setdefault(_owner(transaction.parent), []).extend(pending)
+
+
+def get_taskrun_details(conn, project_id, task_id, user_id):
+    """Return project, task and contributor columns in a single query."""
+    sql_query = text('''
+                     SELECT project.name, project.short_name,
+                     project.published, project.webhook, project.info,
+                     task.calibration, task.exported,
+                     "user".name AS user_name,
+                     "user".fullname AS user_fullname,
+                     "user".info AS user_info
+                     FROM project JOIN task ON task.project_id=project.id
+                     LEFT JOIN "user" ON "user".id=:user_id
+                     AND "user".restrict=false
+                     WHERE project.id=:project_id AND task.id=:task_id
+                     ''')
+    results = conn.execute(sql_query, dict(project_id=project_id,
+                                           task_id=task_id,
+                                           user_id=user_id))
+    return results.first()
+
+
+def user_contributed_feed(user_id, details):
+    tmp = dict(id=user_id,
+               name=details.user_name,
+               fullname=details.user_fullname,
+               info=details.user_info)
+    tmp = User().to_public_json(tmp)
+    tmp['project_name'] = details.name
+    tmp['project_short_name'] = details.short_name
+    tmp['action_updated'] = 'UserContribution'
+    return tmp
 
 
 def push_webhook(project_obj, task_id, result_id):
@@ -195,84 +267,141 @@ def push_webhook(project_obj, task_id, result_id):
         webhook_queue.enqueue(webhook, project_obj['webhook'], payload)
 
 
+# Shared tail of the completion statements. It expects a "completed" CTE with
+# the id of the task; WITH queries are not autocommitted by SQLAlchemy, hence
+# the explicit execution option when run outside of a transaction.
+RESULT_CTE = '''
+             , old_results AS (
+                 UPDATE result SET last_version=false
+                 WHERE project_id=:project_id
+                 AND task_id IN (SELECT id FROM completed))
+             INSERT INTO result
+             (created, project_id, task_id, task_run_ids, last_version)
+             SELECT :created, :project_id, completed.id,
+             ARRAY(SELECT task_run.id FROM task_run
+                   WHERE task_run.project_id=:project_id
+                   AND task_run.task_id=completed.id
+                   ORDER BY task_run.id),
+             true
+             FROM completed
+             RETURNING id;
+             '''
+
+
+def complete_task(conn, project_id, task_id):
+    """Complete the task and create its result if it has enough answers.
+
+    The completion check, the state update, the retirement of the previous
+    result and the new result insert run as one statement. Return the id of
+    the new result, or None when the task is not completed yet.
+    """
+    sql_query = text('''
+                     WITH completed AS (
+                         UPDATE task SET state='completed'
+                         FROM task_stats
+                         WHERE task.id=:task_id
+                         AND task.project_id=:project_id
+                         AND task_stats.task_id=task.id
+                         AND task_stats.n_task_runs >= task.n_answers
+                         RETURNING task.id)
+                     ''' + RESULT_CTE).execution_options(autocommit=True)
+    return conn.scalar(sql_query, dict(project_id=project_id,
+                                       task_id=task_id,
+                                       created=make_timestamp()))
+
+
 def create_result(conn, project_id, task_id):
     """Create a result for the given project and task."""
-    sql_query = ("SELECT id FROM task_run WHERE project_id=%s \
-                 AND task_id=%s") % (project_id, task_id)
-    results = conn.execute(sql_query)
-    task_run_ids = ", ".join(str(tr.id) for tr in results)
+    sql_query = text('''
+                     WITH completed AS (
+                         SELECT CAST(:task_id AS INTEGER) AS id)
+                     ''' + RESULT_CTE).execution_options(autocommit=True)
+    return conn.scalar(sql_query, dict(project_id=project_id,
+                                       task_id=task_id,
+                                       created=make_timestamp()))
 
-    sql_query = ("""SELECT id FROM result WHERE project_id=%s \
-                   AND task_id=%s;""") % (project_id, task_id)
 
-    results = conn.execute(sql_query)
-
-    for r in results:
-        if r:
-            # Update result
-            sql_query = ("""UPDATE result SET last_version=false \
-                           WHERE id=%s;""") % (r.id)
-            conn.execute(sql_query)
-
-    sql_query = """INSERT INTO result
-                   (created, project_id, task_id, task_run_ids, last_version)
-                   VALUES ('%s', %s, %s, '{%s}', %s);""" % (make_timestamp(),
-                                                  project_id,
-                                                  task_id,
-                                                  task_run_ids,
-                                                  True)
-    conn.execute(sql_query)
+@event.listens_for(TaskRun, 'after_insert')
+def increase_task_stats(mapper, conn, target):
+    """Count the new task run. Must run before on_taskrun_submit."""
+    sql_query = text('''
+                     INSERT INTO task_stats
+                     (task_id, project_id, n_task_runs, last_finish_time)
+                     VALUES (:task_id, :project_id, 1, :finish_time)
+                     ON CONFLICT (task_id) DO UPDATE
+                     SET n_task_runs=task_stats.n_task_runs + 1,
+                     last_finish_time=GREATEST(task_stats.last_finish_time,
+                                               EXCLUDED.last_finish_time);
+                     ''')
+    conn.execute(sql_query, dict(task_id=target.task_id,
+                                 project_id=target.project_id,
+                                 finish_time=target.finish_time))
 
-    sql_query = """SELECT id FROM result \
-                WHERE project_id=%s \
-                AND task_id=%s \
-                AND last_version=true""" % (project_id, task_id)
 
-    results = conn.execute(sql_query)
-    for r in results:
-        return r.id
+@event.listens_for(TaskRun, 'after_insert')
+def increase_project_hourly_stats(mapper, conn, target):
+    """Count the new task run in the hour of its finish time."""
+    sql_query = text('''
+                     INSERT INTO project_hourly_stats
+                     (project_id, hour, user_id, user_ip, n_task_runs)
+                     SELECT project_id,
+                     date_trunc('hour', finish_time_ts AT TIME ZONE 'UTC'),
+                     user_id, user_ip, 1
+                     FROM task_run
+                     WHERE id=:id AND finish_time_ts IS NOT NULL
+                     ON CONFLICT (project_id, hour, COALESCE(user_id, 0),
+                                  COALESCE(user_ip, ''))
+                     DO UPDATE
+                     SET n_task_runs=project_hourly_stats.n_task_runs + 1;
+                     ''')
+    conn.execute(sql_query, dict(id=target.id))
 
 
 @event.listens_for(TaskRun, 'after_insert')
 def on_taskrun_submit(mapper, conn, target):
     """Update the task.state when n_answers condition is met."""
-    # Get project details
-    sql_query = ('select name, short_name, published, webhook, info from project \
-                 where id=%s') % target.project_id
-    results = conn.execute(sql_query)
-    tmp = dict()
-    for r in results:
-        tmp['name'] = r.name
-        tmp['short_name'] = r.short_name
-        _published = r.published
-        tmp['info'] = r.info
-        _webhook = r.webhook
-        tmp['id'] = target.project_id
-
-    project_public = dict()
-    project_public.update(Project().to_public_json(tmp))
-    project_public['action_updated'] = 'TaskCompleted'
+    details = get_taskrun_details(conn, target.project_id, target.task_id,
+                                  target.user_id)
+    if details is None:
+        return
 
-    add_user_contributed_to_feed(conn, target.user_id, project_public)
+    if details.user_name is not None:
+        after_commit(target, update_feed,
+                     user_contributed_feed(target.user_id, details))
 
     # golden tasks never complete; bypass update to task.state
     # mark task as exported false for each task run submissions
-    task = task_repo.get_task(id=target.task_id)
-    if task and task.calibration:
-        if task.exported:
-            sql_query = ("""UPDATE task SET exported=False \
-                           WHERE id=%s;""") % (task.id)
-            conn.execute(sql_query)
+    if details.calibration:
+        if details.exported:
+            sql_query = text('''UPDATE task SET exported=false
+                             WHERE id=:task_id''')
+            conn.execute(sql_query, dict(task_id=target.task_id))
+        return
+
+    if not details.published:
         return
 
-    if is_task_completed(conn, target.task_id, target.project_id) and _published:
-        update_task_state(conn, target.task_id)
-        update_feed(project_public)
-        result_id = create_result(conn, target.project_id, target.task_id)
-        project_private = dict()
-        project_private.update(project_public)
-        project_private['webhook'] = _webhook
-        push_webhook(project_private, target.task_id, result_id)
+    result_id = complete_task(conn, target.project_id, target.task_id)
+    if result_id is None:
+        return
+
+    tmp = dict(id=target.project_id,
+               name=details.name,
+               short_name=details.short_name,
+               info=details.info)
+    project_public = dict()
+    project_public.update(Project().to_public_json(tmp))
+    project_public['action_updated'] = 'TaskCompleted'
+    project_private = dict()
+    project_private.update(project_public)
+    project_private['webhook'] = details.webhook
+
+    after_commit(target, ready_queue.task_completed,
+                 target.project_id, target.task_id)
+    after_commit(target, available_tasks.project_changed, target.project_id)
+    after_commit(target, update_feed, project_public)
+    after_commit(target, push_webhook, project_private, target.task_id,
+                 result_id)
 
 
 @event.listens_for(Blogpost, 'after_insert')
@@ -312,6 +441,15 @@ def create_zero_counter(mapper, conn, target):
     conn.execute(sql_query)
 
 
+@event.listens_for(Task, 'after_insert')
+def create_task_stats(mapper, conn, target):
+    sql_query = text('''INSERT INTO task_stats
+                     (task_id, project_id, n_task_runs)
+                     VALUES (:task_id, :project_id, 0)''')
+    conn.execute(sql_query, dict(task_id=target.id,
+                                 project_id=target.project_id))
+
+
 @event.listens_for(Task, 'after_delete')
 def delete_task_counter(mapper, conn, target):
     sql_query = ("delete from counter where project_id=%s and task_id=%s"
@@ -319,6 +457,31 @@ def delete_task_counter(mapper, conn, target):
     conn.execute(sql_query)
 
 
+@event.listens_for(Task, 'after_insert')
+@event.listens_for(Task, 'after_update')
+def update_ready_queue(mapper, conn, target):
+    ready_queue.task_saved(target)
+
+
+@event.listens_for(Task, 'after_delete')
+def remove_from_ready_queue(mapper, conn, target):
+    ready_queue.task_completed(target.project_id, target.id)
+
+
+@event.listens_for(Task, 'after_insert')
+@event.listens_for(Task, 'after_update')
+@event.listens_for(Task, 'after_delete')
+@event.listens_for(TaskRun, 'after_delete')
+def reset_available_tasks(mapper, conn, target):
+    after_commit(target, available_tasks.project_changed, target.project_id)
+
+
+@event.listens_for(TaskRun, 'after_insert')
+def decrease_available_tasks(mapper, conn, target):
+    after_commit(target, available_tasks.task_submitted, target.project_id,
+                 target.user_id, target.user_ip)
+
+
 @event.listens_for(TaskRun, 'after_insert')
 def increase_task_counter(mapper, conn, target):
     sql_query = ("insert into counter(created, project_id, task_id, n_task_runs) \
@@ -334,8 +497,28 @@ def decrease_task_counter(mapper, conn, target):
                  % (make_timestamp(), target.project_id, target.task_id))
     conn.execute(sql_query)
 
-def set_task_export(task_id):
-    sql_query = ("UPDATE task SET exported = False \
-                 where id = :task_id")
-    db.session.execute(sql_query, dict(task_id=task_id))
-    db.session.commit()
+
+@event.listens_for(TaskRun, 'after_delete')
+def decrease_task_stats(mapper, conn, target):
+    sql_query = text('''UPDATE task_stats
+                     SET n_task_runs=GREATEST(n_task_runs - 1, 0),
+                     last_finish_time=(SELECT MAX(finish_time) FROM task_run
+                                       WHERE task_id=:task_id)
+                     WHERE task_id=:task_id''')
+    conn.execute(sql_query, dict(task_id=target.task_id))
+
+
+@event.listens_for(TaskRun, 'after_delete')
+def decrease_project_hourly_stats(mapper, conn, target):
+    sql_query = text('''UPDATE project_hourly_stats
+                     SET n_task_runs=GREATEST(n_task_runs - 1, 0)
+                     WHERE project_id=:project_id
+                     AND hour=date_trunc('hour',
+                         text_to_timestamptz(CAST(:finish_time AS TEXT))
+                         AT TIME ZONE 'UTC')
+                     AND COALESCE(user_id, 0)=COALESCE(:user_id, 0)
+                     AND COALESCE(user_ip, '')=COALESCE(:user_ip, '')''')
+    conn.execute(sql_query, dict(project_id=target.project_id,
+                                 finish_time=target.finish_time,
+                                 user_id=target.user_id,
+                                 user_ip=target.user_ip))
@@ -25,7 +25,8 @@ from flask import current_app
 
 from pybossa.core import db, signer
 from pybossa.contributions_guard import ContributionsGuard
-from pybossa.model import DomainObject, make_timestamp, make_uuid
+from pybossa.model import DomainObject, make_timestamp, make_uuid, \
+    add_timestamp_shadows
 from pybossa.model.task import Task
 from pybossa.model.task_run import TaskRun
 from pybossa.model.category import Category
@@ -198,3 +199,4 @@ class Project(db.Model, DomainObject):
         return self.info.get('project_users', [])
 
 Index('project_owner_id_idx', Project.owner_id)
+add_timestamp_shadows(Project.__table__, 'created')
@@ -0,0 +1,76 @@
+# -*- coding: utf8 -*-
+# This file is part of PYBOSSA.
+#
+# Copyright (C) 2018 Scifabric LTD.
+#
+# PYBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PYBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+
+from sqlalchemy import Integer, Text, DateTime, func
+from sqlalchemy.schema import Column, ForeignKey, Index
+
+from pybossa.core import db
+from pybossa.model import DomainObject
+
+
+class ProjectHourlyStats(db.Model, DomainObject):
+    '''Number of task runs of a contributor to a Project in one hour, kept
+    up to date by the task run event listeners so the project statistics
+    do not need to aggregate the task_run table.'''
+
+    __tablename__ = 'project_hourly_stats'
+
+    #: ID
+    id = Column(Integer, primary_key=True)
+    #: Project.ID these stats belong to.
+    project_id = Column(Integer, ForeignKey('project.id', ondelete='CASCADE'),
+                        nullable=False)
+    #: UTC hour the task runs were finished in.
+    hour = Column(DateTime, nullable=False)
+    #: User.ID of the contributor, as in TaskRun.user_id.
+    user_id = Column(Integer)
+    #: IP of the contributor, as in TaskRun.user_ip.
+    user_ip = Column(Text)
+    #: Number of task runs finished in the hour.
+    n_task_runs = Column(Integer, default=0, nullable=False)
+
+
+Index('project_hourly_stats_contributor_idx', ProjectHourlyStats.project_id,
+      ProjectHourlyStats.hour, func.coalesce(ProjectHourlyStats.user_id, 0),
+      func.coalesce(ProjectHourlyStats.user_ip, ''), unique=True)
+
+
+def uncount_task_runs_sql(condition):
+    """Return SQL removing the task runs of :project_id that match condition
+    from project_hourly_stats.
+
+    Bulk deletes bypass the event listeners (and the triggers), so they run
+    this before deleting the task runs.
+    """
+    return '''
+        UPDATE project_hourly_stats
+        SET n_task_runs=GREATEST(project_hourly_stats.n_task_runs - deleted.n,
+                                 0)
+        FROM (SELECT date_trunc('hour', finish_time_ts AT TIME ZONE 'UTC')
+              AS hour, user_id, user_ip, COUNT(id) AS n
+              FROM task_run
+              WHERE project_id=:project_id AND finish_time_ts IS NOT NULL
+              AND {0}
+              GROUP BY 1, 2, 3) AS deleted
+        WHERE project_hourly_stats.project_id=:project_id
+        AND project_hourly_stats.hour=deleted.hour
+        AND COALESCE(project_hourly_stats.user_id, 0)
+            =COALESCE(deleted.user_id, 0)
+        AND COALESCE(project_hourly_stats.user_ip, '')
+            =COALESCE(deleted.user_ip, '');
+        '''.format(condition)
@@ -49,4 +49,5 @@ class Result(db.Model, DomainObject):
 
 
 Index('result_project_id_idx', Result.project_id)
+Index('result_project_id_id_idx', Result.project_id, Result.id)
 Index('result_task_id_idx', Result.task_id)
@@ -16,14 +16,16 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
 
-from sqlalchemy import Integer, Boolean, Float, UnicodeText, Text, DateTime
+from sqlalchemy import Integer, Boolean, Float, UnicodeText, Text, DateTime, \
+    event, DDL
 import sqlalchemy
 from sqlalchemy.schema import Column, ForeignKey, Index
 from sqlalchemy.orm import relationship, backref
 from sqlalchemy.dialects.postgresql import JSONB, ARRAY
 from sqlalchemy.ext.mutable import MutableList
 from pybossa.core import db
-from pybossa.model import DomainObject, make_timestamp
+from pybossa.model import DomainObject, make_timestamp, \
+    add_timestamp_shadows
 from pybossa.model.task_run import TaskRun
 
 
@@ -76,3 +78,17 @@ class Task(db.Model, DomainObject):
     )
 
 Index('task_project_id_idx', Task.project_id)
+Index('task_project_id_id_idx', Task.project_id, Task.id)
+add_timestamp_shadows(Task.__table__, 'created')
+event.listen(Task.__table__, 'after_create', DDL(
+    'CREATE INDEX task_project_id_created_ts_id_idx '
+    'ON task (project_id, created_ts, id)'))
+event.listen(Task.__table__, 'after_create', DDL(
+    'CREATE INDEX task_created_ts_brin_idx ON task USING BRIN (created_ts)'))
+# Keyset orders of the tasks browse view, see task_browse_helpers.
+event.listen(Task.__table__, 'after_create', DDL(
+    'CREATE INDEX task_project_id_priority_0_keyset_idx ON task '
+    '(project_id, (priority_0 IS NULL), (COALESCE(priority_0, 0)), id)'))
+event.listen(Task.__table__, 'after_create', DDL(
+    'CREATE INDEX task_project_id_created_keyset_idx ON task '
+    "(project_id, (created IS NULL), (COALESCE(created, '')), id)"))
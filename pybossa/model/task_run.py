@@ -16,12 +16,13 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
 
-from sqlalchemy import Integer, Text, Index
+from sqlalchemy import Integer, Text, Index, event, DDL
 from sqlalchemy.schema import Column, ForeignKey
 from sqlalchemy.dialects.postgresql import JSONB
 
 from pybossa.core import db
-from pybossa.model import DomainObject, make_timestamp
+from pybossa.model import DomainObject, make_timestamp, \
+    add_timestamp_shadows
 
 
 
@@ -62,4 +63,15 @@ class TaskRun(db.Model, DomainObject):
 Index('task_run_task_id_idx', TaskRun.task_id)
 Index('task_run_user_id_idx', TaskRun.user_id)
 Index('task_run_project_id_idx', TaskRun.project_id)
+Index('task_run_project_id_id_idx', TaskRun.project_id, TaskRun.id)
 Index('unique_user_id_task_id_idx', TaskRun.task_id, TaskRun.user_id, TaskRun.user_ip, TaskRun.external_uid, unique=True)
+add_timestamp_shadows(TaskRun.__table__, 'created', 'finish_time')
+event.listen(TaskRun.__table__, 'after_create', DDL(
+    'CREATE INDEX task_run_project_id_finish_time_ts_id_idx '
+    'ON task_run (project_id, finish_time_ts, id)'))
+event.listen(TaskRun.__table__, 'after_create', DDL(
+    'CREATE INDEX task_run_project_id_created_ts_id_idx '
+    'ON task_run (project_id, created_ts, id)'))
+event.listen(TaskRun.__table__, 'after_create', DDL(
+    'CREATE INDEX task_run_finish_time_ts_brin_idx '
+    'ON task_run USING BRIN (finish_time_ts)'))
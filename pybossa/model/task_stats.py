@@ -0,0 +1,45 @@
+# -*- coding: utf8 -*-
+# This file is part of PYBOSSA.
+#
+# Copyright (C) 2018 Scifabric LTD.
+#
+# PYBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PYBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+
+from sqlalchemy import Integer, Text
+from sqlalchemy.schema import Column, ForeignKey, Index
+
+from pybossa.core import db
+from pybossa.model import DomainObject
+
+
+class TaskStats(db.Model, DomainObject):
+    '''Number of task runs and last answer time of a Task, kept up to date
+    by the task run event listeners so the task_run table does not need to
+    be aggregated.'''
+
+    __tablename__ = 'task_stats'
+
+    #: Task.ID these stats belong to.
+    task_id = Column(Integer, ForeignKey('task.id', ondelete='CASCADE'),
+                     primary_key=True)
+    #: Project.ID of the task.
+    project_id = Column(Integer, ForeignKey('project.id', ondelete='CASCADE'),
+                        nullable=False)
+    #: Number of task runs for the task.
+    n_task_runs = Column(Integer, default=0, nullable=False)
+    #: Finish time of the last task run for the task.
+    last_finish_time = Column(Text)
+
+
+Index('task_stats_project_id_idx', TaskStats.project_id)
@@ -18,10 +18,7 @@
 # along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
 from pybossa.core import sentinel
 from pybossa.core import db
-try:
-    import cPickle as pickle
-except ImportError:  # pragma: no cover
-    import pickle
+from pybossa.cache import serializer
 
 
 FEED_KEY = 'scifabricnews'
@@ -38,7 +35,7 @@ def get_news(score=None):
                                         withscores=True)
     news = []
     for u in data:
-        tmp = pickle.loads(u[0])
+        tmp = serializer.loads(u[0])
         news.append(tmp)
     return news
 
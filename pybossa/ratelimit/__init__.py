@@ -23,7 +23,15 @@ This module exports:
     * RateLimit class: for limiting the requests
     * ratelimit decorator: for decorating the views
 
+The counting is done in Redis by one of the limiters (RATE_LIMIT_BACKEND):
+    * fixed_window: a counter per window of PER seconds
+    * gcra: a sliding window (generic cell rate algorithm), one script call
+
+With the gcra limiter, authenticated users can reserve RATE_LIMIT_LOCAL_BATCH
+requests at once, that the process then counts locally.
+
 """
+import threading
 import time
 from functools import update_wrapper, wraps
 from flask import request, g
@@ -36,21 +44,120 @@ from flask import current_app
 error = ErrorStatus()
 
 
+class FixedWindowLimiter(object):
+
+    """Count the requests of every window of per seconds."""
+
+    expiration_window = 10
+    batches = False
+
+    def hit(self, key, limit, per, cost=1):
+        """Count cost requests; return (allowed, remaining, reset)."""
+        reset = (int(time.time()) // per) * per + per
+        key = key + str(reset)
+        p = sentinel.master.pipeline()
+        p.incrby(key, cost)
+        p.expireat(key, reset + self.expiration_window)
+        current = min(p.execute()[0], limit)
+        return current < limit, limit - current, reset
+
+
+class GCRALimiter(object):
+
+    """
+    Sliding window: every request pushes the theoretical arrival time (TAT)
+    of the key per / limit seconds further, and is rejected if that leaves
+    the TAT per seconds ahead or more, so that, like the fixed window, it
+    lets limit - 1 requests through per window. A single key holds the TAT.
+
+    """
+
+    batches = True
+
+    script = """
+        local now = tonumber(ARGV[1])
+        local interval = tonumber(ARGV[2])
+        local period = tonumber(ARGV[3])
+        local tat = math.max(tonumber(redis.call('GET', KEYS[1])) or now, now)
+        local new_tat = tat + interval * tonumber(ARGV[4])
+        if new_tat - now < period then
+            redis.call('SET', KEYS[1], tostring(new_tat),
+                       'PX', math.max(math.ceil(new_tat - now), 1))
+            return {1, math.floor((period - (new_tat - now)) / interval),
+                    math.ceil(new_tat / 1000)}
+        end
+        return {0, 0, math.ceil(tat / 1000)}
+        """
+
+    def __init__(self):
+        self._script = None
+
+    def hit(self, key, limit, per, cost=1):
+        """Count cost requests; return (allowed, remaining, reset)."""
+        if self._script is None:
+            self._script = sentinel.master.register_script(self.script)
+        now = int(time.time() * 1000)
+        allowed, remaining, reset = self._script(
+            keys=[key], args=[now, per * 1000.0 / limit, per * 1000, cost],
+            client=sentinel.master)
+        return bool(allowed), int(remaining), int(reset)
+
+
+limiters = dict(fixed_window=FixedWindowLimiter(), gcra=GCRALimiter())
+
+
+class LocalTokens(object):
+
+    """Requests reserved in Redis that this process has not served yet."""
+
+    def __init__(self):
+        self._tokens = {}
+        self._lock = threading.Lock()
+
+    def take(self, key):
+        """Spend a token of key; return (remaining, reset) or None."""
+        with self._lock:
+            item = self._tokens.get(key)
+            if item is None:
+                return None
+            tokens, remaining, reset, expires = item
+            if expires < time.time():
+                del self._tokens[key]
+                return None
+            if tokens == 1:
+                del self._tokens[key]
+            else:
+                self._tokens[key] = (tokens - 1, remaining, reset, expires)
+            return remaining + tokens - 1, reset
+
+    def store(self, key, tokens, remaining, reset, timeout):
+        now = time.time()
+        with self._lock:
+            if len(self._tokens) > 10000:
+                for k in [k for k, item in self._tokens.iteritems()
+                          if item[3] < now]:
+                    del self._tokens[k]
+            self._tokens[key] = (tokens, remaining, reset, now + timeout)
+
+    def clear(self):
+        with self._lock:
+            self._tokens.clear()
+
+
+local_tokens = LocalTokens()
+
+
 class RateLimit(object):
 
     """
     Limit the number of requests.
 
-    It uses a Redis pipe from the master node (configured via Sentinel) to
-    limit the number of requests.
+    It counts the requests with the limiter set in RATE_LIMIT_BACKEND, in
+    the master node (configured via Sentinel).
 
     """
 
-    expiration_window = 10
-
     def __init__(self, key_prefix, limit, per, send_x_headers):
-        self.reset = (int(time.time()) // per) * per + per
-        self.key = key_prefix + str(self.reset)
         self.limit = limit
         self.per = per
         self.send_x_headers = send_x_headers
@@ -58,14 +165,30 @@ class RateLimit(object):
         if not current_user.is_anonymous() and current_user.admin:
             self.limit *= current_app.config.get("ADMIN_RATE_MULTIPLIER", 1)
 
-        p = sentinel.master.pipeline()
-        p.incr(self.key)
-        p.expireat(self.key, self.reset + self.expiration_window)
-
-        self.current = min(p.execute()[0], limit)
-
-    remaining = property(lambda x: x.limit - x.current)
-    over_limit = property(lambda x: x.current >= x.limit)
+        limiter = limiters[current_app.config.get('RATE_LIMIT_BACKEND',
+                                                  'fixed_window')]
+        batch = current_app.config.get('RATE_LIMIT_LOCAL_BATCH') or 1
+        if batch > 1 and limiter.batches and current_user.is_authenticated():
+            allowed, self.remaining, self.reset = self._hit_local(
+                limiter, key_prefix, batch)
+        else:
+            allowed, self.remaining, self.reset = limiter.hit(
+                key_prefix, self.limit, per)
+        self.over_limit = not allowed
+
+    def _hit_local(self, limiter, key, batch):
+        """Spend a locally reserved request, or reserve the next batch."""
+        taken = local_tokens.take(key)
+        if taken is not None:
+            remaining, reset = taken
+            return True, remaining, reset
+        allowed, remaining, reset = limiter.hit(key, self.limit, self.per,
+                                                batch)
+        if not allowed:
+            return limiter.hit(key, self.limit, self.per)
+        local_tokens.store(key, batch - 1, remaining, reset,
+                           current_app.config.get('RATE_LIMIT_LOCAL_TIMEOUT'))
+        return True, remaining + batch - 1, reset
 
 
 def get_view_rate_limit():
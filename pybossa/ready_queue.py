@@ -0,0 +1,237 @@
+# -*- coding: utf8 -*-
+# This file is part of PYBOSSA.
+#
+# Copyright (C) 2018 Scifabric LTD.
+#
+# PYBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PYBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+"""Redis resident ready queue of open tasks for the locked schedulers.
+
+For every project two sorted sets are kept, one for regular tasks and one for
+calibration (gold) tasks. Members are task ids scored so that the natural
+sorted set order matches the locked scheduler order: priority_0 DESC, id ASC.
+The sets are maintained incrementally by the model event listeners and
+rebuilt from Postgres by the sync_ready_queues job, periodically and when a
+scheduling request finds them invalidated.
+"""
+from flask import current_app
+from sqlalchemy import text
+
+
+class ReadyQueue(object):
+
+    KEY_PREFIX = 'pybossa:sched:ready:{0}:{1}'
+    SYNCED_KEY_PREFIX = 'pybossa:sched:ready:{0}:synced'
+    SYNC_REQUESTED_KEY_PREFIX = 'pybossa:sched:ready:{0}:sync_requested'
+    REBUILD_LOCK_KEY_PREFIX = 'pybossa:sched:ready:{0}:rebuilding'
+    TASKS = 'tasks'
+    GOLD = 'gold'
+    # priority_0 is quantized so that (priority, id) fits in the 53 bits of
+    # a double; ids above ID_SCALE only lose the id tie break.
+    PRIORITY_SCALE = 10 ** 6
+    ID_SCALE = 10 ** 9
+    SYNC_TTL = 24 * 60 * 60
+    REBUILD_LOCK_TTL = 60
+    BATCH_SIZE = 1000
+
+    def __init__(self, redis_conn, sync_ttl=None):
+        self.conn = redis_conn
+        if sync_ttl:
+            self.SYNC_TTL = sync_ttl
+
+    @classmethod
+    def score(cls, task_id, priority_0):
+        """Return the sorted set score for a task."""
+        priority = min(1.0, max(0.0, priority_0 or 0))
+        bucket = int(round((1.0 - priority) * cls.PRIORITY_SCALE))
+        return bucket * cls.ID_SCALE + int(task_id)
+
+    def add(self, project_id, task_id, priority_0, calibration,
+            pipeline=None):
+        """Add (or re-score) an open task."""
+        conn = pipeline or self.conn
+        kind = self.GOLD if calibration else self.TASKS
+        other = self.TASKS if calibration else self.GOLD
+        conn.zadd(self._key(project_id, kind),
+                  self.score(task_id, priority_0), task_id)
+        conn.zrem(self._key(project_id, other), task_id)
+
+    def remove(self, project_id, task_id, pipeline=None):
+        """Remove a task that can no longer be scheduled."""
+        conn = pipeline or self.conn
+        conn.zrem(self._key(project_id, self.TASKS), task_id)
+        conn.zrem(self._key(project_id, self.GOLD), task_id)
+
+    def windows(self, project_id, gold_first, size):
+        """Yield lists of candidate task ids in scheduling order.
+
+        Regular tasks go before gold tasks unless gold_first is set, which
+        mirrors the ORDER BY task.calibration of the locked scheduler.
+        """
+        kinds = [self.TASKS, self.GOLD]
+        if gold_first:
+            kinds.reverse()
+        for kind in kinds:
+            key = self._key(project_id, kind)
+            start = 0
+            while True:
+                task_ids = self.conn.zrange(key, start, start + size - 1)
+                if not task_ids:
+                    break
+                yield [int(task_id) for task_id in task_ids]
+                if len(task_ids) < size:
+                    break
+                start += size
+
+    def count(self, project_id):
+        return (self.conn.zcard(self._key(project_id, self.TASKS)) +
+                self.conn.zcard(self._key(project_id, self.GOLD)))
+
+    def is_synced(self, project_id):
+        return bool(self.conn.exists(self._synced_key(project_id)))
+
+    def invalidate(self, project_id):
+        """Force a rebuild from Postgres on the next scheduling request."""
+        self.conn.delete(self._synced_key(project_id))
+
+    def rebuild(self, project_id, rows):
+        """Atomically replace the queues of a project.
+
+        :param rows: iterable of (task_id, priority_0, calibration)
+        """
+        tmp_keys = {}
+        pipeline = self.conn.pipeline(transaction=False)
+        n_rows = 0
+        for task_id, priority_0, calibration in rows:
+            kind = self.GOLD if calibration else self.TASKS
+            tmp_key = tmp_keys.setdefault(kind, self._key(project_id, kind) + ':tmp')
+            pipeline.zadd(tmp_key, self.score(task_id, priority_0), task_id)
+            n_rows += 1
+            if n_rows % self.BATCH_SIZE == 0:
+                pipeline.execute()
+        pipeline.execute()
+
+        pipeline = self.conn.pipeline(transaction=True)
+        for kind in (self.TASKS, self.GOLD):
+            key = self._key(project_id, kind)
+            if kind in tmp_keys:
+                pipeline.rename(tmp_keys[kind], key)
+                pipeline.expire(key, self.SYNC_TTL)
+            else:
+                pipeline.delete(key)
+        pipeline.setex(self._synced_key(project_id), self.SYNC_TTL, n_rows)
+        pipeline.execute()
+        return n_rows
+
+    def acquire_rebuild_lock(self, project_id):
+        key = self.REBUILD_LOCK_KEY_PREFIX.format(project_id)
+        return bool(self.conn.set(key, 1, nx=True, ex=self.REBUILD_LOCK_TTL))
+
+    def release_rebuild_lock(self, project_id):
+        self.conn.delete(self.REBUILD_LOCK_KEY_PREFIX.format(project_id))
+
+    def request_sync(self, project_id):
+        """Return True if no rebuild of the project was requested in the last
+        REBUILD_LOCK_TTL seconds, and record this one."""
+        key = self.SYNC_REQUESTED_KEY_PREFIX.format(project_id)
+        return bool(self.conn.set(key, 1, nx=True, ex=self.REBUILD_LOCK_TTL))
+
+    def clear_sync_request(self, project_id):
+        self.conn.delete(self.SYNC_REQUESTED_KEY_PREFIX.format(project_id))
+
+    def synced_project_ids(self):
+        """Return the ids of the projects with a live ready queue."""
+        from pybossa.sentinel import scan_iter
+        pattern = self.SYNCED_KEY_PREFIX.format('*')
+        return [int(key.split(':')[3])
+                for key in scan_iter(self.conn, match=pattern, count=1000)]
+
+    def _key(self, project_id, kind):
+        return self.KEY_PREFIX.format(project_id, kind)
+
+    def _synced_key(self, project_id):
+        return self.SYNCED_KEY_PREFIX.format(project_id)
+
+
+def is_enabled():
+    return bool(current_app.config.get('SCHED_READY_QUEUE'))
+
+
+def get_ready_queue():
+    from pybossa.core import sentinel
+    return ReadyQueue(sentinel.master,
+                      current_app.config.get('SCHED_READY_QUEUE_SYNC_TTL'))
+
+
+def open_tasks_rows(session, project_id):
+    """Return (id, priority_0, calibration) for the open tasks of a project."""
+    sql = text('''
+               SELECT id, priority_0, calibration FROM task
+               WHERE project_id=:project_id
+               AND state != 'completed'
+               AND ((expiration IS NULL) OR
+                    (expiration > (now() at time zone 'utc')::timestamp));
+               ''')
+    return session.execute(sql, dict(project_id=project_id))
+
+
+def sync_project(project_id, session=None):
+    """Rebuild the ready queue of a project from Postgres.
+
+    Return the number of queued tasks, or None when another worker is already
+    rebuilding it.
+    """
+    if session is None:
+        from pybossa.core import db
+        session = db.slave_session
+    queue = get_ready_queue()
+    if not queue.acquire_rebuild_lock(project_id):
+        return None
+    try:
+        return queue.rebuild(project_id, open_tasks_rows(session, project_id))
+    finally:
+        queue.release_rebuild_lock(project_id)
+
+
+def request_sync(project_id):
+    """Rebuild the ready queue of a project in the sync_ready_queues job,
+    instead of in the scheduling request that found it out of sync."""
+    from pybossa.jobs import enqueue_job, sync_ready_queues
+    if not get_ready_queue().request_sync(project_id):
+        return
+    enqueue_job(dict(name=sync_ready_queues, args=[[project_id]], kwargs={},
+                     timeout=current_app.config.get('TIMEOUT'), queue='low'))
+
+
+def task_saved(task):
+    """Keep the ready queue in sync after a task insert or update."""
+    if not is_enabled():
+        return
+    queue = get_ready_queue()
+    if task.state == u'completed':
+        queue.remove(task.project_id, task.id)
+    elif queue.is_synced(task.project_id):
+        queue.add(task.project_id, task.id, task.priority_0, task.calibration)
+
+
+def task_completed(project_id, task_id):
+    if not is_enabled():
+        return
+    get_ready_queue().remove(project_id, task_id)
+
+
+def project_changed(project_id):
+    """Invalidate the ready queue after bulk SQL updates of a project."""
+    if not is_enabled():
+        return
+    get_ready_queue().invalidate(project_id)
@@ -4,6 +4,55 @@ from datetime import timedelta
 
 ACTIVE_USER_KEY = 'pybossa:active_users_in_project:{}'
 
+# Server side version of LockManager.acquire_lock for a batch of resources.
+# It takes the lock on the first resource with capacity left and records the
+# resource in the client hash, all in a single round trip.
+# KEYS[1]: hash of the resources held by the client
+# KEYS[2..n]: hashes of the clients holding each candidate resource
+# ARGV[1]: client id, ARGV[2]: now, ARGV[3]: expiration, ARGV[4]: ttl
+# ARGV[5..]: resource name and limit ('inf' for no limit) per candidate
+# Returns the 1-based position of the locked candidate, 0 if none.
+ACQUIRE_LOCKS_SCRIPT = """
+local function release_expired(key, now)
+    local locks = redis.call('HGETALL', key)
+    local expired = {}
+    for i = 1, #locks, 2 do
+        if now > tonumber(locks[i + 1]) then
+            expired[#expired + 1] = locks[i]
+        end
+    end
+    if #expired > 0 then
+        redis.call('HDEL', key, unpack(expired))
+    end
+end
+
+local client_id = ARGV[1]
+local now = tonumber(ARGV[2])
+local expiration = ARGV[3]
+local ttl = tonumber(ARGV[4])
+release_expired(KEYS[1], now)
+for i = 2, #KEYS do
+    local key = KEYS[i]
+    local name = ARGV[2 * i + 1]
+    local limit = ARGV[2 * i + 2]
+    release_expired(key, now)
+    local held = redis.call('HEXISTS', key, client_id) == 1
+    if held or limit == 'inf' or redis.call('HLEN', key) < tonumber(limit) then
+        if not held then
+            redis.call('HSET', key, client_id, expiration)
+            redis.call('EXPIRE', key, ttl)
+        end
+        if redis.call('HEXISTS', KEYS[1], name) == 0 then
+            redis.call('HSET', KEYS[1], name, expiration)
+            redis.call('EXPIRE', KEYS[1], ttl)
+        end
+        return i - 1
+    end
+end
+return 0
+"""
+_acquire_locks_script = None
+
 
 def get_active_user_key(project_id):
     return ACTIVE_USER_KEY.format(project_id)
@@ -59,6 +108,33 @@ class LockManager(object):
             return True
         return False
 
+    def acquire_first_lock(self, resources, client_id, client_key):
+        """
+        Atomically acquire a lock on the first available resource of a list.
+        Expired locks are released, capacity is checked and both the lock on
+        the resource and the client side record of it are taken in a single
+        server side script call.
+        :param resources: list of (resource_id, resource_name, limit) tuples,
+            where resource_name is the key stored in the client hash
+        :param client_id: id of client needing the lock
+        :param client_key: hash holding the resources locked by the client
+        :return: position in resources of the locked resource, else None
+        """
+        if not resources:
+            return None
+        timestamp = time()
+        keys = [client_key]
+        args = [client_id, repr(timestamp), repr(timestamp + self._duration),
+                int(self._duration)]
+        for resource_id, resource_name, limit in resources:
+            keys.append(resource_id)
+            args.extend([resource_name,
+                         'inf' if limit == float('inf') else limit])
+        position = self._run_acquire_locks_script(keys, args)
+        if position:
+            return int(position) - 1
+        return None
+
     def has_lock(self, resource_id, client_id):
         """
         :param resource_id: resource on which lock is being held
@@ -104,6 +180,13 @@ class LockManager(object):
         if to_delete:
             self._cache.hdel(resource_id, *to_delete)
 
+    def _run_acquire_locks_script(self, keys, args):
+        global _acquire_locks_script
+        if _acquire_locks_script is None:
+            _acquire_locks_script = self._cache.register_script(
+                ACQUIRE_LOCKS_SCRIPT)
+        return _acquire_locks_script(keys=keys, args=args, client=self._cache)
+
     @staticmethod
     def seconds_remaining(expiration):
         return float(expiration) - time()
@@ -42,7 +42,7 @@ import re
 from pybossa.model.project import Project, TaskRun, Task
 from pybossa.model.announcement import Announcement
 from pybossa.model.project_stats import ProjectStats
-from sqlalchemy.sql import and_, or_
+from sqlalchemy.sql import and_, or_, literal_column, tuple_
 from sqlalchemy import cast, Text, func, desc
 from sqlalchemy.types import TIMESTAMP
 from sqlalchemy.orm.base import _entity_descriptor
@@ -213,12 +213,66 @@ class Repository(object):
             query = query.limit(limit).offset(offset)
         return query
 
+    def _keyset_key(self, model, orderby):
+        """Return the orderby column of a keyset and a function mapping
+        its values to SQL. Text timestamps are compared through their
+        TIMESTAMPTZ shadow copies when they have one, which are indexed."""
+        column = getattr(model, orderby)
+        table = model.__table__
+        if orderby in table.info.get('timestamp_shadows', ()):
+            shadow = literal_column('{0}.{1}_ts'.format(table.name, orderby))
+            return shadow, func.text_to_timestamptz
+        if orderby in ['created', 'updated', 'finish_time']:
+            return cast(column, TIMESTAMP), lambda value: cast(value,
+                                                               TIMESTAMP)
+        return column, lambda value: value
+
+    def _filter_by_keyset(self, query, model, limit, descending, orderby,
+                          keyset):
+        """Return the page of query following keyset, a tuple
+        (nulls, value, last_id) as in the last item of the previous page.
+
+        The items with an orderby value come first, ordered by (value, id),
+        followed by the ones without, ordered by id. nulls tells which of
+        both the page continues; value and last_id are None on its first
+        page. The comparisons on the pair can use an index on
+        (..., orderby, id), so every page costs the same."""
+        nulls, value, last_id = keyset
+        ordering = desc if descending else lambda column: column
+        if orderby == 'id':
+            nulls = True
+        if nulls:
+            if orderby != 'id':
+                key, _ = self._keyset_key(model, orderby)
+                query = query.filter(key.is_(None))
+            if last_id is not None:
+                query = query.filter(model.id < last_id if descending
+                                     else model.id > last_id)
+            query = query.order_by(ordering(model.id))
+        else:
+            key, to_key = self._keyset_key(model, orderby)
+            if last_id is None:
+                query = query.filter(key.isnot(None))
+            else:
+                pair = tuple_(key, model.id)
+                after = tuple_(to_key(value), last_id)
+                query = query.filter(pair < after if descending
+                                     else pair > after)
+            query = query.order_by(ordering(key), ordering(model.id))
+        return query.limit(limit)
+
     def _filter_by(self, model, limit=None, offset=0, yielded=False,
                   last_id=None, fulltextsearch=None, desc=False,
-                  orderby='id', **filters):
-        """Filter by using several arguments and ordering items."""
+                  orderby='id', keyset=None, **filters):
+        """Filter by using several arguments and ordering items.
+
+        With keyset the items are paged by (orderby, id) instead of with
+        offset or last_id, see _filter_by_keyset."""
         query = self.create_context(filters, fulltextsearch, model)
-        if last_id:
+        if keyset is not None:
+            query = self._filter_by_keyset(query, model, limit, desc,
+                                           orderby, keyset)
+        elif last_id:
             query = query.filter(model.id > last_id)
             query = self._set_orderby_desc(query, model, limit,
                                            last_id, offset, desc, orderby)
@@ -230,6 +284,20 @@ class Repository(object):
             return query.yield_per(limit)
         return query.all()
 
+    def _stream_by(self, model, since_column, since_id=None, since=None,
+                   yield_per=1000, **filters):
+        """Return an iterator over the items matching filters in id order,
+        read from the replica through a server-side cursor, yield_per rows
+        at a time. since_id and since (a timestamp of since_column) only
+        keep the items after them."""
+        query = self.db.slave_session.query(model).filter_by(**filters)
+        if since_id:
+            query = query.filter(model.id > since_id)
+        if since:
+            key, to_key = self._keyset_key(model, since_column)
+            query = query.filter(key >= to_key(since))
+        return query.order_by(model.id).yield_per(yield_per)
+
 
 from project_repository import ProjectRepository
 from project_stats_repository import ProjectStatsRepository
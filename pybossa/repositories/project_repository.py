@@ -220,14 +220,9 @@ class ProjectRepository(Repository):
         sql_n_pending_taskruns = text(
             '''
             SELECT project_id,
-                SUM(task.n_answers - COALESCE(t.actual_answers, 0)) AS n_pending_taskruns
+                SUM(task.n_answers - COALESCE(task_stats.n_task_runs, 0)) AS n_pending_taskruns
             FROM task
-            LEFT JOIN (
-            SELECT task_id,
-                   COUNT(id) AS actual_answers
-            FROM task_run
-            GROUP BY task_id) AS t
-            ON task.id = t.task_id
+            LEFT JOIN task_stats ON task.id = task_stats.task_id
             WHERE task.state = 'ongoing'
             GROUP BY project_id
             ORDER BY project_id;
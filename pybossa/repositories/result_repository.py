@@ -45,6 +45,19 @@ class ResultRepository(Repository):
                               fulltextsearch,
                               desc, **filters)
 
+    def stream_by(self, since_id=None, since=None, yield_per=1000,
+                  **filters):
+        filters.setdefault('last_version', True)
+        return self._stream_by(Result, 'created', since_id, since,
+                               yield_per, **filters)
+
+    def get_last_versions_by_task_ids(self, task_ids):
+        if not task_ids:
+            return []
+        return self.db.session.query(Result).filter(
+            Result.task_id.in_(task_ids),
+            Result.last_version == True).order_by(Result.id).all()
+
     def save(self, result):
         self._validate_can_be('saved', result)
         try:
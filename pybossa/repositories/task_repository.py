@@ -17,25 +17,52 @@
 # along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
 
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy import cast, Date
+from sqlalchemy import cast, Date, func
 
 from pybossa.repositories import Repository
 from pybossa.model.task import Task
 from pybossa.model.task_run import TaskRun
+from pybossa.model.project_hourly_stats import uncount_task_runs_sql
 from pybossa.model import make_timestamp
 from pybossa.model.user import User
 from pybossa.exc import WrongObjectError, DBIntegrityError
 from pybossa.cache import projects as cached_projects
+from pybossa.cache import available_tasks
 from pybossa.core import uploader
 from sqlalchemy import text
 from pybossa.cache.task_browse_helpers import get_task_filters
+import csv
 import json
+import time
+from cStringIO import StringIO
 from datetime import datetime, timedelta
 from flask import current_app
 from pybossa.data_access import ensure_task_assignment_to_project
+from pybossa import ready_queue
 from sqlalchemy import or_
 
 
+# Task columns an import can set, staged as text and cast by the insert.
+IMPORT_COLUMNS = ['info', 'state', 'quorum', 'calibration', 'priority_0',
+                  'n_answers', 'user_pref', 'gold_answers', 'expiration']
+IMPORT_JSON_COLUMNS = ['info', 'user_pref', 'gold_answers']
+
+
+def _copy_value(column, value):
+    """Return value as a COPY CSV field; empty fields are NULL."""
+    if value is None:
+        return ''
+    if column in IMPORT_JSON_COLUMNS:
+        return json.dumps(value, allow_nan=False)
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, float):
+        return repr(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
 class TaskRepository(Repository):
     MIN_REDUNDANCY = 1
     MAX_REDUNDANCY = 1000
@@ -57,6 +84,11 @@ class TaskRepository(Repository):
         return self._filter_by(Task, limit, offset, yielded, last_id,
                               fulltextsearch, desc, **filters)
 
+    def stream_tasks_by(self, since_id=None, since=None, yield_per=1000,
+                        **filters):
+        return self._stream_by(Task, 'created', since_id, since, yield_per,
+                               **filters)
+
     def filter_completed_tasks_gold_tasks_by(self, limit=None, offset=0,
         last_id=None, yielded=False, desc=False, **filters):
 
@@ -139,6 +171,34 @@ class TaskRepository(Repository):
         return self._filter_by(TaskRun, limit, offset, yielded, last_id,
                               fulltextsearch, desc, **filters)
 
+    def stream_task_runs_by(self, since_id=None, since=None, yield_per=1000,
+                            **filters):
+        return self._stream_by(TaskRun, 'finish_time', since_id, since,
+                               yield_per, **filters)
+
+    def get_tasks_by_ids(self, task_ids):
+        if not task_ids:
+            return []
+        return self.db.session.query(Task).filter(
+            Task.id.in_(task_ids)).order_by(Task.id).all()
+
+    def get_task_runs_by_task_ids(self, task_ids, limit_per_task=None):
+        """Return the task runs of several tasks in a single query, in task
+        and id order, and up to limit_per_task of each task."""
+        if not task_ids:
+            return []
+        query = self.db.session.query(TaskRun).filter(
+            TaskRun.task_id.in_(task_ids))
+        if limit_per_task:
+            ranked = self.db.session.query(
+                TaskRun.id,
+                func.row_number().over(partition_by=TaskRun.task_id,
+                                       order_by=TaskRun.id).label('n'))\
+                .filter(TaskRun.task_id.in_(task_ids)).subquery()
+            query = query.join(ranked, ranked.c.id == TaskRun.id)\
+                .filter(ranked.c.n <= limit_per_task)
+        return query.order_by(TaskRun.task_id, TaskRun.id).all()
+
     def count_task_runs_with(self, **filters):
         query_args, _, _, _ = self.generate_query_from_keywords(TaskRun, **filters)
         return self.db.session.query(TaskRun).filter(*query_args).count()
@@ -193,6 +253,8 @@ class TaskRepository(Repository):
         self.db.session.execute(text('''
                    DELETE FROM result WHERE project_id=:project_id
                                       AND task_id=:task_id;'''), args)
+        self.db.session.execute(text(uncount_task_runs_sql('task_id=:task_id')),
+                                args)
         self.db.session.execute(text('''
                    DELETE FROM task_run WHERE project_id=:project_id
                                         AND task_id=:task_id;'''), args)
@@ -201,69 +263,146 @@ class TaskRepository(Repository):
                                     AND id=:task_id;'''), args)
         self.db.session.commit()
         cached_projects.clean(project_id)
+        ready_queue.task_completed(project_id, task_id)
+        available_tasks.project_changed(project_id)
 
     def delete_valid_from_project(self, project, force_reset=False, filters=None):
-        if not force_reset:
-            """Delete only tasks that have no results associated."""
-            params = {}
-            sql = text('''
-                DELETE FROM task WHERE task.project_id=:project_id
-                AND task.id NOT IN
-                (SELECT task_id FROM result
-                WHERE result.project_id=:project_id GROUP BY result.task_id);
-                ''')
-        else:
-            """force reset, remove all results."""
-            filters = filters or {}
-            conditions, params = get_task_filters(filters)
-
-            # bulkdel db conn is with db user having session_replication_role
-            # when bulkdel is not configured, make explict sql query to set
-            # session replication role to replica
-            sql_session_repl = ''
-            if not 'bulkdel' in current_app.config.get('SQLALCHEMY_BINDS'):
-                sql_session_repl = 'SET session_replication_role TO replica;'
-            sql = text('''
-                BEGIN;
-
-                {}
-
-                CREATE TEMP TABLE to_delete ON COMMIT DROP AS (
-                    SELECT task.id as id,
-                    coalesce(ct, 0) as n_task_runs, task.n_answers, ft,
-                    priority_0, task.created
-                    FROM task LEFT OUTER JOIN
-                    (SELECT task_id, CAST(COUNT(id) AS FLOAT) AS ct,
-                    MAX(finish_time) as ft FROM task_run
-                    WHERE project_id=:project_id GROUP BY task_id) AS log_counts
-                    ON task.id=log_counts.task_id
-                    WHERE task.project_id=:project_id {}
-                );
-                DELETE FROM result WHERE project_id=:project_id
-                       AND task_id in (SELECT id FROM to_delete);
-                DELETE FROM task_run WHERE project_id=:project_id
-                       AND task_id in (SELECT id FROM to_delete);
-                DELETE FROM task WHERE task.project_id=:project_id
-                       AND id in (SELECT id FROM to_delete);
-                COMMIT;
-                '''.format(sql_session_repl, conditions))
-        self.db.bulkdel_session.execute(sql, dict(project_id=project.id, **params))
-        self.db.bulkdel_session.commit()
-        cached_projects.clean_project(project.id)
+        """Delete the tasks of a project that have no results or, with
+        force_reset, the ones matching filters and their results."""
+        self.delete_tasks_in_batches(project.id, force_reset, filters)
         self._delete_zip_files_from_store(project)
 
+    def delete_tasks_in_batches(self, project_id, force_reset=False,
+                                filters=None, progress=None):
+        """
+        Delete tasks of a project with their task runs, counters and stats,
+        in batches of BULK_DELETE_BATCH_SIZE tasks in id order. Every batch
+        is a short transaction, so only the rows being deleted are locked
+        and task runs can still be submitted meanwhile. Before each batch,
+        wait while the replica lags more than BULK_DELETE_MAX_REPLICATION_LAG
+        seconds behind.
+
+        Without force_reset only tasks with no results are deleted, otherwise
+        the ones matching filters (see get_task_filters) and their results.
+        progress, if given, is called with the number of deleted tasks after
+        each batch. Return the number of deleted tasks.
+        """
+        if force_reset:
+            conditions, params = get_task_filters(filters or {})
+            keep_results = ''
+            delete_results = '''
+                DELETE FROM result WHERE project_id=:project_id
+                       AND task_id IN (SELECT id FROM to_delete);'''
+        else:
+            conditions = '''
+                AND NOT EXISTS (SELECT 1 FROM result
+                                WHERE result.project_id=:project_id
+                                AND result.task_id=task.id)'''
+            params = {}
+            # The batch is locked, so no result can be added to it anymore,
+            # but one may have been committed while it was being locked.
+            keep_results = '''
+                DELETE FROM to_delete WHERE EXISTS (
+                    SELECT 1 FROM result WHERE result.project_id=:project_id
+                    AND result.task_id=to_delete.id);'''
+            delete_results = ''
+        select_sql = text('''
+            CREATE TEMP TABLE to_delete ON COMMIT DROP AS (
+                SELECT task.id AS id
+                FROM task LEFT OUTER JOIN
+                (SELECT task_id, CAST(n_task_runs AS FLOAT) AS ct,
+                last_finish_time AS ft FROM task_stats
+                WHERE project_id=:project_id) AS log_counts
+                ON task.id=log_counts.task_id
+                WHERE task.project_id=:project_id AND task.id > :last_id {0}
+                ORDER BY task.id LIMIT :batch_size
+                FOR UPDATE OF task
+            );'''.format(conditions))
+        batch_sql = text('SELECT COUNT(id), MAX(id) FROM to_delete')
+        sql = text('''
+            {0}
+            DELETE FROM counter WHERE project_id=:project_id
+                   AND task_id IN (SELECT id FROM to_delete);
+            DELETE FROM task_stats WHERE project_id=:project_id
+                   AND task_id IN (SELECT id FROM to_delete);
+            {1}
+            {2}
+            DELETE FROM task_run WHERE project_id=:project_id
+                   AND task_id IN (SELECT id FROM to_delete);
+            DELETE FROM task WHERE project_id=:project_id
+                   AND id IN (SELECT id FROM to_delete);
+            '''.format(keep_results, delete_results,
+                       uncount_task_runs_sql(
+                           'task_id IN (SELECT id FROM to_delete)')))
+        deleted_sql = text('SELECT COUNT(id) FROM to_delete')
+        batch_size = current_app.config.get('BULK_DELETE_BATCH_SIZE')
+        session = self.db.bulkdel_session
+        params.update(project_id=project_id, batch_size=batch_size,
+                      last_id=0)
+        n = 0
+        try:
+            while True:
+                self._wait_for_replica()
+                session.execute(select_sql, params)
+                count, last_id = session.execute(batch_sql).first()
+                session.execute(sql, params)
+                deleted = session.execute(deleted_sql).scalar()
+                session.commit()
+                n += deleted
+                if progress and deleted:
+                    progress(n)
+                if count < batch_size:
+                    break
+                params['last_id'] = last_id
+        finally:
+            session.rollback()
+            cached_projects.clean_project(project_id)
+            ready_queue.project_changed(project_id)
+            available_tasks.project_changed(project_id)
+        return n
+
+    def _wait_for_replica(self):
+        """Sleep while the replica lags more than
+        BULK_DELETE_MAX_REPLICATION_LAG seconds behind the master."""
+        max_lag = current_app.config.get('BULK_DELETE_MAX_REPLICATION_LAG')
+        if max_lag is None or self.db.slave_session is self.db.session:
+            return
+        sql = text('''
+            SELECT CASE WHEN pg_last_xlog_receive_location()
+                             = pg_last_xlog_replay_location() THEN 0
+            ELSE COALESCE(EXTRACT(EPOCH FROM clock_timestamp()
+                                  - pg_last_xact_replay_timestamp()), 0)
+            END
+            ''')
+        while True:
+            lag = self.db.slave_session.execute(sql).scalar() or 0
+            self.db.slave_session.rollback()
+            if lag <= max_lag:
+                return
+            current_app.logger.info('Replica is %.1f s behind, pausing '
+                                    'bulk delete', lag)
+            time.sleep(lag - max_lag)
+
     def delete_taskruns_from_project(self, project):
         sql = text('''
                    DELETE FROM task_run WHERE project_id=:project_id;
+                   UPDATE task_stats SET n_task_runs=0, last_finish_time=NULL
+                   WHERE project_id=:project_id;
+                   DELETE FROM project_hourly_stats
+                   WHERE project_id=:project_id;
                    ''')
         self.db.session.execute(sql, dict(project_id=project.id))
         self.db.session.commit()
         cached_projects.clean_project(project.id)
+        ready_queue.project_changed(project.id)
+        available_tasks.project_changed(project.id)
         self._delete_zip_files_from_store(project)
 
-    def update_tasks_redundancy(self, project, n_answers, filters=None):
+    def update_tasks_redundancy(self, project, n_answers, filters=None,
+                                task_ids=None):
         """
-        Update the n_answer of every task from a project and their state.
+        Update the n_answer of every task from a project (matching filters,
+        or with an id in task_ids) and their state.
         Use raw SQL for performance. Mark tasks as exported = False for
         tasks with curr redundancy < new redundancy, with state as completed
         and were marked as exported = True
@@ -275,6 +414,9 @@ class TaskRepository(Repository):
         filters = filters or {}
         task_expiration = '{} day'.format(self.rdancy_upd_exp)
         conditions, params = get_task_filters(filters)
+        if task_ids is not None:
+            conditions += ' AND task.id = ANY(:task_ids)'
+            params['task_ids'] = list(task_ids)
         tasks_not_updated = self._get_redundancy_update_msg(
             project, n_answers, conditions, params, task_expiration)
 
@@ -285,9 +427,9 @@ class TaskRepository(Repository):
                         coalesce(ct, 0) as n_task_runs, task.n_answers, ft,
                         priority_0, task.created
                         FROM task LEFT OUTER JOIN
-                        (SELECT task_id, CAST(COUNT(id) AS FLOAT) AS ct,
-                        MAX(finish_time) as ft FROM task_run
-                        WHERE project_id=:project_id GROUP BY task_id) AS log_counts
+                        (SELECT task_id, CAST(n_task_runs AS FLOAT) AS ct,
+                        last_finish_time as ft FROM task_stats
+                        WHERE project_id=:project_id) AS log_counts
                         ON task.id=log_counts.task_id
                         WHERE task.project_id=:project_id {}
                    ),
@@ -309,7 +451,7 @@ class TaskRepository(Repository):
                    state='ongoing' WHERE project_id=:project_id AND
                    ((id IN (SELECT id from tasks_excl_file_urls)) OR
                    (id IN (SELECT id from tasks_with_file_urls) AND state='ongoing'
-                   AND TO_DATE(created, 'YYYY-MM-DD\THH24:MI:SS.US') >= NOW() - :task_expiration ::INTERVAL));'''
+                   AND created_ts >= NOW() - :task_expiration ::INTERVAL));'''
                    .format(conditions))
         self.db.session.execute(sql, dict(n_answers=n_answers,
                                           project_id=project.id,
@@ -318,19 +460,21 @@ class TaskRepository(Repository):
         self.update_task_state(project.id)
         self.db.session.commit()
         cached_projects.clean_project(project.id)
+        ready_queue.project_changed(project.id)
+        available_tasks.project_changed(project.id)
         return tasks_not_updated
 
     def update_task_state(self, project_id):
         # Create temp tables for completed tasks
         sql = text('''
                    CREATE TEMP TABLE complete_tasks ON COMMIT DROP AS (
-                   SELECT task.id, array_agg(task_run.id) as task_runs
-                   FROM task, task_run
-                   WHERE task_run.task_id=task.id
+                   SELECT task.id
+                   FROM task, task_stats
+                   WHERE task_stats.task_id=task.id
                    AND task.project_id=:project_id
                    AND task.calibration!=1
-                   GROUP BY task.id
-                   having COUNT(task_run.id) >= task.n_answers);
+                   AND task_stats.n_task_runs > 0
+                   AND task_stats.n_task_runs >= task.n_answers);
                    ''')
         self.db.session.execute(sql, dict(project_id=project_id))
         # Set state to completed
@@ -370,9 +514,9 @@ class TaskRepository(Repository):
                         coalesce(ct, 0) as n_task_runs, task.n_answers, ft,
                         priority_0, task.created
                         FROM task LEFT OUTER JOIN
-                        (SELECT task_id, CAST(COUNT(id) AS FLOAT) AS ct,
-                        MAX(finish_time) as ft FROM task_run
-                        WHERE project_id=:project_id GROUP BY task_id) AS log_counts
+                        (SELECT task_id, CAST(n_task_runs AS FLOAT) AS ct,
+                        last_finish_time as ft FROM task_stats
+                        WHERE project_id=:project_id) AS log_counts
                         ON task.id=log_counts.task_id
                         WHERE task.project_id=:project_id {}
                    )
@@ -386,6 +530,7 @@ class TaskRepository(Repository):
                                           **params))
         self.db.session.commit()
         cached_projects.clean_project(project_id)
+        ready_queue.project_changed(project_id)
 
     def find_duplicate(self, project_id, info):
         """
@@ -406,6 +551,99 @@ class TaskRepository(Repository):
         if row:
             return row[0]
 
+    def save_many(self, project, tasks):
+        """
+        Insert new tasks of a project in one transaction. The tasks are
+        copied into a temporary table with COPY and inserted with a single
+        statement that skips the ones whose info is already in an ongoing
+        task of the project (or earlier in tasks), and creates their counter
+        and task_stats rows. Return the number of inserted tasks.
+        """
+        from pybossa.model.event_listeners import (mark_updated_project,
+                                                   add_tasks_event)
+        if not tasks:
+            return 0
+        for task in tasks:
+            ensure_task_assignment_to_project(task, project)
+        data = StringIO()
+        writer = csv.writer(data)
+        for i, task in enumerate(tasks):
+            writer.writerow([i] + [_copy_value(column, getattr(task, column))
+                                   for column in IMPORT_COLUMNS])
+        data.seek(0)
+
+        mark_updated_project(project.id)
+        params = dict(project_id=project.id, created=make_timestamp())
+        session = self.db.session
+        try:
+            # Concurrent imports to a project must see each other's tasks.
+            session.execute(text('''
+                SELECT pg_advisory_xact_lock(hashtext('task_import'),
+                                             :project_id);
+                CREATE TEMP TABLE task_import (ord INTEGER, {0} TEXT)
+                ON COMMIT DROP;
+                '''.format(' TEXT, '.join(IMPORT_COLUMNS))), params)
+            cursor = session.connection().connection.cursor()
+            cursor.copy_expert('COPY task_import FROM STDIN WITH CSV', data)
+            cursor.close()
+            n = session.execute(text('''
+                WITH staged AS (
+                    SELECT DISTINCT ON (md5(CAST(info AS JSONB)::text))
+                    ord, CAST(info AS JSONB) AS info, state,
+                    CAST(quorum AS INTEGER) AS quorum,
+                    CAST(calibration AS INTEGER) AS calibration,
+                    CAST(priority_0 AS FLOAT) AS priority_0,
+                    CAST(n_answers AS INTEGER) AS n_answers,
+                    CAST(user_pref AS JSONB) AS user_pref,
+                    CAST(gold_answers AS JSONB) AS gold_answers,
+                    CAST(expiration AS TIMESTAMP) AS expiration
+                    FROM task_import
+                    ORDER BY md5(CAST(info AS JSONB)::text), ord
+                ), new_task AS (
+                    INSERT INTO task (created, project_id, state, quorum,
+                                      calibration, priority_0, info,
+                                      n_answers, exported, user_pref,
+                                      gold_answers, expiration)
+                    SELECT :created, :project_id,
+                    COALESCE(state, 'ongoing'), COALESCE(quorum, 0),
+                    COALESCE(calibration, 0), COALESCE(priority_0, 0), info,
+                    COALESCE(n_answers, 1), FALSE, user_pref, gold_answers,
+                    expiration
+                    FROM staged
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM task
+                        WHERE task.project_id=:project_id
+                        AND task.state='ongoing'
+                        AND md5(task.info::text)=md5(staged.info::text))
+                    ORDER BY ord
+                    RETURNING id
+                ), new_counter AS (
+                    INSERT INTO counter (created, project_id, task_id,
+                                         n_task_runs)
+                    SELECT CAST(:created AS TIMESTAMP), :project_id, id, 0
+                    FROM new_task
+                ), new_task_stats AS (
+                    INSERT INTO task_stats (task_id, project_id, n_task_runs)
+                    SELECT id, :project_id, 0 FROM new_task
+                )
+                SELECT COUNT(*) FROM new_task;
+                '''), params).scalar()
+            session.execute(text('''
+                UPDATE project SET updated=:created WHERE id=:project_id;
+                '''), params)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        if n:
+            cached_projects.clean_project(project.id)
+            ready_queue.project_changed(project.id)
+            available_tasks.project_changed(project.id)
+            add_tasks_event(dict(id=project.id, name=project.name,
+                                 short_name=project.short_name,
+                                 info=project.info))
+        return n
+
     def _validate_can_be(self, action, element):
         from flask import current_app
         from pybossa.core import project_repo
@@ -449,9 +687,9 @@ class TaskRepository(Repository):
                         coalesce(ct, 0) as n_task_runs, task.n_answers, ft,
                         priority_0, task.created
                         FROM task LEFT OUTER JOIN
-                        (SELECT task_id, CAST(COUNT(id) AS FLOAT) AS ct,
-                        MAX(finish_time) as ft FROM task_run
-                        WHERE project_id=:project_id GROUP BY task_id) AS log_counts
+                        (SELECT task_id, CAST(n_task_runs AS FLOAT) AS ct,
+                        last_finish_time as ft FROM task_stats
+                        WHERE project_id=:project_id) AS log_counts
                         ON task.id=log_counts.task_id
                         WHERE task.project_id=:project_id
                         AND task.state='completed'
@@ -475,7 +713,7 @@ class TaskRepository(Repository):
                    WHERE project_id=:project_id AND
                    ((id IN (SELECT id from tasks_excl_file_urls)) OR
                    (id IN (SELECT id from tasks_with_file_urls) AND state='ongoing'
-                   AND TO_DATE(created, 'YYYY-MM-DD\THH24:MI:SS.US') >= NOW() - :task_expiration ::INTERVAL));'''
+                   AND created_ts >= NOW() - :task_expiration ::INTERVAL));'''
                    .format(conditions))
         self.db.session.execute(sql, dict(n_answers=n_answers,
                                           project_id=project_id,
@@ -490,9 +728,9 @@ class TaskRepository(Repository):
                         coalesce(ct, 0) as n_task_runs, task.n_answers, ft,
                         priority_0, task.created
                         FROM task LEFT OUTER JOIN
-                        (SELECT task_id, CAST(COUNT(id) AS FLOAT) AS ct,
-                        MAX(finish_time) as ft FROM task_run
-                        WHERE project_id=:project_id GROUP BY task_id) AS log_counts
+                        (SELECT task_id, CAST(n_task_runs AS FLOAT) AS ct,
+                        last_finish_time as ft FROM task_stats
+                        WHERE project_id=:project_id) AS log_counts
                         ON task.id=log_counts.task_id
                         WHERE task.project_id=:project_id {}
                    )
@@ -502,7 +740,7 @@ class TaskRepository(Repository):
                    AND jsonb_typeof(t.info) = 'object'
                    AND EXISTS(SELECT TRUE FROM jsonb_object_keys(t.info) AS key
                    WHERE key ILIKE '%\_\_upload\_url%')
-                   AND (t.state = 'completed' OR TO_DATE(created, 'YYYY-MM-DD\THH24:MI:SS.US') < NOW() - :task_expiration ::INTERVAL)
+                   AND (t.state = 'completed' OR created_ts < NOW() - :task_expiration ::INTERVAL)
                    AND n_answers != :n_answers;'''
                    .format(conditions))
         tasks = self.db.session.execute(sql,
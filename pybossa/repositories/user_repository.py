@@ -187,8 +187,7 @@ class UserRepository(Repository):
                     FROM "user" INNER JOIN task_run
                     ON (task_run.user_id = "user".id)
                     WHERE project_id = :project_id
-                    AND current_timestamp - to_timestamp(finish_time, 'YYYY-MM-DD"T"HH24:MI:SS.US')
-                        < interval '1 month';
+                    AND finish_time_ts > current_timestamp - interval '1 month';
                     ''')
         results = self.db.session.execute(sql, dict(project_id=project_id))
         return [row.email_addr for row in results]
@@ -22,14 +22,16 @@ from sqlalchemy.sql import and_, or_
 from pybossa.model import DomainObject
 from pybossa.model.task import Task
 from pybossa.model.task_run import TaskRun
-from pybossa.model.counter import Counter
-from pybossa.core import db, sentinel, project_repo, task_repo
+from pybossa.model.task_stats import TaskStats
+from pybossa.core import db, sentinel, task_repo
 from pybossa.sentinel import keys
 from redis_lock import LockManager, get_active_user_count, register_active_user
+from pybossa import ready_queue
 from contributions_guard import ContributionsGuard
 from werkzeug.exceptions import BadRequest, Forbidden
 import random
 from pybossa.cache import users as cached_users
+from pybossa.cache import project_descriptors
 from flask import current_app
 from pybossa import data_access
 from datetime import datetime
@@ -45,6 +47,7 @@ class Schedulers(object):
 
 
 DEFAULT_SCHEDULER = Schedulers.locked
+READY_QUEUE_CLAUSE = 'AND task.id = ANY(:task_ids)'
 
 
 def new_task(project_id, sched, user_id=None, user_ip=None,
@@ -116,11 +119,10 @@ def get_breadth_first_task(project_id, user_id=None, user_ip=None,
                                                                 external_uid=external_uid)
 
     tmp = project_query.except_(subquery)
-    query = session.query(Task, func.sum(Counter.n_task_runs).label('n_task_runs'))\
-                   .filter(Task.id==Counter.task_id)\
-                   .filter(Counter.task_id.in_(tmp))\
+    query = session.query(Task, TaskStats.n_task_runs.label('n_task_runs'))\
+                   .filter(Task.id==TaskStats.task_id)\
+                   .filter(TaskStats.task_id.in_(tmp))\
                    .filter(or_(Task.expiration == None, Task.expiration > datetime.utcnow()))\
-                   .group_by(Task.id)\
                    .order_by('n_task_runs ASC')\
 
     query = _set_orderby_desc(query, orderby, desc)
@@ -227,18 +229,26 @@ def locked_scheduler(query_factory):
             "Project {} - number of current users: {}"
             .format(project_id, user_count))
 
-        sql = query_factory(project_id, user_id, user_ip, external_uid,
-                            limit, offset, orderby, desc, rand_within_priority,
-                            present_gold_task)
-        rows = session.execute(sql, dict(project_id=project_id,
-                                         user_id=user_id,
-                                         limit=user_count + 5))
-
-        for task_id, taskcount, n_answers, calibration, timeout in rows:
-            timeout = timeout or TIMEOUT
-            remaining = float('inf') if calibration else n_answers - taskcount
-            if acquire_lock(task_id, user_id, remaining, timeout):
+        query_args = (project_id, user_id, user_ip, external_uid,
+                      limit, offset, orderby, desc, rand_within_priority,
+                      present_gold_task)
+        params = dict(project_id=project_id, user_id=user_id,
+                      limit=user_count + 5)
+        if ready_queue.is_enabled():
+            rows = get_ready_queue_rows(query_factory, query_args, params,
+                                        present_gold_task)
+        else:
+            rows = session.execute(query_factory(*query_args), params)
+
+        for candidates in _chunks(rows, params['limit']):
+            timeout = candidates[0].timeout or TIMEOUT
+            limits = [(task_id, float('inf') if calibration else n_answers - taskcount)
+                      for task_id, taskcount, n_answers, calibration, _ in candidates]
+            position = acquire_first_lock(limits, user_id, timeout)
+            if position is not None:
                 rows.close()
+                task_id = candidates[position].id
+                calibration = candidates[position].calibration
                 save_task_id_project_id(task_id, project_id, 2 * timeout)
                 register_active_user(project_id, user_id, sentinel.master, ttl=timeout)
 
@@ -253,21 +263,77 @@ def locked_scheduler(query_factory):
     return template_get_locked_task
 
 
+def get_ready_queue_rows(query_factory, query_args, params, present_gold_task):
+    """Yield candidate rows for the locked scheduler from the ready queue.
+
+    Task ids are read from the project ready queue in windows of
+    params['limit'] ids and the scheduler query is only run for the ids of
+    each window, which turns the project wide scan into an index lookup.
+    If no lock is obtained within SCHED_READY_QUEUE_MAX_WINDOWS windows, fall
+    back to the regular scheduler query. So does a project whose queue is
+    not synced, while the sync_ready_queues job rebuilds it.
+    """
+    project_id = params['project_id']
+    queue = ready_queue.get_ready_queue()
+    if not queue.is_synced(project_id):
+        ready_queue.request_sync(project_id)
+        for row in _iter_rows(query_factory(*query_args), params):
+            yield row
+        return
+
+    sql = query_factory(*query_args, use_ready_queue=True)
+    max_windows = current_app.config.get('SCHED_READY_QUEUE_MAX_WINDOWS', 10)
+    windows = queue.windows(project_id, present_gold_task, params['limit'])
+    for n_window, task_ids in enumerate(windows):
+        if n_window >= max_windows:
+            current_app.logger.info(
+                'Project {} - no task in the first {} ready queue windows'
+                .format(project_id, n_window))
+            for row in _iter_rows(query_factory(*query_args), params):
+                yield row
+            return
+        for row in session.execute(sql, dict(params, task_ids=task_ids)).fetchall():
+            yield row
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _iter_rows(sql, params):
+    rows = session.execute(sql, params)
+    try:
+        for row in rows:
+            yield row
+    finally:
+        rows.close()
+
+
 @locked_scheduler
 def get_locked_task(project_id, user_id=None, user_ip=None,
                     external_uid=None, limit=1, offset=0,
                     orderby='priority_0', desc=True, rand_within_priority=False,
-                    present_gold_task=False):
+                    present_gold_task=False, use_ready_queue=False):
     """ Select a new task to be returned to the contributor.
 
     For each incomplete task, check if the number of users working on the task
     is smaller than the number of answers still needed. In that case, acquire
     a lock on the task and return the task to the user. If offset is nonzero,
     skip that amount of available tasks before returning to the user.
+
+    With use_ready_queue set, only the tasks in :task_ids are considered.
     """
     having_clause = 'HAVING COUNT(task_run.task_id) < n_answers' if  not present_gold_task else ''
     allowed_task_levels_clause = data_access.get_data_access_db_clause_for_task_assignment(user_id)
     order_by_calib = 'DESC NULLS LAST' if present_gold_task else ''
+    task_ids_clause = READY_QUEUE_CLAUSE if use_ready_queue else ''
 
     sql = text('''
            SELECT task.id, COUNT(task_run.task_id) AS taskcount, n_answers, task.calibration,
@@ -280,13 +346,14 @@ def get_locked_task(project_id, user_id=None, user_ip=None,
            (SELECT 1 FROM task_run WHERE project_id=:project_id AND
            user_id=:user_id AND task_id=task.id)
            AND task.project_id=:project_id
+           {}
            AND ((task.expiration IS NULL) OR (task.expiration > (now() at time zone 'utc')::timestamp))
            AND task.state !='completed'
            {}
            group by task.id
            {}
            ORDER BY task.calibration {}, priority_0 DESC, {} LIMIT :limit;
-           '''.format(allowed_task_levels_clause,
+           '''.format(task_ids_clause, allowed_task_levels_clause,
                 having_clause, order_by_calib,
                 'random()' if rand_within_priority else 'id ASC'))
 
@@ -297,7 +364,7 @@ def get_locked_task(project_id, user_id=None, user_ip=None,
 def get_user_pref_task(project_id, user_id=None, user_ip=None,
                        external_uid=None, limit=1, offset=0,
                        orderby='priority_0', desc=True, rand_within_priority=False,
-                       present_gold_task=False):
+                       present_gold_task=False, use_ready_queue=False):
     """ Select a new task based on user preference set under user profile.
 
     For each incomplete task, check if the number of users working on the task
@@ -305,12 +372,15 @@ def get_user_pref_task(project_id, user_id=None, user_ip=None,
     a lock on the task that matches user preference(if any) with users profile
     and return the task to the user. If offset is nonzero, skip that amount of
     available tasks before returning to the user.
+
+    With use_ready_queue set, only the tasks in :task_ids are considered.
     """
 
     user_pref_list = cached_users.get_user_preferences(user_id)
     secondary_order = 'random()' if rand_within_priority else 'id ASC'
     allowed_task_levels_clause = data_access.get_data_access_db_clause_for_task_assignment(user_id)
     order_by_calib = 'DESC NULLS LAST' if present_gold_task else ''
+    task_ids_clause = READY_QUEUE_CLAUSE if use_ready_queue else ''
 
     sql = '''
            SELECT task.id, COUNT(task_run.task_id) AS taskcount, n_answers, task.calibration,
@@ -323,6 +393,7 @@ def get_user_pref_task(project_id, user_id=None, user_ip=None,
            (SELECT 1 FROM task_run WHERE project_id=:project_id AND
            user_id=:user_id AND task_id=task.id)
            AND task.project_id=:project_id
+           {}
            AND ({})
            AND ((task.expiration IS NULL) OR (task.expiration > (now() at time zone 'utc')::timestamp))
            AND task.state !='completed'
@@ -331,7 +402,7 @@ def get_user_pref_task(project_id, user_id=None, user_ip=None,
            ORDER BY task.calibration {}, priority_0 DESC,
            {}
            LIMIT :limit;
-           '''.format(user_pref_list,
+           '''.format(task_ids_clause, user_pref_list,
            allowed_task_levels_clause,
            order_by_calib, secondary_order)
     return text(sql)
@@ -350,6 +421,8 @@ def has_lock(task_id, user_id, timeout):
 
 
 def acquire_lock(task_id, user_id, limit, timeout, pipeline=None, execute=True):
+    if pipeline is None and execute:
+        return acquire_first_lock([(task_id, limit)], user_id, timeout) is not None
     redis_conn = sentinel.master
     pipeline = pipeline or redis_conn.pipeline(transaction=True)
     lock_manager = LockManager(redis_conn, timeout)
@@ -363,6 +436,20 @@ def acquire_lock(task_id, user_id, limit, timeout, pipeline=None, execute=True):
     return False
 
 
+def acquire_first_lock(candidates, user_id, timeout):
+    """Lock the first available task of a list in a single Redis call.
+
+    :param candidates: list of (task_id, limit) tuples, where limit is the
+        number of users that can work on the task concurrently
+    :return: position in candidates of the locked task, else None
+    """
+    lock_manager = LockManager(sentinel.master, timeout)
+    resources = [(get_task_users_key(task_id), task_id, limit)
+                 for task_id, limit in candidates]
+    return lock_manager.acquire_first_lock(resources, user_id,
+                                           get_user_tasks_key(user_id))
+
+
 def release_lock(task_id, user_id, timeout, pipeline=None, execute=True):
     redis_conn = sentinel.master
     pipeline = pipeline or redis_conn.pipeline(transaction=True)
@@ -440,7 +527,7 @@ def release_user_locks(user_id):
 
 
 def get_project_scheduler_and_timeout(project_id):
-    project = project_repo.get(project_id)
+    project = project_descriptors.get(project_id)
     if not project:
         raise Forbidden('Invalid project_id')
     return get_scheduler_and_timeout(project)
@@ -0,0 +1,176 @@
+# -*- coding: utf8 -*-
+# This file is part of PYBOSSA.
+#
+# Copyright (C) 2018 Scifabric LTD.
+#
+# PYBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PYBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+"""Fan-out of Redis pub/sub channels to Server-Sent Events streams.
+
+Every process holds a single pub/sub connection, subscribed to a channel
+while at least one stream is reading it. A daemon thread copies each message
+to a bounded queue per stream; a stream that does not keep up fills its
+queue and is closed, and the browser EventSource reconnects.
+
+Streams last as long as the browser keeps the page open, so they are meant
+to be served by sse_gateway.py (gevent) rather than by the request workers.
+"""
+import os
+import threading
+import time
+from Queue import Queue, Empty, Full
+
+from flask import current_app
+
+
+HEARTBEAT = ': heartbeat\n\n'
+
+
+class EventClient(object):
+
+    """Messages of the channel waiting to be sent to one stream."""
+
+    def __init__(self, queue_size):
+        self.queue = Queue(maxsize=queue_size)
+        self.dropped = False
+
+    def put(self, data):
+        """Queue data, or drop the client if its queue is full."""
+        if self.dropped:
+            return
+        try:
+            self.queue.put_nowait(data)
+        except Full:
+            self.dropped = True
+
+
+class EventHub(object):
+
+    """Share one pub/sub connection of the process between all the streams."""
+
+    RETRY_DELAY = 1
+
+    def __init__(self):
+        self._clients = {}
+        self._pubsub = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._subscribed = threading.Event()
+
+    def subscribe(self, redis_conn, channel, queue_size):
+        """Return a new EventClient receiving the messages of channel."""
+        client = EventClient(queue_size)
+        with self._lock:
+            self._ensure_listening(redis_conn)
+            clients = self._clients.setdefault(channel, set())
+            if not clients:
+                self._pubsub.subscribe(channel)
+            clients.add(client)
+            self._subscribed.set()
+        return client
+
+    def unsubscribe(self, channel, client):
+        with self._lock:
+            clients = self._clients.get(channel)
+            if clients is None:
+                return
+            clients.discard(client)
+            if not clients:
+                del self._clients[channel]
+                try:
+                    self._pubsub.unsubscribe(channel)
+                except Exception:
+                    # Only the remaining channels are subscribed again
+                    # on reconnection.
+                    pass
+
+    def channels(self):
+        with self._lock:
+            return set(self._clients)
+
+    def dispatch(self, channel, data):
+        with self._lock:
+            clients = list(self._clients.get(channel, ()))
+        for client in clients:
+            client.put(data)
+            if client.dropped:
+                self.unsubscribe(channel, client)
+
+    def _ensure_listening(self, redis_conn):
+        # Called with the lock held. Forked workers inherit the connection
+        # and the clients of the parent but not the thread.
+        if self._pid == os.getpid():
+            return
+        self._clients = {}
+        self._pubsub = redis_conn.pubsub()
+        app = current_app._get_current_object()
+        thread = threading.Thread(target=self._listen, args=(app, redis_conn))
+        thread.daemon = True
+        thread.start()
+        self._pid = os.getpid()
+
+    def _listen(self, app, redis_conn):
+        with app.app_context():
+            self._listen_forever(redis_conn)
+
+    def _listen_forever(self, redis_conn):
+        while True:
+            self._subscribed.wait()
+            try:
+                # listen() returns once nothing is subscribed.
+                for message in self._pubsub.listen():
+                    if message['type'] == 'message':
+                        self.dispatch(message['channel'], message['data'])
+            except Exception:
+                current_app.logger.exception('Event hub lost its pub/sub '
+                                             'connection')
+            with self._lock:
+                if not self._clients:
+                    self._subscribed.clear()
+                    continue
+            # Messages published while disconnected are lost.
+            time.sleep(self.RETRY_DELAY)
+            self._reconnect(redis_conn)
+
+    def _reconnect(self, redis_conn):
+        with self._lock:
+            try:
+                self._pubsub.reset()
+            except Exception:
+                pass
+            self._pubsub = redis_conn.pubsub()
+            try:
+                self._pubsub.subscribe(list(self._clients))
+            except Exception:
+                current_app.logger.exception('Event hub could not subscribe '
+                                             'again')
+
+
+hub = EventHub()
+
+
+def event_stream(redis_conn, channel, heartbeat=15, queue_size=100):
+    """Yield the messages of channel as Server-Sent Events, and a comment
+    every heartbeat seconds without messages, so proxies keep the stream
+    open and closed connections are noticed."""
+    client = hub.subscribe(redis_conn, channel, queue_size)
+    try:
+        while not client.dropped:
+            try:
+                data = client.queue.get(timeout=heartbeat)
+            except Empty:
+                yield HEARTBEAT
+                continue
+            yield 'data: %s\n\n' % data
+    finally:
+        hub.unsubscribe(channel, client)
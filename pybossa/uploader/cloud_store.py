@@ -1,3 +1,5 @@
+import os
+from cStringIO import StringIO
 from pybossa.uploader import Uploader
 from flask import current_app as app
 from flask import url_for
@@ -7,6 +9,9 @@ from pybossa.cloud_store_api.connection import create_connection
 
 class CloudStoreUploader(Uploader):
 
+    # S3 parts must be at least 5 MB, except for the last one.
+    MULTIPART_CHUNK_SIZE = 16 * 1024 * 1024
+
     def __init__(self):
         self._bucket = None
 
@@ -46,6 +51,9 @@ class CloudStoreUploader(Uploader):
         """Override by the specific uploader handler."""
         try:
             key = self.key_name(container, file.filename)
+            if self._stream_size(file.stream) > self.MULTIPART_CHUNK_SIZE:
+                self._upload_multipart(file.stream, key)
+                return True
             key = self.bucket.get_key(key, validate=False)
             key.set_contents_from_string(file.read(), policy='public-read')
             return True
@@ -53,6 +61,33 @@ class CloudStoreUploader(Uploader):
             app.logger.exception('Error uploading')
             return False
 
+    def _upload_multipart(self, stream, key_name):
+        """Upload a big file in parts of MULTIPART_CHUNK_SIZE bytes, so
+        only one part is held in memory."""
+        upload = self.bucket.initiate_multipart_upload(key_name,
+                                                       policy='public-read')
+        try:
+            for part_num, chunk in enumerate(
+                    iter(lambda: stream.read(self.MULTIPART_CHUNK_SIZE), ''),
+                    1):
+                upload.upload_part_from_file(StringIO(chunk), part_num)
+            upload.complete_upload()
+        except Exception:
+            upload.cancel_upload()
+            raise
+
+    @staticmethod
+    def _stream_size(stream):
+        """Return the bytes left in a seekable stream, or 0 if unknown."""
+        try:
+            position = stream.tell()
+            stream.seek(0, os.SEEK_END)
+            size = stream.tell() - position
+            stream.seek(position)
+            return size
+        except Exception:
+            return 0
+
     def delete_file(self, name, container):  # pragma: no cover
         try:
             key = self.key_name(container, name)
@@ -26,7 +26,7 @@ from StringIO import StringIO
 
 from flask import Blueprint, request, url_for, flash, redirect, abort, Response, current_app
 from flask import render_template, render_template_string, make_response, session
-from flask import Markup, jsonify
+from flask import Markup, jsonify, stream_with_context
 from flask.ext.login import login_required, current_user
 from flask.ext.babel import gettext
 from flask_wtf.csrf import generate_csrf
@@ -72,6 +72,7 @@ from pybossa.forms.projects_view_forms import *
 from pybossa.forms.admin_view_forms import SearchForm
 from pybossa.importers import BulkImportException
 from pybossa.pro_features import ProFeatureHandler
+from pybossa.sse import event_stream
 
 from pybossa.core import (project_repo, user_repo, task_repo, blog_repo,
                           result_repo, webhook_repo, auditlog_repo)
@@ -1259,11 +1260,15 @@ def tasks_browse(short_name, page=1, records_per_page=10):
             per_page = records_per_page
         else:
             per_page = 10
-        offset = (page - 1) * per_page
+        keyset = 'after' in args
+        offset = 0 if keyset else (page - 1) * per_page
         args["records_per_page"] = per_page
         args["offset"] = offset
         start_time = time.time()
         total_count, page_tasks = cached_projects.browse_tasks(project.get('id'), args)
+        next_cursor = None
+        if keyset and len(page_tasks) == per_page:
+            next_cursor = page_tasks[-1]['cursor']
         current_app.logger.debug("Browse Tasks data loading took %s seconds"
                                  % (time.time()-start_time))
         first_task_id = cached_projects.first_task_id(project.get('id'))
@@ -1285,6 +1290,7 @@ def tasks_browse(short_name, page=1, records_per_page=10):
         args["order_by"] = args.pop("order_by_dict", dict())
         args.pop("records_per_page", None)
         args.pop("offset", None)
+        args.pop("after", None)
 
         if disp_info_columns:
             for task in page_tasks:
@@ -1312,6 +1318,7 @@ def tasks_browse(short_name, page=1, records_per_page=10):
                     allowed_records_per_page=allowed_records_per_page,
                     records_per_page=records_per_page,
                     filter_data=args,
+                    next_cursor=next_cursor,
                     first_task_id=first_task_id,
                     info_columns=disp_info_columns,
                     filter_columns=columns,
@@ -1432,10 +1439,12 @@ def bulk_redundancy_update(short_name):
         n_answers = req_data.get('n_answers', 1)
         task_ids = req_data.get('taskIds')
         if task_ids:
-            tasks_updated = _update_task_redundancy(project.id, task_ids, n_answers)
-            if not tasks_updated:
+            task_ids = [int(task_id) for task_id in task_ids if task_id]
+            tasks_not_updated = task_repo.update_tasks_redundancy(
+                project, n_answers, task_ids=task_ids)
+            if tasks_not_updated:
                 flash('Redundancy not updated for tasks containing files that are either completed or older than '
-                      '{} days.'.format(current_app.config.get('REDUNDANCY_UPDATE_EXPIRATION', 30)))
+                      '{} days.'.format(task_repo.rdancy_upd_exp))
             new_value = json.dumps({
                 'task_ids': task_ids,
                 'n_answers': n_answers
@@ -1460,39 +1469,6 @@ def bulk_redundancy_update(short_name):
         return ErrorStatus().format_exception(e, 'redundancyupdate', 'POST')
 
 
-def _update_task_redundancy(project_id, task_ids, n_answers):
-    """
-    Update the redundancy for a list of tasks in a given project. Mark tasks
-    exported as False for tasks with curr redundancy < new redundancy
-    and task was already exported
-    """
-    tasks_updated = False
-    rdancy_upd_exp = current_app.config.get('REDUNDANCY_UPDATE_EXPIRATION', 30)
-    for task_id in task_ids:
-        if task_id:
-            t = task_repo.get_task_by(project_id=project_id,
-                                      id=int(task_id))
-            if t and t.n_answers == n_answers:
-                tasks_updated = True # no flash error message for same redundancy not updated
-            if t and t.n_answers != n_answers:
-                now = datetime.now()
-                created = datetime.strptime(t.created, '%Y-%m-%dT%H:%M:%S.%f')
-                days_task_created = (now - created).days
-
-                if len(t.task_runs) < n_answers:
-                    if t.info and ([k for k in t.info if k.endswith('__upload_url')] and
-                        (t.state == 'completed' or days_task_created > rdancy_upd_exp)):
-                        continue
-                    else:
-                        t.exported = False
-                t.n_answers = n_answers
-                t.state = 'ongoing'
-                if len(t.task_runs) >= n_answers:
-                    t.state = 'completed'
-                task_repo.update(t)
-                tasks_updated = True
-    return tasks_updated
-
 @crossdomain(origin='*', headers=cors_headers)
 @blueprint.route('/<short_name>/tasks/deleteselected', methods=['POST'])
 @login_required
@@ -2379,11 +2355,10 @@ def publish(short_name, published):
 
 def project_event_stream(short_name, channel_type):
     """Event stream for pub/sub notifications."""
-    pubsub = sentinel.master.pubsub()
     channel = "channel_%s_%s" % (channel_type, short_name)
-    pubsub.subscribe(channel)
-    for message in pubsub.listen():
-        yield 'data: %s\n\n' % message['data']
+    return stream_with_context(event_stream(
+        sentinel.master, channel, current_app.config.get('SSE_HEARTBEAT'),
+        current_app.config.get('SSE_CLIENT_QUEUE_SIZE')))
 
 
 @blueprint.route('/<short_name>/privatestream')
@@ -78,6 +78,8 @@ setup(
     version = '2.9.3',
     packages = find_packages(),
     install_requires = requirements,
+    # sse_gateway.py serves the Server-Sent Events streams with gevent.
+    extras_require = {'sse': ['gevent']},
     # only needed when installing directly from setup.py (PyPi, eggs?) and pointing to e.g. a git repo.
     # Keep in mind that dependency_links are not used when installing with requirements.txt
     # and need to be added redundant to requirements.txt in this case!
@@ -0,0 +1,37 @@
+# -*- coding: utf8 -*-
+# This file is part of PYBOSSA.
+#
+# Copyright (C) 2018 Scifabric LTD.
+#
+# PYBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PYBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PYBOSSA. If not, see <http://www.gnu.org/licenses/>.
+"""Serve the Server-Sent Events streams of the projects.
+
+Every stream stays open while its page is, so they are served here by gevent
+instead of by the uwsgi workers; nginx proxies only the stream URLs to it.
+"""
+try:
+    from gevent import monkey
+    monkey.patch_all()
+    from gevent.pywsgi import WSGIServer
+except ImportError:  # pragma: no cover
+    raise SystemExit('sse_gateway.py requires gevent: pip install pybossa[sse]')
+
+from pybossa.core import create_app
+
+app = create_app()
+
+if __name__ == "__main__":  # pragma: no cover
+    server = WSGIServer((app.config['SSE_GATEWAY_HOST'],
+                         app.config['SSE_GATEWAY_PORT']), app)
+    server.serve_forever()
@@ -0,0 +1,106 @@
+# -*- coding: utf8 -*-
+# This file is part of PYBOSSA.
+#
+# Copyright (C) 2018 Scifabric LTD.
+#
+# PYBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PYBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+import gzip
+import json
+from StringIO import StringIO
+from default import db, with_context
+from test_api import TestAPI
+from factories import ProjectFactory, TaskFactory, TaskRunFactory, UserFactory
+from pybossa.repositories import ResultRepository
+
+result_repo = ResultRepository(db)
+
+
+class TestNDJSONAPI(TestAPI):
+
+    def lines(self, res):
+        return [json.loads(line) for line in res.data.splitlines()]
+
+    @with_context
+    def test_taskruns_ndjson(self):
+        """Test API taskruns.ndjson streams the task runs of a project to
+        its owners"""
+        owner, other = UserFactory.create_batch(2)
+        project = ProjectFactory.create(owner=owner)
+        taskruns = TaskRunFactory.create_batch(3, project=project)
+        TaskRunFactory.create()
+        url = '/api/project/%s/taskruns.ndjson' % project.id
+
+        res = self.app.get(url + '?api_key=' + owner.api_key)
+        assert res.status_code == 200, res.data
+        assert res.mimetype == 'application/x-ndjson', res.mimetype
+        data = self.lines(res)
+        assert [tr['id'] for tr in data] == [tr.id for tr in taskruns], data
+        assert data[0] == json.loads(json.dumps(taskruns[0].dictize()))
+
+        res = self.app.get(url + '?since_id=%s&api_key=%s'
+                           % (taskruns[0].id, owner.api_key))
+        data = self.lines(res)
+        assert [tr['id'] for tr in data] == [tr.id for tr in taskruns[1:]]
+
+        res = self.app.get(url + '?api_key=' + other.api_key)
+        assert res.status_code == 403, res.status_code
+        res = self.app.get(url)
+        assert res.status_code == 401, res.status_code
+        res = self.app.get('/api/project/9999/taskruns.ndjson?api_key='
+                           + owner.api_key)
+        assert res.status_code == 404, res.status_code
+
+    @with_context
+    def test_ndjson_gzip(self):
+        """Test API ndjson exports are gzipped when the client accepts it"""
+        owner = UserFactory.create()
+        project = ProjectFactory.create(owner=owner)
+        for task in TaskFactory.create_batch(2, project=project,
+                                             n_answers=1):
+            TaskRunFactory.create(task=task)
+        results = result_repo.filter_by(project_id=project.id)
+        assert len(results) == 2, results
+        url = '/api/project/%s/results.ndjson?api_key=%s' % (project.id,
+                                                              owner.api_key)
+
+        res = self.app.get(url, headers={'Accept-Encoding': 'gzip'})
+        assert res.headers['Content-Encoding'] == 'gzip', res.headers
+        lines = gzip.GzipFile(fileobj=StringIO(res.data)).read()
+        data = [json.loads(line) for line in lines.splitlines()]
+        assert [r['id'] for r in data] == [r.id for r in results], data
+
+    @with_context
+    def test_tasks_ndjson(self):
+        """Test API tasks.ndjson hides gold answers and filters by since"""
+        owner, user = UserFactory.create_batch(2)
+        project = ProjectFactory.create(owner=owner)
+        TaskFactory.create(project=project, created='2018-01-01T00:00:00')
+        tasks = [TaskFactory.create(project=project, created=created,
+                                    gold_answers={'answer': 1})
+                 for created in ['2018-01-02T00:00:00',
+                                 '2018-01-03T00:00:00']]
+        url = '/api/project/%s/tasks.ndjson?since=%s&api_key=%s'
+
+        res = self.app.get(url % (project.id, '2018-01-02', user.api_key))
+        data = self.lines(res)
+        assert [t['id'] for t in data] == [t.id for t in tasks], data
+        assert 'gold_answers' not in data[0], data
+
+        res = self.app.get(url % (project.id, '2018-01-02T01:00:00%2B01:00',
+                                  owner.api_key))
+        data = self.lines(res)
+        assert [t['id'] for t in data] == [t.id for t in tasks], data
+
+        res = self.app.get(url % (project.id, 'yesterday', owner.api_key))
+        assert res.status_code == 400, res.status_code
@@ -20,6 +20,7 @@ from default import db, with_context
 from nose.tools import assert_equal
 from test_api import TestAPI
 from mock import patch, call
+from sqlalchemy import event
 from helper.gig_helper import make_subadmin
 
 from factories import ProjectFactory, TaskFactory, TaskRunFactory, UserFactory
@@ -1161,3 +1162,110 @@ class TestTaskAPI(TestAPI):
         res = self.app.post('/api/task', data=json.dumps(data), headers=admin_headers)
         res_data = json.loads(res.data)
         assert res_data['exception_msg'] == 'Missing or incorrect required fields: ', res
+
+    @with_context
+    def test_task_query_related_queries(self):
+        """Test related=True reads the task runs and results of a page of
+        tasks with one query each."""
+        admin = UserFactory.create(admin=True)
+        self.create_result(n_results=10, n_answers=2)
+        url = '/api/task?all=1&related=True&api_key=%s&limit=' % admin.api_key
+        statements = []
+
+        def count_statement(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        def get(limit):
+            del statements[:]
+            return json.loads(self.app.get(url + str(limit)).data)
+
+        event.listen(db.engine, 'before_cursor_execute', count_statement)
+        try:
+            get(1)
+            tasks = get(1)
+            n_statements = len(statements)
+            assert len(tasks) == 1, tasks
+            tasks = get(10)
+            assert len(tasks) == 10, tasks
+            assert len(statements) == n_statements, statements
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count_statement)
+
+        for task in tasks:
+            assert len(task['task_runs']) == 2, task
+            assert task['result']['task_id'] == task['id'], task
+
+        with patch.dict(self.flask_app.config,
+                        {'API_RELATED_TASK_RUNS_LIMIT': 1}):
+            for task in get(10):
+                assert len(task['task_runs']) == 1, task
+
+    @with_context
+    def test_task_query_cursor(self):
+        """Test API query for tasks pages with cursor by (orderby, id)"""
+        admin = UserFactory.create()
+        project = ProjectFactory.create(owner=admin)
+        created = ['2018-01-02T00:00:00', '2018-01-01T00:00:00',
+                   '2018-01-02T00:00:00', '', '2018-01-03T00:00:00',
+                   '2018-01-01T00:00:00', '']
+        tasks = [TaskFactory.create(project=project, created=value)
+                 for value in created]
+        expected = sorted([task for task in tasks if task.created],
+                          key=lambda task: (task.created, task.id),
+                          reverse=True)
+        expected += sorted([task for task in tasks if not task.created],
+                           key=lambda task: task.id, reverse=True)
+
+        url = ('/api/task?project_id=%s&orderby=created&desc=1&limit=2'
+               '&api_key=%s&cursor=' % (project.id, admin.api_key))
+        ids = []
+        cursor = ''
+        for _ in range(len(tasks) + 2):
+            res = self.app.get(url + cursor)
+            assert res.status_code == 200, res.data
+            ids += [task['id'] for task in json.loads(res.data)]
+            cursor = res.headers.get('X-Next-Cursor')
+            if not cursor:
+                break
+        assert not cursor
+        assert ids == [task.id for task in expected], ids
+
+        res = self.app.get('/api/task?project_id=%s&orderby=id&limit=3'
+                           '&cursor=' % project.id)
+        cursor = res.headers['X-Next-Cursor']
+        res = self.app.get('/api/task?project_id=%s&orderby=id&limit=3'
+                           '&cursor=%s' % (project.id, cursor))
+        data = json.loads(res.data)
+        assert [task['id'] for task in data] == [t.id for t in tasks[3:6]]
+
+        res = self.app.get('/api/task?orderby=created&cursor=%s' % cursor)
+        assert res.status_code == 400, res.data
+        res = self.app.get('/api/task?orderby=created&cursor=')
+        assert res.status_code == 400, res.data
+        res = self.app.get('/api/task?project_id=%s&orderby=state&cursor='
+                           % project.id)
+        assert res.status_code == 400, res.data
+        res = self.app.get('/api/task?cursor=invalid')
+        assert res.status_code == 400, res.data
+
+    @with_context
+    def test_task_query_reads_projects_once(self):
+        """Test API query for tasks reads the projects of the page once for
+        a non admin user"""
+        user = UserFactory.create()
+        for project in ProjectFactory.create_batch(2):
+            TaskFactory.create_batch(50, project=project)
+        statements = []
+
+        def count_statement(conn, cursor, statement, *args):
+            if 'owners_ids FROM project' in statement:
+                statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', count_statement)
+        try:
+            res = self.app.get('/api/task?all=1&limit=100&api_key='
+                               + user.api_key)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count_statement)
+        assert len(json.loads(res.data)) == 100, res.data
+        assert len(statements) == 1, statements
@@ -17,7 +17,8 @@
 # along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
 
 from default import Test, assert_not_raises, with_context
-from pybossa.auth import ensure_authorized_to
+from pybossa.auth import ensure_authorized_to, is_authorized_many
+from pybossa.cache import project_descriptors
 from nose.tools import assert_raises
 from werkzeug.exceptions import Forbidden, Unauthorized
 from mock import patch
@@ -296,3 +297,25 @@ class TestTaskrunAuthorization(Test):
         assert self.mock_admin.id != user_taskrun.user.id, user_taskrun.user.id
         assert_not_raises(Exception,
                           ensure_authorized_to, 'delete', user_taskrun)
+
+    @with_context
+    def test_owner_read_many_taskruns(self):
+        """Test owners can read the taskruns of their projects in bulk, with
+        the projects read in a single query"""
+        owner = UserFactory.create()
+        own_project = ProjectFactory.create(owner=owner)
+        other_project = ProjectFactory.create()
+        own_task = TaskFactory.create(project=own_project)
+        other_task = TaskFactory.create(project=other_project)
+        taskruns = (TaskRunFactory.create_batch(2, task=own_task) +
+                    TaskRunFactory.create_batch(1, task=other_task))
+        user = mock_current_user(anonymous=False, admin=False, id=owner.id)
+        user.subadmin = False
+
+        with patch.object(project_descriptors, '_load',
+                          wraps=project_descriptors._load) as load:
+            authorized = is_authorized_many(user, 'read', taskruns)
+            assert load.call_count == 1, load.call_count
+        assert authorized == [True, True, False], authorized
+        assert is_authorized_many(self.mock_anonymous, 'read',
+                                  taskruns) == [False] * 3
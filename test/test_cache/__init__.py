@@ -17,11 +17,13 @@
 # along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
 
 import hashlib
+import os
+import time
 from mock import patch
 from pybossa.cache import (get_key_to_hash, get_hash_key, cache, memoize,
                            delete_cached, delete_memoized, memoize_essentials,
                            delete_memoized_essential, delete_cache_group,
-                           get_cache_group_key)
+                           get_cache_group_key, serializer)
 from pybossa.sentinel import Sentinel
 import settings_test
 
@@ -433,3 +435,152 @@ class TestCacheMemoizeFunctions(object):
             return None
         my_func('a')
         assert len(test_sentinel.master.keys()) == 1
+
+
+    def test_memoize_many_shares_keys_with_single_calls(self):
+        """Test CACHE memoize many reads the values stored by single calls and
+        stores the ones it computes for them"""
+
+        @memoize()
+        def my_func(arg, call_count=[]):
+            call_count.append(arg)
+            return len(call_count)
+
+        assert my_func(1) == 1
+        values = my_func.many([1, 2])
+
+        assert values == {1: 1, 2: 2}, values
+        assert my_func(2) == 2
+        assert len(test_sentinel.master.keys()) == 2
+
+
+    def test_memoize_many_uses_batch_function_for_misses(self):
+        """Test CACHE memoize many computes all the misses with one call to
+        the registered batch function"""
+        batches = []
+
+        @memoize(cache_group_keys=([0],))
+        def my_func(arg):
+            return arg * 2
+
+        @my_func.batch
+        def my_func_many(args):
+            batches.append(args)
+            return dict((arg, arg * 2) for arg in args)
+
+        my_func(1)
+        values = my_func.many([1, 2, 3])
+
+        assert values == {1: 2, 2: 4, 3: 6}, values
+        assert batches == [[2, 3]], batches
+        assert my_func.many([2, 3]) == {2: 4, 3: 6}
+        assert batches == [[2, 3]], batches
+        delete_cache_group('3')
+        my_func.many([2, 3])
+        assert batches == [[2, 3], [3]], batches
+
+    def test_memoize_many_reads_falsy_cached_values(self):
+        """Test CACHE memoize many does not recompute cached falsy values"""
+        calls = []
+
+        @memoize()
+        def my_func(arg):
+            calls.append(arg)
+            return 0
+
+        assert my_func.many([1]) == {1: 0}
+        assert my_func.many([1]) == {1: 0}
+        assert calls == [1], calls
+
+    def test_memoize_many_does_not_write_when_disabled(self):
+        """Test CACHE memoize many does not store values when the Redis cache
+        is disabled"""
+
+        @memoize()
+        def my_func(arg):
+            return arg * 2
+
+        with patch.dict(os.environ, {'PYBOSSA_REDIS_CACHE_DISABLED': '1'}):
+            assert my_func.many([1, 2]) == {1: 2, 2: 4}
+        assert test_sentinel.master.keys() == [], test_sentinel.master.keys()
+
+
+    def test_memoize_waits_for_worker_holding_the_lock(self):
+        """Test CACHE memoize with lock_timeout does not recompute a value
+        another worker is already computing"""
+
+        @memoize(lock_timeout=5)
+        def my_func(arg):
+            return 'computed here'
+        key = get_hash_key("%s:%s_args:" % (settings_test.REDIS_KEYPREFIX,
+                                            my_func.__name__),
+                           get_key_to_hash('arg'))
+        test_sentinel.master.set(key + ':lock', 1)
+
+        def other_worker_stores(seconds):
+            test_sentinel.master.setex(key, 300, serializer.dumps('computed'))
+        with patch('pybossa.cache.time.sleep', side_effect=other_worker_stores):
+            assert my_func('arg') == 'computed'
+
+
+    def test_memoize_computes_when_lock_is_not_released(self):
+        """Test CACHE memoize computes the value itself if the worker holding
+        the lock does not store it in time"""
+
+        @memoize(lock_timeout=0.1)
+        def my_func(arg):
+            return 'computed here'
+        key = get_hash_key("%s:%s_args:" % (settings_test.REDIS_KEYPREFIX,
+                                            my_func.__name__),
+                           get_key_to_hash('arg'))
+        test_sentinel.master.set(key + ':lock', 1)
+
+        assert my_func('arg') == 'computed here'
+        assert test_sentinel.master.get(key + ':lock') == '1'
+
+
+    def test_memoize_releases_the_lock(self):
+        """Test CACHE memoize removes its lock once the value is stored"""
+
+        @memoize(lock_timeout=5)
+        def my_func(arg):
+            return arg
+        my_func('arg')
+
+        assert len(test_sentinel.master.keys('*:lock')) == 0
+
+
+    def test_memoize_early_refresh(self):
+        """Test CACHE memoize with early_refresh recomputes a value before it
+        expires depending on the XFetch draw"""
+
+        @memoize(timeout=5, early_refresh=1)
+        def my_func(arg, call_count=[]):
+            time.sleep(0.01)
+            call_count.append(1)
+            return len(call_count)
+        my_func('arg')
+
+        with patch('pybossa.cache.random.random', return_value=0):
+            assert my_func('arg') == 1
+        with patch('pybossa.cache.random.random', return_value=1 - 1e-300):
+            assert my_func('arg') == 2
+        assert my_func('arg') == 2
+
+
+    def test_memoize_early_refresh_serves_value_while_locked(self):
+        """Test CACHE memoize early refresh is done by a single worker"""
+
+        @memoize(timeout=5, early_refresh=1, lock_timeout=5)
+        def my_func(arg, call_count=[]):
+            time.sleep(0.01)
+            call_count.append(1)
+            return len(call_count)
+        my_func('arg')
+        key = get_hash_key("%s:%s_args:" % (settings_test.REDIS_KEYPREFIX,
+                                            my_func.__name__),
+                           get_key_to_hash('arg'))
+        test_sentinel.master.set(key + ':lock', 1)
+
+        with patch('pybossa.cache.random.random', return_value=1 - 1e-300):
+            assert my_func('arg') == 1
@@ -0,0 +1,93 @@
+# -*- coding: utf8 -*-
+# This file is part of PYBOSSA.
+#
+# Copyright (C) 2018 Scifabric LTD.
+#
+# PYBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PYBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+from mock import patch
+from default import Test, db, sentinel, with_context
+from factories import ProjectFactory, TaskFactory, TaskRunFactory, UserFactory
+from pybossa.cache import helpers, available_tasks
+from pybossa.repositories import TaskRepository
+
+task_repo = TaskRepository(db)
+
+
+class TestAvailableTasksCache(Test):
+
+    def setUp(self):
+        super(TestAvailableTasksCache, self).setUp()
+        self.cache = os.environ.pop('PYBOSSA_REDIS_CACHE_DISABLED', None)
+        sentinel.master.flushall()
+
+    def tearDown(self):
+        if self.cache is not None:
+            os.environ['PYBOSSA_REDIS_CACHE_DISABLED'] = self.cache
+        super(TestAvailableTasksCache, self).tearDown()
+
+    @with_context
+    def test_counts_are_cached(self):
+        """Test n_available_tasks only queries the database once"""
+        project = ProjectFactory.create()
+        TaskFactory.create_batch(2, project=project)
+
+        assert helpers.n_available_tasks(project.id, user_id=1) == 2
+        with patch.object(helpers, '_n_available_tasks') as count:
+            assert helpers.n_available_tasks(project.id, user_id=1) == 2
+            assert not count.called
+
+    @with_context
+    def test_task_run_decrements_its_contributor(self):
+        """Test a task run decrements the counts of its contributor and keeps
+        the others"""
+        project = ProjectFactory.create()
+        tasks = TaskFactory.create_batch(3, project=project, n_answers=2)
+        user, other = UserFactory.create_batch(2)
+        assert helpers.n_available_tasks(project.id, user_id=user.id) == 3
+        assert helpers.n_available_tasks_for_user(project, user.id) == 3
+        assert helpers.n_available_tasks(project.id, user_id=other.id) == 3
+
+        TaskRunFactory.create(task=tasks[0], user=user)
+
+        with patch.object(helpers, '_n_available_tasks') as count:
+            assert helpers.n_available_tasks(project.id, user_id=user.id) == 2
+            assert helpers.n_available_tasks(project.id, user_id=other.id) == 3
+            assert not count.called
+        assert helpers.n_available_tasks_for_user(project, user.id) == 2
+
+    @with_context
+    def test_task_changes_reset_the_project(self):
+        """Test completed, new and deleted tasks reset the counts"""
+        project = ProjectFactory.create()
+        tasks = TaskFactory.create_batch(2, project=project, n_answers=1)
+        user, other = UserFactory.create_batch(2)
+        assert helpers.n_available_tasks(project.id, user_id=other.id) == 2
+
+        TaskRunFactory.create(task=tasks[0], user=user)
+        assert helpers.n_available_tasks(project.id, user_id=other.id) == 1
+
+        TaskFactory.create(project=project)
+        assert helpers.n_available_tasks(project.id, user_id=other.id) == 2
+
+        task_repo.delete_valid_from_project(project)
+        assert helpers.n_available_tasks(project.id, user_id=other.id) == 0
+
+    @with_context
+    def test_counts_of_anonymous_contributors(self):
+        """Test anonymous contributors are counted by IP"""
+        assert available_tasks.contributor(1) == 'user:1'
+        assert available_tasks.contributor(None, '10.0.0.1') == 'ip:10.0.0.1'
+        assert available_tasks.contributor() == 'ip:127.0.0.1'
@@ -17,6 +17,7 @@
 # along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
 
 from default import Test, with_context
+from pybossa.core import task_repo
 from pybossa.cache.project_stats import *
 from factories import UserFactory, ProjectFactory, TaskFactory, \
     TaskRunFactory, AnonymousTaskRunFactory
@@ -146,3 +147,29 @@ class TestProjectsStatsCache(Test):
         assert max_hours == 1
         assert max_hours_anon is None
         assert max_hours_auth == 1
+
+    @with_context
+    def test_stats_follow_bulk_deletes(self):
+        """Test CACHE PROJECT STATS discount task runs deleted in bulk."""
+        pr = ProjectFactory.create()
+        kept, deleted = TaskFactory.create_batch(2, project=pr, n_answers=3)
+        user = UserFactory.create()
+        TaskRunFactory.create(project=pr, task=kept, user=user)
+        TaskRunFactory.create(project=pr, task=deleted, user=user)
+        AnonymousTaskRunFactory.create(project=pr, task=deleted)
+
+        task_repo.delete_task_by_id(pr.id, deleted.id)
+
+        users, anon_users, auth_users = stats_users(pr.id)
+        assert auth_users == [[user.id, 1]], auth_users
+        assert anon_users == [], anon_users
+        assert users == dict(n_auth=1, n_anon=0), users
+        hours, hours_anon, hours_auth, max_hours, \
+            max_hours_anon, max_hours_auth = stats_hours(pr.id)
+        assert sum(hours.values()) == 1, hours
+        assert max_hours_anon == 0, max_hours_anon
+
+        task_repo.delete_taskruns_from_project(pr)
+
+        users, anon_users, auth_users = stats_users(pr.id)
+        assert auth_users == [], auth_users
@@ -16,7 +16,8 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
 
-from default import Test, with_context
+import os
+from default import Test, with_context, with_context_settings
 from pybossa.cache import projects as cached_projects
 from factories import UserFactory, ProjectFactory, TaskFactory, \
     TaskRunFactory, AnonymousTaskRunFactory
@@ -25,8 +26,9 @@ import datetime
 from pybossa.core import result_repo
 from pybossa.model.project import Project
 from pybossa.cache.project_stats import update_stats
-from nose.tools import nottest
+from nose.tools import nottest, assert_raises
 from pybossa.cache.task_browse_helpers import get_task_filters, parse_tasks_browse_args
+from test_cache import test_sentinel
 
 class TestProjectsCache(Test):
 
@@ -432,6 +434,102 @@ class TestProjectsCache(Test):
         assert cached_tasks[0].get('pct_status') == 1.0, cached_tasks[0].get('pct_status')
 
 
+    def browse_pages(self, project_id, query, per_page, keyset):
+        """Return the task ids of every browse page of a project."""
+        pages = []
+        cursor = ''
+        offset = 0
+        while True:
+            if keyset:
+                args = parse_tasks_browse_args(dict(query, cursor=cursor))
+            else:
+                args = parse_tasks_browse_args(query)
+                args['offset'] = offset
+            args['records_per_page'] = per_page
+            count, tasks = cached_projects.browse_tasks(project_id, args)
+            pages.append([task['id'] for task in tasks])
+            if len(tasks) < per_page:
+                return pages
+            if keyset:
+                cursor = tasks[-1]['cursor']
+            offset += per_page
+
+    @with_context
+    def test_browse_tasks_keyset_pages_match_offset_pages(self):
+        """Test CACHE PROJECTS browse_tasks cursor pages are the offset
+        pages, also for descending orders of nullable columns"""
+        project = ProjectFactory.create()
+        tasks = TaskFactory.create_batch(7, project=project, n_answers=2)
+        for task in tasks[:3]:
+            TaskRunFactory.create(task=task)
+        TaskRunFactory.create(task=tasks[4])
+
+        for order_by in (None, 'task_id desc', 'created asc',
+                         'priority desc,task_id desc'):
+            query = dict(order_by=order_by) if order_by else {}
+            offset_pages = self.browse_pages(project.id, query, 3, False)
+            keyset_pages = self.browse_pages(project.id, query, 3, True)
+            assert keyset_pages == offset_pages, (order_by, keyset_pages,
+                                                  offset_pages)
+            assert sum(len(page) for page in keyset_pages) == 7
+
+    @with_context
+    def test_browse_tasks_cursor_needs_single_direction(self):
+        """Test CACHE PROJECTS cursors are rejected for mixed order
+        directions, for orders without an index and for cursors of other
+        orders"""
+        query = dict(order_by='priority desc,task_id asc', cursor='')
+        assert_raises(ValueError, parse_tasks_browse_args, query)
+
+        query = dict(order_by='finish_time desc', cursor='')
+        assert_raises(ValueError, parse_tasks_browse_args, query)
+
+        cursor = cached_projects.encode_cursor([1])
+        query = dict(order_by='priority desc', cursor=cursor)
+        assert_raises(ValueError, parse_tasks_browse_args, query)
+
+        query = dict(cursor='not a cursor')
+        assert_raises(ValueError, parse_tasks_browse_args, query)
+
+    @with_context
+    @patch('pybossa.cache.sentinel', new=test_sentinel)
+    @patch('pybossa.cache.projects.task_count', return_value=0)
+    def test_browse_tasks_counts_once_per_filters(self, task_count):
+        """Test CACHE PROJECTS browse_tasks_count ignores paging and order
+        arguments"""
+        disabled = os.environ.pop('PYBOSSA_REDIS_CACHE_DISABLED', None)
+        test_sentinel.master.flushall()
+        try:
+            args = dict(state='ongoing', records_per_page=10)
+            cached_projects.browse_tasks_count(1, args)
+            cached_projects.browse_tasks_count(
+                1, dict(args, offset=10, order_by='id desc', after=[5]))
+            assert task_count.call_count == 1, task_count.call_count
+
+            cached_projects.browse_tasks_count(1, dict(state='completed'))
+            assert task_count.call_count == 2, task_count.call_count
+        finally:
+            if disabled is not None:
+                os.environ['PYBOSSA_REDIS_CACHE_DISABLED'] = disabled
+
+    @with_context_settings(BROWSE_TASKS_COUNT_ESTIMATE_THRESHOLD=10)
+    @patch('pybossa.cache.projects.n_tasks')
+    @patch('pybossa.cache.projects.estimate_task_count', return_value=49)
+    @patch('pybossa.cache.projects.cached_task_count', return_value=45)
+    def test_browse_tasks_count_estimate(self, cached, estimate, n_tasks):
+        """Test CACHE PROJECTS browse_tasks_count estimates big projects"""
+        n_tasks.return_value = 5
+        assert cached_projects.browse_tasks_count(1, {}) == 45
+        n_tasks.return_value = 50
+        assert cached_projects.browse_tasks_count(1, {}) == 49
+
+    @with_context
+    def test_estimate_task_count(self):
+        """Test CACHE PROJECTS estimate_task_count reads the query plan"""
+        project = ProjectFactory.create()
+        TaskFactory.create_batch(3, project=project)
+        assert cached_projects.estimate_task_count(project.id, {}) >= 0
+
     @with_context
     def test_n_featured_returns_nothing(self):
         """Test CACHE PROJECTS _n_featured 0 if there are no featured projects"""
@@ -451,9 +549,9 @@ class TestProjectsCache(Test):
 
 
     @with_context
-    @patch('pybossa.cache.pickle')
+    @patch('pybossa.cache.serializer')
     @patch('pybossa.cache.projects._n_draft')
-    def test_n_count_calls_n_draft(self, _n_draft, pickle):
+    def test_n_count_calls_n_draft(self, _n_draft, serializer):
         """Test CACHE PROJECTS n_count calls _n_draft when called with argument
         'draft'"""
         cached_projects.n_count('draft')
@@ -462,9 +560,9 @@ class TestProjectsCache(Test):
 
 
     @with_context
-    @patch('pybossa.cache.pickle')
+    @patch('pybossa.cache.serializer')
     @patch('pybossa.cache.projects._n_featured')
-    def test_n_count_calls_n_featuredt(self, _n_featured, pickle):
+    def test_n_count_calls_n_featuredt(self, _n_featured, serializer):
         """Test CACHE PROJECTS n_count calls _n_featured when called with
         argument 'featured'"""
         cached_projects.n_count('featured')
@@ -608,6 +706,28 @@ class TestProjectsCache(Test):
 
         assert average_time == 0, average_time
 
+    @with_context
+    def test_listing_stats_matches_single_project_stats(self):
+        """Test CACHE PROJECTS listing_stats returns the same stats as the
+        per project functions"""
+        empty = ProjectFactory.create()
+        project = self.create_project_with_tasks(1, 3)
+        task = TaskFactory.create(project=project, n_answers=2)
+        TaskRunFactory.create(task=task)
+        AnonymousTaskRunFactory.create(task=task)
+        project_ids = [empty.id, project.id]
+
+        stats = cached_projects.listing_stats(project_ids)
+
+        for project_id in project_ids:
+            expected = dict(
+                overall_progress=cached_projects.overall_progress(project_id),
+                n_tasks=cached_projects.n_tasks(project_id),
+                n_volunteers=cached_projects.n_volunteers(project_id),
+                last_activity_raw=cached_projects.last_activity(project_id))
+            for key, value in expected.items():
+                assert stats[project_id][key] == value, (key, stats)
+
     @with_context
     def test_average_contribution_time_returns_average_contribution_time(self):
         project = ProjectFactory.create()
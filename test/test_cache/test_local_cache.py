@@ -0,0 +1,124 @@
+# -*- coding: utf8 -*-
+# This file is part of PYBOSSA.
+#
+# Copyright (C) 2018 Scifabric LTD.
+#
+# PYBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PYBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+import os
+from mock import patch, Mock
+from nose.tools import assert_raises
+from redis.exceptions import ConnectionError
+from pybossa.cache import memoize, delete_memoized, local_cache
+from pybossa.cache.local_cache import LocalCache, LocalCacheInvalidator
+from test_cache import test_sentinel
+
+
+class TestLocalCache(object):
+
+    def test_get_returns_stored_value(self):
+        cache = LocalCache()
+        cache.set('key', 'value')
+        assert cache.get('key') == 'value'
+        assert cache.get('other') is None
+
+    def test_entries_expire(self):
+        cache = LocalCache(timeout=5)
+        with patch('pybossa.cache.local_cache.time.time', return_value=100):
+            cache.set('key', 'value', timeout=300)
+        with patch('pybossa.cache.local_cache.time.time', return_value=104):
+            assert cache.get('key') == 'value'
+        with patch('pybossa.cache.local_cache.time.time', return_value=106):
+            assert cache.get('key') is None
+
+    def test_least_recently_used_is_evicted(self):
+        cache = LocalCache(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        assert len(cache) == 2
+        assert cache.get('b') is None
+        assert cache.get('a') == 1
+        assert cache.get('c') == 3
+
+    def test_invalidator_applies_messages(self):
+        cache = LocalCache()
+        invalidator = LocalCacheInvalidator(cache, 'channel')
+        for key in ('prefix:f_args:1', 'prefix:f_args:2', 'prefix:g_args:1'):
+            cache.set(key, key)
+
+        invalidator.apply('key\nprefix:f_args:1')
+        assert cache.get('prefix:f_args:1') is None
+        assert cache.get('prefix:f_args:2') is not None
+
+        invalidator.apply('prefix\nprefix:f_args:')
+        assert cache.get('prefix:f_args:2') is None
+        assert cache.get('prefix:g_args:1') is not None
+
+    @patch('pybossa.cache.local_cache.log')
+    def test_invalidator_logs_listener_errors(self, log):
+        cache = LocalCache()
+        cache.set('key', 'value')
+        invalidator = LocalCacheInvalidator(cache, 'channel')
+        redis_conn = Mock()
+        redis_conn.pubsub.side_effect = ConnectionError()
+
+        with patch('pybossa.cache.local_cache.time.sleep',
+                   side_effect=StopIteration):
+            assert_raises(StopIteration, invalidator._listen, redis_conn)
+
+        assert log.exception.called
+        assert cache.get('key') is None
+
+
+@patch('pybossa.cache.sentinel', new=test_sentinel)
+@patch('pybossa.cache.settings.CACHE_LOCAL', new=True, create=True)
+class TestMemoizeLocalCache(object):
+
+    def setUp(self):
+        self.cache = os.environ.pop('PYBOSSA_REDIS_CACHE_DISABLED', None)
+        test_sentinel.master.flushall()
+        local_cache.clear()
+
+    def tearDown(self):
+        local_cache.clear()
+        if self.cache is not None:
+            os.environ['PYBOSSA_REDIS_CACHE_DISABLED'] = self.cache
+
+    def test_memoize_reads_local_tier_before_redis(self):
+        @memoize()
+        def my_func(arg, call_count=[]):
+            call_count.append(1)
+            return len(call_count)
+
+        assert my_func('arg') == 1
+        assert my_func('arg') == 1
+        test_sentinel.master.flushall()
+
+        assert my_func('arg') == 1
+
+    def test_delete_memoized_drops_local_entries(self):
+        @memoize()
+        def my_func(arg, call_count=[]):
+            call_count.append(1)
+            return len(call_count)
+
+        my_func('arg')
+        my_func('arg')
+        delete_memoized(my_func, 'arg')
+        assert my_func('arg') == 2
+
+        my_func('arg')
+        delete_memoized(my_func)
+        assert my_func('arg') == 3
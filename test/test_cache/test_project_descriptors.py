@@ -0,0 +1,93 @@
+# -*- coding: utf8 -*-
+# This file is part of PYBOSSA.
+#
+# Copyright (C) 2018 Scifabric LTD.
+#
+# PYBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PYBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+
+from mock import patch
+from default import Test, db, sentinel, with_context
+from factories import ProjectFactory
+from pybossa.cache import project_descriptors
+from pybossa.repositories import ProjectRepository
+
+project_repo = ProjectRepository(db)
+
+
+class TestProjectDescriptors(Test):
+
+    @with_context
+    def test_get(self):
+        """Test get returns the project metadata"""
+        project = ProjectFactory.create(info=dict(sched='locked_scheduler',
+                                                  timeout=60, foo='bar'),
+                                        webhook='http://example.com')
+
+        descriptor = project_descriptors.get(project.id)
+
+        assert descriptor.id == project.id
+        assert descriptor.owners_ids == project.owners_ids
+        assert descriptor.webhook == 'http://example.com'
+        assert descriptor.info == dict(sched='locked_scheduler', timeout=60)
+        assert project_descriptors.get(project.id + 1) is None
+
+    @with_context
+    @patch('pybossa.cache.project_descriptors.is_enabled', return_value=True)
+    def test_get_loads_once(self, is_enabled):
+        """Test get only reads the database once per process and version"""
+        sentinel.master.flushall()
+        project_descriptors.descriptors.clear()
+        project = ProjectFactory.create()
+        project_descriptors.get(project.id)
+
+        with patch.object(project_descriptors, '_load') as load:
+            assert project_descriptors.get(project.id).id == project.id
+            assert not load.called
+            with self.flask_app.test_request_context('/'):
+                assert project_descriptors.get(project.id).id == project.id
+                assert not load.called
+
+    @with_context
+    @patch('pybossa.cache.project_descriptors.is_enabled', return_value=False)
+    def test_get_loads_once_per_request_without_cache(self, is_enabled):
+        """Test get reads the database once per request when the Redis cache
+        is disabled"""
+        project = ProjectFactory.create()
+
+        with patch.object(project_descriptors, '_load',
+                          wraps=project_descriptors._load) as load:
+            with self.flask_app.test_request_context('/'):
+                assert project_descriptors.get(project.id).id == project.id
+                assert project_descriptors.get(project.id).id == project.id
+                assert load.call_count == 1, load.call_count
+            with self.flask_app.test_request_context('/'):
+                assert project_descriptors.get(project.id).id == project.id
+                assert load.call_count == 2, load.call_count
+
+    @with_context
+    def test_update_resets_the_descriptor(self):
+        """Test changes to the project load it again"""
+        project = ProjectFactory.create(published=False)
+        assert project_descriptors.get(project.id).published is False
+
+        project.published = True
+        project_repo.update(project)
+        assert project_descriptors.get(project.id).published is True
+
+        # Another process loaded it at the previous version
+        project_descriptors.descriptors.set(project.id, ('old', None))
+        assert project_descriptors.get(project.id).published is True
+
+        project_repo.delete(project)
+        assert project_descriptors.get(project.id) is None
@@ -0,0 +1,157 @@
+# -*- coding: utf8 -*-
+# This file is part of PYBOSSA.
+#
+# Copyright (C) 2018 Scifabric LTD.
+#
+# PYBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PYBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+import datetime
+import os
+import timeit
+import cPickle as pickle
+from mock import patch
+from nose.plugins.skip import SkipTest
+from nose.tools import assert_raises
+from pybossa.cache import get_key_prefix
+from pybossa.cache.serialization import Serializer, msgpack
+import settings_test
+
+
+def browse_tasks_page():
+    tasks = [dict(id=i, n_task_runs=float(i % 3), n_answers=3,
+                  priority_0=0.0, finish_time=u'01-02-18 10:%02d' % (i % 60),
+                  created=u'01-01-18 09:%02d' % (i % 60), calibration=0,
+                  pct_status=(i % 3) / 3.0)
+             for i in range(100)]
+    return (1000, tasks)
+
+
+def user_summary():
+    return dict(id=1, name=u'johndoe', fullname=u'John Doe',
+                created=u'2018-01-01T00:00:00.000000',
+                api_key=u'a5a3a6a2-1f8c-4c1f-8f7e-0a3e2d1f9c7b',
+                twitter_user_id=None, google_user_id=None,
+                facebook_user_id=None,
+                info=dict(avatar=u'avatar.png', container=u'user_1',
+                          extra=u'x' * 200),
+                admin=False, locale=u'en', email_addr=u'john@example.com',
+                n_answers=1234, valid_email=True,
+                confirmation_email_sent=False,
+                registered_ago=u'10 months ago',
+                last_task_submission_on=u'2018-10-01T00:00:00.000000',
+                rank=12, score=1234, total=5000)
+
+
+def project_stats():
+    days = [[u'2018-01-%02d' % (i % 28 + 1), i * 10] for i in range(120)]
+    return dict(n_tasks=1000, n_task_runs=3000, n_results=900,
+                overall_progress=90, n_volunteers=150,
+                n_completed_tasks=900, n_blogposts=2,
+                info=dict(dayStats=days,
+                          hourStats=dict((str(h), h * 3) for h in range(24)),
+                          userStats=dict(
+                              n_anon=10, n_auth=140,
+                              top5=[dict(name=u'user%s' % i, tasks=100 - i)
+                                    for i in range(5)])))
+
+
+SHAPES = [('browse_tasks page', browse_tasks_page()),
+          ('user summary', user_summary()),
+          ('project stats', project_stats())]
+
+
+class TestSerializer(object):
+
+    def test_pickle_payloads_stay_plain_pickles(self):
+        """Test uncompressed pickle payloads can be read by pickle.loads"""
+        serializer = Serializer('pickle')
+        data = serializer.dumps(user_summary())
+        assert pickle.loads(data) == user_summary()
+
+    def test_loads_reads_legacy_pickles(self):
+        """Test values stored before the serializer existed are readable"""
+        for codec in ('pickle', 'json'):
+            serializer = Serializer(codec, compress_threshold=10)
+            assert serializer.loads(pickle.dumps(project_stats())) == \
+                project_stats()
+
+    def test_json_round_trips_compatible_values(self):
+        serializer = Serializer('json')
+        data = serializer.dumps(user_summary())
+        assert data.startswith('\x00j'), repr(data[:3])
+        assert serializer.loads(data) == user_summary()
+
+    def test_json_pickles_values_it_cannot_reproduce(self):
+        serializer = Serializer('json')
+        for value in [(1, 2), {1: 'a'}, datetime.datetime(2018, 1, 1)]:
+            data = serializer.dumps(value)
+            assert not data.startswith('\x00'), repr(data[:3])
+            assert serializer.loads(data) == value
+
+    def test_compression_above_threshold(self):
+        serializer = Serializer('json', compress_threshold=100)
+        small = serializer.dumps(dict(a=1))
+        big = serializer.dumps(project_stats())
+        assert small.startswith('\x00j-'), repr(small[:3])
+        assert big.startswith('\x00jz'), repr(big[:3])
+        assert serializer.loads(big) == project_stats()
+
+    def test_reads_payloads_from_other_codecs(self):
+        data = Serializer('json', compress_threshold=100).dumps(
+            project_stats())
+        assert Serializer('pickle').loads(data) == project_stats()
+
+    def test_unknown_codec(self):
+        assert_raises(ValueError, Serializer, 'yaml')
+
+    @patch('pybossa.cache.settings.CACHE_KEY_VERSION', new=3, create=True)
+    def test_key_version(self):
+        expected = '%s:v3' % settings_test.REDIS_KEYPREFIX
+        assert get_key_prefix() == expected, get_key_prefix()
+
+    def test_benchmark_cached_shapes(self):
+        """Micro-benchmark payload size and encode/decode time per codec.
+
+        Only runs with PYBOSSA_BENCHMARK set. Run with -s to see the table;
+        only correctness is asserted. Values a codec cannot reproduce are
+        pickled, and their rows say so.
+        """
+        if not os.environ.get('PYBOSSA_BENCHMARK'):
+            raise SkipTest('PYBOSSA_BENCHMARK is not set')
+        configs = [('pickle protocol 0 (legacy)', None)]
+        codecs = ['pickle', 'json'] + (['msgpack'] if msgpack else [])
+        for codec in codecs:
+            configs.append((codec, Serializer(codec)))
+            configs.append((codec + ' + zlib', Serializer(codec, 1024)))
+        number = 200
+        lines = ['%-18s %-32s %8s %10s %10s' % ('shape', 'codec', 'bytes',
+                                                'dumps us', 'loads us')]
+        for shape, value in SHAPES:
+            for name, serializer in configs:
+                if serializer is None:
+                    dumps, loads = pickle.dumps, pickle.loads
+                else:
+                    dumps, loads = serializer.dumps, serializer.loads
+                    codec = serializer._encode(value)[0]
+                    if codec is not serializer.codec:
+                        name += ' (pickle fallback)'
+                data = dumps(value)
+                assert loads(data) == value, (shape, name)
+                dumps_time = timeit.timeit(lambda: dumps(value),
+                                           number=number)
+                loads_time = timeit.timeit(lambda: loads(data),
+                                           number=number)
+                lines.append('%-18s %-32s %8d %10.1f %10.1f' % (
+                    shape, name, len(data), dumps_time * 1e6 / number,
+                    loads_time * 1e6 / number))
+        print '\n'.join(lines)
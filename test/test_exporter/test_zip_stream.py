@@ -0,0 +1,94 @@
+# -*- coding: utf8 -*-
+# This file is part of PYBOSSA.
+#
+# Copyright (C) 2018 Scifabric LTD.
+#
+# PYBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PYBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+"""This module tests the ZipStream class."""
+import json
+import zipfile
+from cStringIO import StringIO
+from default import Test, with_context, with_context_settings
+from factories import ProjectFactory, TaskFactory, TaskRunFactory
+from pybossa.core import task_json_exporter, task_csv_exporter
+from pybossa.exporter.zip_stream import ZipStream
+
+
+class TestZipStream(object):
+
+    def test_members_are_readable_by_zipfile(self):
+        out = StringIO()
+        with ZipStream(out) as _zip:
+            _zip.write_iter('rows.csv', ('row,%d\n' % i for i in range(1000)))
+            _zip.writestr(u'caf\xe9.json', u'{"name": "caf\xe9"}')
+            _zip.writestr('empty.txt', '')
+
+        _zip = zipfile.ZipFile(StringIO(out.getvalue()))
+        assert _zip.testzip() is None
+        assert _zip.namelist() == ['rows.csv', u'caf\xe9.json', 'empty.txt']
+        rows = _zip.read('rows.csv').splitlines()
+        assert len(rows) == 1000 and rows[-1] == 'row,999', rows[-1]
+        assert json.loads(_zip.read(u'caf\xe9.json')) == {'name': u'caf\xe9'}
+        assert _zip.read('empty.txt') == ''
+
+    def test_output_is_written_sequentially(self):
+        """Test the archive is written without seeking back."""
+        class WriteOnly(object):
+            def __init__(self):
+                self.data = []
+
+            def write(self, data):
+                self.data.append(data)
+
+        out = WriteOnly()
+        with ZipStream(out, compresslevel=9) as _zip:
+            _zip.write_iter('data.txt', ['a' * 100000])
+        _zip = zipfile.ZipFile(StringIO(''.join(out.data)))
+        info = _zip.getinfo('data.txt')
+        assert info.file_size == 100000
+        assert info.compress_size < 1000, info.compress_size
+
+
+class TestStreamingExport(Test):
+
+    def create_project(self):
+        project = ProjectFactory.create(short_name='streaming')
+        tasks = TaskFactory.create_batch(3, project=project,
+                                         info={u'name': u'caf\xe9'})
+        for task in tasks:
+            TaskRunFactory.create(task=task)
+        return project
+
+    @with_context
+    def test_task_run_json_export_with_filters(self):
+        project = self.create_project()
+        filters = dict(display_info_columns=[])
+        with task_json_exporter.make_zip(project, 'task_run', False,
+                                         filters) as fp:
+            _zip = zipfile.ZipFile(fp.stream)
+            data = json.loads(_zip.read(_zip.namelist()[0]))
+        assert len(data) == 3, data
+        assert fp.filename.endswith('_task_run_json.zip'), fp.filename
+
+    @with_context_settings(EXPORT_COMPRESS_LEVEL=0)
+    def test_task_csv_export_compress_level(self):
+        project = self.create_project()
+        filters = dict(display_info_columns=[])
+        with task_csv_exporter.make_zip(project, 'task', False,
+                                        filters) as fp:
+            _zip = zipfile.ZipFile(fp.stream)
+            info = _zip.infolist()[0]
+            rows = _zip.read(info.filename).splitlines()
+        assert len(rows) == 4, rows
+        assert info.compress_size >= info.file_size
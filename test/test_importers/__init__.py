@@ -16,6 +16,8 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
 from mock import patch, Mock
+from nose.tools import assert_raises
+from rq.timeouts import JobTimeoutException
 from pybossa.importers import Importer
 
 from default import Test, with_context
@@ -104,10 +106,88 @@ class TestImporterPublicMethods(Test):
         importer_factory.return_value = mock_importer
         project = ProjectFactory.create()
         form_data = dict(type='flickr', album_id='1234')
-        with patch.object(task_repo, 'save', side_effect=Exception('a')):
-            result = self.importer.create_tasks(task_repo, project, **form_data)
+        with patch.object(task_repo, 'save_many', side_effect=Exception('b')):
+            with patch.object(task_repo, 'save', side_effect=Exception('a')):
+                result = self.importer.create_tasks(task_repo, project, **form_data)
         assert '1 task import failed due to a' in result.message, result.message
 
+    @with_context
+    def test_create_tasks_skips_duplicates_in_the_import(self, importer_factory):
+        mock_importer = Mock()
+        mock_importer.tasks.return_value = [{'info': {'question': 'question'}}
+                                            for i in range(3)]
+        importer_factory.return_value = mock_importer
+        project = ProjectFactory.create()
+        form_data = dict(type='flickr', album_id='1234')
+
+        result = self.importer.create_tasks(task_repo, project, **form_data)
+        tasks = task_repo.filter_tasks_by(project_id=project.id)
+
+        assert len(tasks) == 1, len(tasks)
+        assert result.total == 1, result.total
+
+    @with_context
+    def test_create_tasks_resumes_failed_import(self, importer_factory):
+        mock_importer = Mock()
+        mock_importer.tasks.return_value = [{'info': {'question': i}}
+                                            for i in range(5)]
+        importer_factory.return_value = mock_importer
+        project = ProjectFactory.create()
+        form_data = dict(type='flickr', album_id='1234')
+        save_many = task_repo.save_many
+        calls = []
+
+        def fail_second_batch(project, tasks):
+            calls.append([task.info['question'] for task in tasks])
+            if len(calls) == 2:
+                raise JobTimeoutException()
+            return save_many(project, tasks)
+
+        with patch.dict(self.flask_app.config, {'IMPORT_TASKS_BATCH_SIZE': 2}):
+            with patch.object(task_repo, 'save_many',
+                              side_effect=fail_second_batch):
+                assert_raises(JobTimeoutException, self.importer.create_tasks,
+                              task_repo, project, **form_data)
+                result = self.importer.create_tasks(task_repo, project,
+                                                    **form_data)
+        tasks = task_repo.filter_tasks_by(project_id=project.id)
+
+        assert calls == [[0, 1], [2, 3], [2, 3], [4]], calls
+        assert len(tasks) == 5, len(tasks)
+        assert result.total == 5, result.total
+
+    @with_context
+    def test_create_tasks_restarts_import_if_source_changed(self, importer_factory):
+        mock_importer = Mock()
+        mock_importer.tasks.return_value = [{'info': {'question': i}}
+                                            for i in range(5)]
+        importer_factory.return_value = mock_importer
+        project = ProjectFactory.create()
+        form_data = dict(type='csv', csv_url='http://fakecsv.com')
+        save_many = task_repo.save_many
+        calls = []
+
+        def fail_second_batch(project, tasks):
+            calls.append([task.info['question'] for task in tasks])
+            if len(calls) == 2:
+                raise JobTimeoutException()
+            return save_many(project, tasks)
+
+        with patch.dict(self.flask_app.config, {'IMPORT_TASKS_BATCH_SIZE': 2}):
+            with patch.object(task_repo, 'save_many',
+                              side_effect=fail_second_batch):
+                assert_raises(JobTimeoutException, self.importer.create_tasks,
+                              task_repo, project, **form_data)
+                mock_importer.tasks.return_value = [{'info': {'question': i}}
+                                                    for i in range(10, 15)]
+                result = self.importer.create_tasks(task_repo, project,
+                                                    **form_data)
+        tasks = task_repo.filter_tasks_by(project_id=project.id)
+
+        assert calls == [[0, 1], [2, 3], [10, 11], [12, 13], [14]], calls
+        assert len(tasks) == 7, len(tasks)
+        assert result.total == 7, result.total
+
     @with_context
     def test_count_tasks_to_import_returns_number_of_tasks_to_import(self, importer_factory):
         mock_importer = Mock()
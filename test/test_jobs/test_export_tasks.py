@@ -1,4 +1,4 @@
-from default import Test, with_context, flask_app
+from default import Test, with_context, with_context_settings, flask_app
 from factories import ProjectFactory, UserFactory, TaskFactory, TaskRunFactory
 from pybossa.jobs import export_tasks
 from mock import patch, MagicMock
@@ -130,3 +130,26 @@ class TestExport(Test):
         message = args[0]
         assert message.recipients[0] == user.email_addr, message.recipients
         assert message.subject == 'Data exported for your project: test_project', message.subject
+
+    @with_context_settings(EXPORT_MAX_ATTACHMENT_SIZE=10)
+    @patch('pybossa.exporter.json_export.scheduler')
+    @patch('pybossa.jobs.uploader')
+    @patch('pybossa.jobs.mail')
+    def test_export_tasks_links_big_exports(self, mail, uploader, scheduler):
+        """Test JOB export_tasks uploads exports too big to be attached."""
+        user = UserFactory.create(admin=True)
+        project = ProjectFactory.create(name='test_project')
+        task = TaskFactory.create(project=project)
+        TaskRunFactory.create(project=project, task=task)
+        uploader.upload_file.return_value = True
+
+        export_tasks(user.email_addr, project.short_name, 'task', False, 'json')
+        message = mail.send.call_args[0][0]
+
+        assert not message.attachments, message.attachments
+        _file = uploader.upload_file.call_args[0][0]
+        container = uploader.upload_file.call_args[1]['container']
+        assert container == 'user_%d' % project.owner_id, container
+        assert '_sec_' in _file.filename, _file.filename
+        assert _file.filename in message.body, message.body
+        assert scheduler.enqueue_in.called
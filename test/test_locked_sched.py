@@ -23,6 +23,8 @@ from pybossa.sched import (
     Schedulers,
     get_task_users_key,
     acquire_lock,
+    acquire_first_lock,
+    get_user_tasks,
     has_lock,
     get_task_id_and_duration_for_project_user,
     get_task_id_project_id_key
@@ -142,6 +144,44 @@ class TestLockedSched(sched.Helper):
         acquire_lock(task_id, user_id, limit, timeout)
         assert has_lock(task_id, user_id, limit)
 
+    @with_context
+    def test_acquire_lock_respects_limit(self):
+        timeout = 100
+        assert acquire_lock(1, 1, 1, timeout)
+        assert acquire_lock(1, 1, 1, timeout), 'lock holder keeps its lock'
+        assert not acquire_lock(1, 2, 1, timeout)
+        assert acquire_lock(1, 2, float('inf'), timeout)
+
+    @with_context
+    def test_acquire_first_lock(self):
+        timeout = 100
+        acquire_lock(1, 1, 1, timeout)
+        acquire_lock(2, 1, 1, timeout)
+
+        position = acquire_first_lock([(1, 1), (2, 1), (3, 1), (4, 1)], 2,
+                                      timeout)
+
+        assert position == 2, position
+        assert has_lock(3, 2, timeout)
+        assert not has_lock(4, 2, timeout)
+        assert get_user_tasks(2, timeout).keys() == ['3']
+
+    @with_context
+    def test_acquire_first_lock_none_available(self):
+        timeout = 100
+        acquire_lock(1, 1, 1, timeout)
+
+        assert acquire_first_lock([(1, 1), (2, 0)], 2, timeout) is None
+        assert acquire_first_lock([], 2, timeout) is None
+        assert get_user_tasks(2, timeout) == {}
+
+    @with_context
+    def test_acquire_first_lock_releases_expired_locks(self):
+        acquire_lock(1, 1, 1, -1)
+
+        assert acquire_first_lock([(1, 1)], 2, 100) == 0
+        assert not has_lock(1, 1, 100)
+
     @with_context
     def test_get_task_id_and_duration_for_project_user_missing(self):
         user = UserFactory.create()
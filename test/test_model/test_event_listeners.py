@@ -17,13 +17,15 @@
 # along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
 
 from default import Test, with_context
-from factories import TaskFactory, TaskRunFactory
-from mock import patch, MagicMock
+from factories import TaskFactory, TaskRunFactory, ProjectFactory, UserFactory
+from mock import patch, MagicMock, call
 from pybossa.core import db, task_repo, result_repo
 from pybossa.model.counter import Counter
+from pybossa.model.task_stats import TaskStats
+from pybossa.model.project_hourly_stats import ProjectHourlyStats
 from pybossa.model.event_listeners import *
 from pybossa.jobs import notify_blog_users
-from sqlalchemy import func
+from sqlalchemy import event, func
 
 
 """Tests for model event listeners."""
@@ -121,40 +123,123 @@ class TestModelEventListeners(Test):
 
     @with_context
     @patch('pybossa.model.event_listeners.push_webhook')
-    @patch('pybossa.model.event_listeners.create_result', return_value=1)
-    @patch('pybossa.model.event_listeners.update_task_state')
-    @patch('pybossa.model.event_listeners.is_task_completed', return_value=True)
-    @patch('pybossa.model.event_listeners.add_user_contributed_to_feed')
     @patch('pybossa.model.event_listeners.update_feed')
-    def test_on_taskrun_submit_event(self, mock_update_feed,
-                                     mock_add_user,
-                                     mock_is_task,
-                                     mock_update_task,
-                                     mock_create_result,
-                                     mock_push):
+    def test_on_taskrun_submit_event(self, mock_update_feed, mock_push):
         """Test on_taskrun_submit is called."""
-        conn = MagicMock()
-        target = MagicMock()
-        target.id = 1
-        target.project_id = 1
-        target.task_id = 2
-        target.user_id = 3
-        tmp = Project(id=1, name='name', short_name='short_name',
-                      info=dict(container=1, thumbnail="avatar.png"),
-                      published=True,
-                      webhook='http://localhost.com')
-        conn.execute.return_value = [tmp]
-        on_taskrun_submit(None, conn, target)
-        obj = tmp.to_public_json()
+        user = UserFactory.create()
+        project = ProjectFactory.create(webhook='http://localhost.com')
+        task = TaskFactory.create(project=project, n_answers=1)
+        mock_update_feed.reset_mock()
+
+        TaskRunFactory.create(task=task, user=user)
+
+        assert task_repo.get_task(task.id).state == 'completed'
+        result = result_repo.filter_by(project_id=project.id,
+                                       task_id=task.id,
+                                       last_version=True)[0]
+        contribution = User().to_public_json(dict(id=user.id,
+                                                  name=user.name,
+                                                  fullname=user.fullname,
+                                                  info=user.info))
+        contribution['project_name'] = project.name
+        contribution['project_short_name'] = project.short_name
+        contribution['action_updated'] = 'UserContribution'
+        obj = Project().to_public_json(dict(id=project.id,
+                                            name=project.name,
+                                            short_name=project.short_name,
+                                            info=project.info))
         obj['action_updated'] = 'TaskCompleted'
-        mock_add_user.assert_called_with(conn, target.user_id, obj)
-        mock_update_task.assert_called_with(conn, target.task_id)
-        mock_update_feed.assert_called_once_with(obj)
-        obj_with_webhook = tmp.to_public_json()
-        obj_with_webhook['webhook'] = tmp.webhook
-        obj_with_webhook['action_updated'] = 'TaskCompleted'
-        mock_push.assert_called_with(obj_with_webhook, target.task_id, 1)
+        assert mock_update_feed.call_args_list == [call(contribution),
+                                                   call(obj)]
+        obj_with_webhook = dict(obj)
+        obj_with_webhook['webhook'] = project.webhook
+        mock_push.assert_called_once_with(obj_with_webhook, task.id,
+                                          result.id)
+
+    @with_context
+    @patch('pybossa.model.event_listeners.push_webhook')
+    @patch('pybossa.model.event_listeners.update_feed')
+    def test_on_taskrun_submit_waits_for_commit(self, mock_update_feed,
+                                                mock_push):
+        """Test on_taskrun_submit side effects are dropped on rollback."""
+        user = UserFactory.create()
+        task = TaskFactory.create(n_answers=1)
+        mock_update_feed.reset_mock()
+        task_run = TaskRunFactory.build(task=task, user=user)
+
+        db.session.add(task_run)
+        db.session.flush()
+        assert not mock_update_feed.called
+        assert not mock_push.called
+        db.session.rollback()
+
+        db.session.commit()
+        assert not mock_update_feed.called
+        assert not mock_push.called
+        assert task_repo.get_task(task.id).state == 'ongoing'
+
+    @with_context
+    @patch('pybossa.model.event_listeners.push_webhook')
+    @patch('pybossa.model.event_listeners.update_feed')
+    def test_savepoint_rollback_keeps_outer_callbacks(self, mock_update_feed,
+                                                      mock_push):
+        """Test rolling back a SAVEPOINT only drops its own side effects."""
+        user = UserFactory.create()
+        task, other_task = TaskFactory.create_batch(2, n_answers=1)
+        mock_update_feed.reset_mock()
+
+        db.session.add(TaskRunFactory.build(task=task, user=user))
+        db.session.flush()
+        db.session.begin_nested()
+        db.session.add(TaskRunFactory.build(task=other_task, user=user))
+        db.session.flush()
+        db.session.rollback()
+        assert not mock_push.called
+        db.session.commit()
+
+        assert mock_push.call_count == 1, mock_push.call_args_list
+        assert mock_push.call_args[0][1] == task.id, mock_push.call_args
+
+    @with_context
+    @patch('pybossa.model.event_listeners.push_webhook')
+    @patch('pybossa.model.event_listeners.update_feed')
+    def test_failing_after_commit_callback_is_logged(self, mock_update_feed,
+                                                     mock_push):
+        """Test a failing after_commit callback does not skip the others."""
+        user = UserFactory.create()
+        task = TaskFactory.create(n_answers=1)
+        mock_update_feed.side_effect = Exception('feed is down')
+
+        with patch.object(self.flask_app.logger, 'exception') as exception:
+            TaskRunFactory.create(task=task, user=user)
 
+        assert exception.called
+        assert mock_push.called
+
+    @with_context
+    @patch('pybossa.model.event_listeners.push_webhook')
+    @patch('pybossa.model.event_listeners.update_feed')
+    def test_on_taskrun_submit_queries(self, mock_update_feed, mock_push):
+        """Test on_taskrun_submit completes a task with two statements."""
+        user = UserFactory.create()
+        task = TaskFactory.create(n_answers=1)
+        TaskRunFactory.create(task=task, user=user)
+        target = TaskRun(project_id=task.project_id, task_id=task.id,
+                         user_id=user.id)
+        statements = []
+        conn = db.engine.connect()
+        event.listen(conn, 'before_cursor_execute',
+                     lambda *args: statements.append(args[2]))
+
+        on_taskrun_submit(None, conn, target)
+
+        # It used to take 11 statements: project, user, task, completion
+        # check, task reload, state update and five for the result.
+        assert len(statements) == 2, statements
+        results = result_repo.filter_by(project_id=task.project_id,
+                                        task_id=task.id)
+        assert len(results) == 2, results
+        assert mock_push.called
 
     @with_context
     @patch('pybossa.model.event_listeners.update_feed')
@@ -169,8 +254,7 @@ class TestModelEventListeners(Test):
         mock_update_feed.assert_called_with(obj)
 
     @with_context
-    @patch('pybossa.model.event_listeners.create_result')
-    def test_create_result_event(self, mock_create_result):
+    def test_create_result_event(self):
         """Test create_result is called."""
         from pybossa.core import db
         task = TaskFactory.create(n_answers=1)
@@ -181,7 +265,6 @@ class TestModelEventListeners(Test):
                                        task_id=task.id,
                                        last_version=True)[0]
 
-        assert mock_create_result.called
         err_msg = "The result should ID should be the same"
         assert result_id == result.id, err_msg
 
@@ -190,7 +273,6 @@ class TestModelEventListeners(Test):
         TaskRunFactory.create(task=task)
 
         result_id = create_result(conn, task.project_id, task.id)
-        assert mock_create_result.called
         result = result_repo.filter_by(project_id=task.project_id,
                                        task_id=task.id,
                                        last_version=True)
@@ -282,3 +364,80 @@ class TestModelEventListeners(Test):
         assert len(counters) == 1, counters
         counter = counters[0]
         assert counter[2] == 0, counter
+
+    @with_context
+    def test_task_stats_created_with_task(self):
+        """Test event listener when adding a task adds its stats row."""
+        task = TaskFactory.create()
+
+        stats = db.session.query(TaskStats).get(task.id)
+
+        assert stats.project_id == task.project_id, stats
+        assert stats.n_task_runs == 0, stats
+        assert stats.last_finish_time is None, stats
+
+    @with_context
+    def test_task_stats_follow_task_runs(self):
+        """Test task stats are updated when adding and deleting task runs."""
+        task = TaskFactory.create(n_answers=3)
+        first = TaskRunFactory.create(task=task,
+                                      finish_time='2018-01-01T00:00:00.000000')
+        last = TaskRunFactory.create(task=task,
+                                     finish_time='2018-01-02T00:00:00.000000')
+
+        stats = db.session.query(TaskStats).get(task.id)
+        assert stats.n_task_runs == 2, stats
+        assert stats.last_finish_time == last.finish_time, stats
+
+        db.session.delete(last)
+        db.session.commit()
+
+        stats = db.session.query(TaskStats).get(task.id)
+        assert stats.n_task_runs == 1, stats
+        assert stats.last_finish_time == first.finish_time, stats
+
+    @with_context
+    def test_complete_task_uses_task_stats(self):
+        """Test complete_task compares task stats with n_answers."""
+        task = TaskFactory.create(n_answers=2, project__published=False)
+        first = TaskRunFactory.create(task=task)
+        conn = db.engine.connect()
+
+        assert complete_task(conn, task.project_id, task.id) is None
+        assert task_repo.get_task(task.id).state == 'ongoing'
+
+        second = TaskRunFactory.create(task=task)
+        result_id = complete_task(conn, task.project_id, task.id)
+
+        result = result_repo.get(result_id)
+        assert result.last_version, result
+        assert result.task_run_ids == [first.id, second.id], result
+        assert task_repo.get_task(task.id).state == 'completed'
+
+    @with_context
+    def test_project_hourly_stats_follow_task_runs(self):
+        """Test project hourly stats count task runs per hour and user."""
+        project = ProjectFactory.create()
+        task = TaskFactory.create(project=project, n_answers=5)
+        user = UserFactory.create()
+        first = TaskRunFactory.create(task=task, user=user,
+                                      finish_time='2018-01-01T10:05:00.000000')
+        TaskRunFactory.create(task=task, user=user,
+                              finish_time='2018-01-01T10:55:00.000000')
+        TaskRunFactory.create(task=task, finish_time='2018-01-01T11:00:00.000000')
+
+        stats = db.session.query(ProjectHourlyStats)\
+                  .filter_by(project_id=project.id, user_id=user.id).all()
+        assert len(stats) == 1, stats
+        assert stats[0].hour.isoformat() == '2018-01-01T10:00:00', stats
+        assert stats[0].n_task_runs == 2, stats
+        assert stats[0].user_ip is None, stats
+
+        db.session.delete(first)
+        db.session.commit()
+
+        db.session.refresh(stats[0])
+        assert stats[0].n_task_runs == 1, stats
+        total = db.session.query(func.sum(ProjectHourlyStats.n_task_runs))\
+                  .filter_by(project_id=project.id).scalar()
+        assert total == 2, total
@@ -18,7 +18,8 @@
 
 from default import Test, db, with_context
 from nose.tools import assert_raises
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError, DataError
 from pybossa.model.user import User
 from pybossa.model.project import Project
 from pybossa.model.task import Task
@@ -59,3 +60,41 @@ class TestModelTaskRun(Test):
         db.session.add(task_run)
         assert_raises(IntegrityError, db.session.commit)
         db.session.rollback()
+
+    @with_context
+    def test_task_run_timestamp_shadows(self):
+        """Test TASK_RUN created and finish_time are copied as timestamptz"""
+        user = User(email_addr="john.doe@example.com", name="johndoe",
+                    fullname="John Doe", locale="en")
+        category = Category(name=u'cat', short_name=u'cat', description=u'cat')
+        project = Project(name='Application', short_name='app',
+                          description='desc', owner=user, category=category)
+        task = Task(project=project)
+        task_run = TaskRun(project=project, task=task,
+                           created=u'2018-01-01T10:00:00.000000',
+                           finish_time=u'2018-01-01T10:00:30.500000')
+        db.session.add(task_run)
+        db.session.commit()
+
+        sql = text('''SELECT EXTRACT(EPOCH FROM finish_time_ts - created_ts),
+                   finish_time_ts AT TIME ZONE 'UTC' FROM task_run
+                   WHERE id=:id''')
+        elapsed, finish_time = db.session.execute(
+            sql, dict(id=task_run.id)).first()
+        assert elapsed == 30.5, elapsed
+        assert finish_time.isoformat() == '2018-01-01T10:00:30.500000'
+
+        task_run.finish_time = u'2018-01-02T10:00:00.000000'
+        db.session.commit()
+        elapsed, _ = db.session.execute(sql, dict(id=task_run.id)).first()
+        assert elapsed == 24 * 3600, elapsed
+
+        task_run.finish_time = u''
+        db.session.commit()
+        elapsed, finish_time = db.session.execute(
+            sql, dict(id=task_run.id)).first()
+        assert elapsed is None and finish_time is None
+
+        task_run.finish_time = u'not a date'
+        assert_raises(DataError, db.session.commit)
+        db.session.rollback()
@@ -27,6 +27,7 @@ import json
 from default import flask_app, sentinel, with_context, rebuild_db
 from factories import ProjectFactory, UserFactory
 from mock import patch
+from pybossa.ratelimit import FixedWindowLimiter, GCRALimiter, local_tokens
 
 
 class TestAPI(object):
@@ -154,3 +155,56 @@ class TestAPI(object):
             for user in users:
                 _url = url % user.api_key
                 self.check_limit(_url, action, 'project')
+
+
+class TestLimiters(object):
+
+    def setUp(self):
+        sentinel.master.flushall()
+        local_tokens.clear()
+
+    @patch('pybossa.ratelimit.time')
+    def test_gcra_limiter(self, mock_time):
+        """Test the gcra limiter allows limit - 1 requests per period, and
+        new ones as the window slides."""
+        limiter = GCRALimiter()
+        mock_time.time.return_value = 1000.0
+        for i in range(4, 0, -1):
+            assert limiter.hit('key', 5, 10) == (True, i, 1010 - 2 * i)
+        assert limiter.hit('key', 5, 10) == (False, 0, 1008)
+
+        mock_time.time.return_value = 1002.0
+        assert limiter.hit('key', 5, 10) == (True, 1, 1010)
+        assert limiter.hit('key', 5, 10)[0] is False
+
+    @patch('pybossa.ratelimit.time')
+    def test_limiters_allow_the_same_requests(self, mock_time):
+        """Test both limiters let the same requests through per window."""
+        mock_time.time.return_value = 1000.0
+        for limiter in (FixedWindowLimiter(), GCRALimiter()):
+            sentinel.master.flushall()
+            hits = [limiter.hit('key', 5, 10)[:2] for i in range(6)]
+            assert hits == [(True, 4), (True, 3), (True, 2), (True, 1),
+                            (False, 0), (False, 0)], hits
+
+    @with_context
+    @patch('pybossa.ratelimit.time')
+    @patch('pybossa.api.api_base.APIBase._db_query')
+    def test_local_batch(self, mock, mock_time):
+        """Test authenticated requests are counted locally in batches."""
+        rebuild_db()
+        mock.return_value = {}
+        mock_time.time.return_value = 1000.0
+        user = UserFactory.create()
+        url = '/api/project?api_key=%s' % user.api_key
+        config = {'RATE_LIMIT_BACKEND': 'gcra', 'RATE_LIMIT_LOCAL_BATCH': 10}
+        with patch.dict(flask_app.config, config):
+            for i in range(299, 289, -1):
+                res = TestAPI.app.get(url)
+                assert int(res.headers['X-RateLimit-Remaining']) == i
+                # The first request reserved the others
+                key = sentinel.master.keys('rate-limit/*')[0]
+                assert float(sentinel.master.get(key)) == 1030000
+            res = TestAPI.app.get(url)
+            assert int(res.headers['X-RateLimit-Remaining']) == 289
+            assert float(sentinel.master.get(key)) == 1060000
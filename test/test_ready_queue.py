@@ -0,0 +1,139 @@
+# -*- coding: utf8 -*-
+# This file is part of PYBOSSA.
+#
+# Copyright (C) 2018 Scifabric LTD.
+#
+# PYBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PYBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+from mock import patch
+from helper import sched
+from default import with_context_settings, db
+from factories import TaskFactory, ProjectFactory, UserFactory
+from pybossa.core import project_repo, task_repo, sentinel
+from pybossa.sched import Schedulers
+from pybossa.jobs import sync_ready_queues
+from pybossa.ready_queue import ReadyQueue, sync_project
+
+
+class TestReadyQueue(sched.Helper):
+
+    def setUp(self):
+        super(TestReadyQueue, self).setUp()
+        self.queue = ReadyQueue(sentinel.master)
+
+    def all_ids(self, project_id, gold_first=False):
+        return [task_id for window in
+                self.queue.windows(project_id, gold_first, 2)
+                for task_id in window]
+
+    def test_score_orders_by_priority_then_id(self):
+        assert ReadyQueue.score(2, 0.9) < ReadyQueue.score(1, 0.1)
+        assert ReadyQueue.score(1, 0.5) < ReadyQueue.score(2, 0.5)
+
+    @with_context_settings(SCHED_READY_QUEUE=True)
+    def test_windows_order(self):
+        self.queue.rebuild(1, [(1, 0.1, 0), (2, 0.9, 0), (3, 0.5, 1),
+                               (4, 0.5, 0)])
+        assert self.all_ids(1) == [2, 4, 1, 3], self.all_ids(1)
+        assert self.all_ids(1, gold_first=True) == [3, 2, 4, 1]
+
+    @with_context_settings(SCHED_READY_QUEUE=True)
+    def test_sync_project_skips_completed_tasks(self):
+        project = ProjectFactory.create()
+        ongoing = TaskFactory.create(project=project)
+        TaskFactory.create(project=project, state='completed')
+
+        assert sync_project(project.id) == 1
+        assert self.queue.is_synced(project.id)
+        assert self.all_ids(project.id) == [ongoing.id]
+
+    @with_context_settings(SCHED_READY_QUEUE=True)
+    def test_task_events_keep_queue_in_sync(self):
+        project = ProjectFactory.create()
+        task = TaskFactory.create(project=project)
+        sync_project(project.id)
+        new_task = TaskFactory.create(project=project)
+        assert self.all_ids(project.id) == [task.id, new_task.id]
+
+        task.state = u'completed'
+        task_repo.update(task)
+        assert self.all_ids(project.id) == [new_task.id]
+
+        task_repo.delete(new_task)
+        assert self.all_ids(project.id) == []
+
+    @with_context_settings(SCHED_READY_QUEUE=True)
+    def test_bulk_update_invalidates_queue(self):
+        project = ProjectFactory.create()
+        TaskFactory.create(project=project)
+        sync_project(project.id)
+
+        task_repo.update_priority(project.id, 0.5, {})
+
+        assert not self.queue.is_synced(project.id)
+
+    @with_context_settings(SCHED_READY_QUEUE=True)
+    @patch('pybossa.jobs.enqueue_job')
+    def test_locked_sched_requests_sync(self, enqueue_job):
+        project = ProjectFactory.create()
+        project.info['sched'] = Schedulers.locked
+        project_repo.save(project)
+        task = TaskFactory.create(project=project, n_answers=1)
+        user = UserFactory.create()
+
+        self.set_proj_passwd_cookie(project, user)
+        res = self.app.get('api/project/{}/newtask?api_key={}'
+                           .format(project.id, user.api_key))
+        assert json.loads(res.data)['id'] == task.id, res.data
+        assert not self.queue.is_synced(project.id)
+        job = enqueue_job.call_args[0][0]
+        assert job['name'] is sync_ready_queues, job
+        assert job['args'] == [[project.id]], job
+
+        self.app.get('api/project/{}/newtask?api_key={}'
+                     .format(project.id, user.api_key))
+        assert enqueue_job.call_count == 1, enqueue_job.call_count
+        sync_ready_queues(*job['args'])
+        assert self.queue.is_synced(project.id)
+        assert self.queue.request_sync(project.id)
+
+    @with_context_settings(SCHED_READY_QUEUE=True)
+    def test_locked_sched_uses_ready_queue(self):
+        owner = UserFactory.create(id=500)
+        user = UserFactory.create(id=501)
+        project = ProjectFactory.create(owner=owner)
+        project.info['sched'] = Schedulers.locked
+        project_repo.save(project)
+        task1 = TaskFactory.create(project=project, info='task 1', n_answers=1)
+        task2 = TaskFactory.create(project=project, info='task 2', n_answers=1)
+        sync_project(project.id)
+
+        self.set_proj_passwd_cookie(project, user)
+        res = self.app.get('api/project/{}/newtask?api_key={}'
+                           .format(project.id, user.api_key))
+        rec_task1 = json.loads(res.data)
+
+        res = self.app.get('api/project/{}/newtask?api_key={}'
+                           .format(project.id, owner.api_key))
+        rec_task2 = json.loads(res.data)
+
+        assert rec_task1['id'] == task1.id, rec_task1
+        assert rec_task2['id'] == task2.id, rec_task2
+
+        task_run = dict(project_id=project.id, task_id=task1.id, info='hi')
+        res = self.app.post('api/taskrun?api_key={}'.format(user.api_key),
+                            data=json.dumps(task_run))
+        assert res.status_code == 200, res.data
+        assert self.all_ids(project.id) == [task2.id]
@@ -612,6 +612,33 @@ class TestTaskRepositorySaveDeleteUpdate(Test):
         assert_raises(WrongObjectError, self.task_repo.save, bad_object)
 
 
+    @with_context
+    def test_save_many_skips_duplicates(self):
+        """Test save_many inserts the new tasks with their counters and
+        task_stats, skipping the ones already in the project or the batch"""
+
+        project = ProjectFactory.create()
+        TaskFactory.create(project=project, info={'q': 0})
+        tasks = [Task(project_id=project.id, info={'q': q}, n_answers=2)
+                 for q in [0, 1, 2, 1]]
+        tasks[2].priority_0 = u'0.5'
+        tasks[2].gold_answers = {u'q': u'ñ'}
+
+        assert self.task_repo.save_many(project, tasks) == 2
+
+        saved = self.task_repo.filter_tasks_by(project_id=project.id)
+        new = sorted((t for t in saved if t.info['q']), key=lambda t: t.id)
+        assert [t.info for t in new] == [{'q': 1}, {'q': 2}], new
+        assert new[0].n_answers == 2 and new[0].state == 'ongoing'
+        assert new[1].priority_0 == 0.5, new[1].priority_0
+        assert new[1].gold_answers == {u'q': u'ñ'}, new[1].gold_answers
+        for table in ('counter', 'task_stats'):
+            count = db.session.execute(
+                'SELECT COUNT(*) FROM %s WHERE project_id=%d'
+                % (table, project.id)).scalar()
+            assert count == 3, (table, count)
+
+
     @with_context
     def test_update_task(self):
         """Test update persists the changes made to Task instances"""
@@ -762,6 +789,34 @@ class TestTaskRepositorySaveDeleteUpdate(Test):
         assert non_deleted[0].id == taskrun.id, err_msg
 
 
+    @with_context
+    def test_delete_tasks_in_batches_with_filters(self):
+        """Test delete_tasks_in_batches deletes the tasks matching the filters
+        with their results, one batch at a time"""
+
+        project = ProjectFactory.create()
+        kept = TaskFactory.create_batch(2, project=project, priority_0=0.1)
+        tasks = TaskFactory.create_batch(3, project=project, priority_0=0.9,
+                                         n_answers=1)
+        TaskRunFactory.create(task=tasks[1])
+        progress = []
+
+        with patch.dict(self.flask_app.config, {'BULK_DELETE_BATCH_SIZE': 2}):
+            n = self.task_repo.delete_tasks_in_batches(
+                project.id, force_reset=True,
+                filters=dict(priority_from=0.5), progress=progress.append)
+
+        assert n == 3, n
+        assert progress == [2, 3], progress
+        remaining = self.task_repo.filter_tasks_by(project_id=project.id)
+        assert sorted(t.id for t in remaining) == [t.id for t in kept]
+        for table in ('result', 'task_run', 'counter', 'task_stats'):
+            ids = [row[0] for row in db.session.execute(
+                'SELECT DISTINCT task_id FROM %s WHERE project_id=%d'
+                % (table, project.id))]
+            assert set(ids) <= set(t.id for t in kept), (table, ids)
+
+
     @with_context
     def test_delete_taskruns_from_project_deletes_taskruns(self):
         task = TaskFactory.create()
@@ -855,3 +910,27 @@ class TestTaskRepositorySaveDeleteUpdate(Test):
 
         for task in tasks:
             assert task.state == 'completed', task.state
+
+
+    @with_context
+    def test_update_tasks_redundancy_of_selected_tasks(self):
+        """Test update_tasks_redundancy with task_ids only updates those tasks
+        and reports the completed ones with files"""
+
+        project = ProjectFactory.create()
+        tasks = TaskFactory.create_batch(4, project=project, n_answers=1)
+        tasks[3].info = {'file__upload_url': 'https://mybucket/test.pdf'}
+        self.task_repo.update(tasks[3])
+        TaskRunFactory.create(task=tasks[1])
+        TaskRunFactory.create(task=tasks[3])
+        task_ids = [tasks[0].id, tasks[1].id, tasks[3].id]
+
+        not_updated = self.task_repo.update_tasks_redundancy(
+            project, 2, task_ids=task_ids)
+        tasks = sorted(self.task_repo.filter_tasks_by(project_id=project.id),
+                       key=lambda t: t.id)
+
+        assert not_updated == str(tasks[3].id), not_updated
+        assert [t.n_answers for t in tasks] == [2, 2, 1, 1], tasks
+        assert [t.state for t in tasks] == ['ongoing', 'ongoing', 'ongoing',
+                                            'completed'], tasks
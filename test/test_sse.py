@@ -0,0 +1,93 @@
+# -*- coding: utf8 -*-
+# This file is part of PYBOSSA.
+#
+# Copyright (C) 2018 Scifabric LTD.
+#
+# PYBOSSA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# PYBOSSA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with PYBOSSA.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+from mock import patch
+from default import Test, with_context
+from pybossa.core import sentinel
+from pybossa.sse import EventHub, HEARTBEAT, event_stream
+
+
+class TestEventHub(Test):
+
+    channel = 'channel_public_foo'
+
+    def setUp(self):
+        super(TestEventHub, self).setUp()
+        self.hub = EventHub()
+
+    def subscribers(self, n):
+        """Wait until n connections are subscribed to the channel."""
+        for i in range(100):
+            count = sentinel.master.execute_command('PUBSUB', 'NUMSUB',
+                                                    self.channel)[1]
+            if int(count) == n:
+                return True
+            time.sleep(0.01)
+        return False
+
+    @with_context
+    def test_fan_out(self):
+        """Test one subscription delivers the messages to every client"""
+        first = self.hub.subscribe(sentinel.master, self.channel, 10)
+        second = self.hub.subscribe(sentinel.master, self.channel, 10)
+        assert self.subscribers(1)
+
+        sentinel.master.publish(self.channel, 'foobar')
+
+        assert first.queue.get(timeout=1) == 'foobar'
+        assert second.queue.get(timeout=1) == 'foobar'
+
+    @with_context
+    def test_unsubscribe_last_client(self):
+        """Test the channel is unsubscribed with its last client"""
+        first = self.hub.subscribe(sentinel.master, self.channel, 10)
+        second = self.hub.subscribe(sentinel.master, self.channel, 10)
+        assert self.subscribers(1)
+
+        self.hub.unsubscribe(self.channel, first)
+        assert self.hub.channels() == set([self.channel])
+        self.hub.unsubscribe(self.channel, second)
+        assert self.hub.channels() == set()
+        assert self.subscribers(0)
+
+    @with_context
+    def test_slow_client_is_dropped(self):
+        """Test a client is dropped when its queue is full"""
+        slow = self.hub.subscribe(sentinel.master, self.channel, 1)
+        fast = self.hub.subscribe(sentinel.master, self.channel, 10)
+
+        self.hub.dispatch(self.channel, 'one')
+        self.hub.dispatch(self.channel, 'two')
+
+        assert slow.dropped
+        assert not fast.dropped
+        assert fast.queue.qsize() == 2
+
+    @with_context
+    def test_event_stream(self):
+        """Test event_stream sends messages and heartbeats"""
+        with patch('pybossa.sse.hub', self.hub):
+            stream = event_stream(sentinel.master, self.channel,
+                                  heartbeat=0.01)
+            assert next(stream) == HEARTBEAT
+            assert self.subscribers(1)
+            sentinel.master.publish(self.channel, 'foobar')
+            assert next(stream) == 'data: foobar\n\n'
+            stream.close()
+            assert self.hub.channels() == set()
@@ -74,6 +74,36 @@ class TestCloudUploader(Test):
         with patch.dict(self.flask_app.config, {'UPLOAD_BUCKET': 'testbucket'}):
             assert not u.upload_file(fs, 'cont')
 
+    @with_context
+    @patch('pybossa.uploader.cloud_store.CloudStoreUploader.MULTIPART_CHUNK_SIZE',
+           new=4)
+    @patch('pybossa.uploader.cloud_store.create_connection')
+    def test_cloud_uploader_multipart(self, create_connection):
+        mock_conn = MagicMock()
+        mock_bucket = MagicMock()
+        mock_upload = MagicMock()
+        mock_conn.get_bucket.return_value = mock_bucket
+        mock_bucket.initiate_multipart_upload.return_value = mock_upload
+        create_connection.return_value = mock_conn
+        parts = []
+        mock_upload.upload_part_from_file.side_effect = \
+            lambda fp, part_num: parts.append((part_num, fp.read()))
+
+        u = CloudStoreUploader()
+        fs = FileStorage(stream=StringIO(u'hello world'),
+                         filename='the_file.zip')
+        with patch.dict(self.flask_app.config, {
+                'UPLOAD_BUCKET': 'testbucket',
+                'S3_UPLOAD': self.conn_args
+            }):
+            assert u.upload_file(fs, 'cont')
+
+        mock_bucket.initiate_multipart_upload.assert_called_with(
+            u.key_name('cont', 'the_file.zip'), policy='public-read')
+        assert parts == [(1, 'hell'), (2, 'o wo'), (3, 'rld')], parts
+        assert mock_upload.complete_upload.called
+        assert not mock_bucket.get_key.called
+
     @with_context
     @patch('pybossa.uploader.cloud_store.create_connection')
     def test_cloud_uploader_delete(self, create_connection):
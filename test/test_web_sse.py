@@ -201,14 +201,12 @@ class TestWebSse(web.Helper):
         assert res.status_code == 200
         assert res.data == self.fake_sse_response, res.data
 
-    @patch('pybossa.view.projects.sentinel.master.pubsub')
-    def test_project_event_stream(self, mock_pubsub):
+    @with_context
+    @patch('pybossa.view.projects.event_stream')
+    def test_project_event_stream(self, mock_event_stream):
         """Test project_event_stream works."""
-        tmp = MagicMock()
-        def gen():
-            yield dict(data='foobar')
-        tmp.listen.return_value = gen()
-        mock_pubsub.return_value = tmp
-        res = project_event_stream('foo', 'public')
-        expected = 'data: %s\n\n' % 'foobar'
-        assert next(res) == expected, next(res)
+        with self.flask_app.test_request_context('/'):
+            project_event_stream('foo', 'public')
+        args = mock_event_stream.call_args[0]
+        assert args[1] == 'channel_public_foo', args
+        assert args[2:] == (15, 100), args